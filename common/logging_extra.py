@@ -40,7 +40,8 @@ class SwagFormatter(logging.Formatter):
       except (ValueError, TypeError):
         record_dict['msg'] = [record.msg]+record.args
 
-    record_dict['ctx'] = self.swaglogger.get_ctx()
+    # captured when the record was queued by an asynchronous handler
+    record_dict['ctx'] = record.swag_ctx if hasattr(record, 'swag_ctx') else self.swaglogger.get_ctx()
 
     if record.exc_info:
       record_dict['exc_info'] = self.formatException(record.exc_info)
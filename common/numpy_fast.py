@@ -1,3 +1,6 @@
+from bisect import bisect_left
+import numpy as np
+
 def int_rnd(x):
   return int(round(x))
 
@@ -5,12 +8,11 @@ def clip(x, lo, hi):
   return max(lo, min(hi, x))
 
 def interp(x, xp, fp):
+  """Like np.interp for increasing xp, x can be a scalar or an iterable (returns a list)"""
   N = len(xp)
 
   def get_interp(xv):
-    hi = 0
-    while hi < N and xv > xp[hi]:
-      hi += 1
+    hi = bisect_left(xp, xv)
     low = hi - 1
     return fp[-1] if hi == N and xv > xp[low] else (
       fp[0] if hi == 0 else
@@ -18,5 +20,50 @@ def interp(x, xp, fp):
 
   return [get_interp(v) for v in x] if hasattr(x, '__iter__') else get_interp(x)
 
+class Interpolator():
+  """interp with a fixed table. The breakpoint and value differences are computed once,
+  results are bit for bit the same as interp(x, xp, fp)."""
+  __slots__ = ('xp', 'fp', 'dxp', 'dfp', 'N', '_xp', '_fp', '_dxp', '_dfp')
+
+  def __init__(self, xp, fp):
+    assert len(xp) == len(fp) and len(xp) > 0
+    self.xp = list(xp)
+    self.fp = list(fp)
+    self.N = len(self.xp)
+    self.dxp = [self.xp[i + 1] - self.xp[i] for i in range(self.N - 1)]
+    self.dfp = [self.fp[i + 1] - self.fp[i] for i in range(self.N - 1)]
+    # contiguous float64 tables for batch()
+    self._xp = np.ascontiguousarray(self.xp, dtype=np.float64)
+    self._fp = np.ascontiguousarray(self.fp, dtype=np.float64)
+    self._dxp = np.ascontiguousarray(self.dxp, dtype=np.float64)
+    self._dfp = np.ascontiguousarray(self.dfp, dtype=np.float64)
+
+  def get(self, xv):
+    hi = bisect_left(self.xp, xv)
+    if hi == self.N:
+      return self.fp[-1]
+    if hi == 0:
+      return self.fp[0]
+    low = hi - 1
+    return (xv - self.xp[low]) * self.dfp[low] / self.dxp[low] + self.fp[low]
+
+  def __call__(self, x):
+    return [self.get(v) for v in x] if hasattr(x, '__iter__') else self.get(x)
+
+  def batch(self, x):
+    """Interpolates a whole array at once, returns a float64 array shaped like x"""
+    shape = np.shape(x)
+    x = np.asarray(x, dtype=np.float64).reshape(-1)
+    hi = np.searchsorted(self._xp, x, side='left')
+    hi[np.isnan(x)] = 0  # interp returns fp[0] for nan, searchsorted puts it at the end
+    if self.N == 1:
+      return np.full(shape, self._fp[0])
+    low = np.clip(hi - 1, 0, self.N - 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      y = (x - self._xp[low]) * self._dfp[low] / self._dxp[low] + self._fp[low]
+    y[hi == 0] = self._fp[0]
+    y[hi == self.N] = self._fp[-1]
+    return y.reshape(shape)
+
 def mean(x):
   return sum(x) / len(x)
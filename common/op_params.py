@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 import os
 import json
+import mmap
+import fcntl
+import atexit
+import struct
+import threading
 from common.travis_checker import travis
 from common.colors import opParams_error as error
 from common.colors import opParams_warning as warning
+from common.file_helpers import atomic_write_in_dir_neos
 try:
   from common.realtime import sec_since_boot
 except ImportError:
@@ -12,6 +18,87 @@ except ImportError:
   warning("Using python time.time() instead of faster sec_since_boot")
 
 
+PARAMS_FILE = '/data/op_params.json'
+BACKUP_FILE = '/data/op_params_corrupt.json'
+SNAPSHOT_FILE = '/data/op_params_snapshot'
+
+
+class ParamsSnapshot:
+  """
+    A compact copy of op_params.json in a fixed size, memory mapped file that every process maps.
+    The header holds a generation counter that is odd while the writer is updating the body (seqlock),
+    so readers can tell whether params changed with a single memory read and only parse on change,
+    once per process.
+    Writers are serialized with flock, and with a lock between the threads of a process which share one snapshot.
+  """
+  HEADER = struct.Struct('<8sQdI')  # magic, generation, mtime of op_params.json, body length
+  MAGIC = b'opparams'
+  SIZE = 64 * 1024
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o664)
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      if os.fstat(fd).st_size != self.SIZE:
+        os.ftruncate(fd, self.SIZE)
+      self._mm = mmap.mmap(fd, self.SIZE)
+      if self._mm[:len(self.MAGIC)] != self.MAGIC:
+        self._mm[:self.HEADER.size] = self.HEADER.pack(self.MAGIC, 0, 0., 0)
+    finally:
+      fcntl.flock(fd, fcntl.LOCK_UN)
+    self._fd = fd  # one per path and process, see get_snapshot
+    self._parsed = None  # (generation, mtime, params) of the last read
+
+  @property
+  def generation(self):
+    return struct.unpack_from('<Q', self._mm, 8)[0]
+
+  def read(self):
+    """Returns (generation, mtime, params) or None if nothing is published or a write is in progress"""
+    _, generation, mtime, length = self.HEADER.unpack_from(self._mm)
+    if generation == 0 or generation % 2:
+      return None
+    parsed = self._parsed
+    if parsed is not None and parsed[0] == generation:  # already parsed by this process
+      return generation, parsed[1], dict(parsed[2])
+    body = self._mm[self.HEADER.size:self.HEADER.size + length]
+    if self.generation != generation:  # changed while we were copying
+      return None
+    self._parsed = generation, mtime, json.loads(body)
+    return generation, mtime, dict(self._parsed[2])
+
+  def publish(self, params, mtime):
+    body = json.dumps(params, separators=(',', ':')).encode()
+    if self.HEADER.size + len(body) > self.SIZE:
+      return False
+    with self._lock:
+      fcntl.flock(self._fd, fcntl.LOCK_EX)
+      try:
+        generation = self.generation + (1 if self.generation % 2 == 0 else 0)  # odd: write in progress
+        struct.pack_into('<Q', self._mm, 8, generation)
+        self._mm[self.HEADER.size:self.HEADER.size + len(body)] = body
+        self._mm[:self.HEADER.size] = self.HEADER.pack(self.MAGIC, generation, mtime, len(body))
+        struct.pack_into('<Q', self._mm, 8, generation + 1)
+        self._parsed = generation + 1, mtime, dict(params)
+      finally:
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+    return True
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(path):
+  """The ParamsSnapshot of path shared by the process, opParams() is constructed in some update loops"""
+  with _snapshots_lock:
+    if path not in _snapshots:
+      _snapshots[path] = ParamsSnapshot(path)
+    return _snapshots[path]
+
+
 class ValueTypes:
   number = [float, int]
   none_or_number = [type(None), float, int]
@@ -119,9 +206,17 @@ class opParams:
                         'uniqueID': Param(None, [type(None), str], 'User\'s unique ID')
                        }
 
-    self._params_file = '/data/op_params.json'
-    self._backup_file = '/data/op_params_corrupt.json'
+    self._params_file = PARAMS_FILE
+    self._backup_file = BACKUP_FILE
     self._last_read_time = sec_since_boot()
+    self._mtime = None  # of the params file when we last parsed it
+    self._generation = None  # of the snapshot we last read
+    self._snapshot = None
+    self.write_delay = 0.5  # puts within this many seconds are written to disk together
+    self._write_lock = threading.RLock()
+    self._write_timer = None
+    self._dirty = False
+    self._flush_at_exit = False
     self.read_frequency = 2.5  # max frequency to read with self.get(...) (sec)
     self._to_delete = ['reset_integral', 'log_data']  # a list of params you want to delete (unused)
     self._run_init()  # restores, reads, and updates params
@@ -134,7 +229,19 @@ class opParams:
     if travis:
       return
 
-    if os.path.isfile(self._params_file):
+    try:
+      self._snapshot = get_snapshot(SNAPSHOT_FILE)
+    except (OSError, ValueError) as e:
+      warning("Can't open op_params snapshot, reading from {}: {}".format(self._params_file, e))
+    snapshot = self._snapshot.read() if self._snapshot is not None else None
+    mtime = self._get_mtime()
+
+    if snapshot is not None and mtime is not None and snapshot[1] == mtime:
+      # the file didn't change since it was published, no need to parse it. opParams() is constructed in some update loops
+      self._generation, self._mtime, self.params = snapshot
+      to_write = self._add_default_params()
+      to_write |= self._delete_old()
+    elif os.path.isfile(self._params_file):
       if self._read():
         to_write = self._add_default_params()  # if new default data has been added
         to_write |= self._delete_old()  # or if old params have been deleted
@@ -148,8 +255,9 @@ class opParams:
       to_write = True  # user's first time running a fork with op_params, write default params
 
     if to_write:
-      self._write()
-      os.chmod(self._params_file, 0o764)
+      self._write()  # also publishes
+    elif self._generation is None:  # first process after boot or the file was edited
+      self._publish()
 
   def get(self, key=None, force_live=False):  # any params you try to get MUST be in fork_params
     param_info = self.param_info(key)
@@ -167,16 +275,43 @@ class opParams:
     return param_info.default  # return default value because user's value of key is not in allowed_types to avoid crashing openpilot
 
   def put(self, key, value):
-    self._check_key_exists(key, 'put')
-    if not self.param_info(key).is_valid(value):
-      raise Exception('opParams: Tried to put a value of invalid type!')
-    self.params.update({key: value})
-    self._write()
+    self.put_many({key: value})
+
+  def put_many(self, params):
+    """Validates and updates several params, they are written to disk together after write_delay"""
+    for key, value in params.items():
+      self._check_key_exists(key, 'put')
+      if not self.param_info(key).is_valid(value):
+        raise Exception('opParams: Tried to put a value of invalid type!')
+    with self._write_lock:
+      self.params.update(params)
+      self._schedule_write()
 
   def delete(self, key):  # todo: might be obsolete. remove?
-    if key in self.params:
-      del self.params[key]
-      self._write()
+    with self._write_lock:
+      if key in self.params:
+        del self.params[key]
+        self._schedule_write()
+
+  def flush(self):
+    """Writes pending puts to disk now"""
+    with self._write_lock:
+      if self._write_timer is not None:
+        self._write_timer.cancel()
+        self._write_timer = None
+      if self._dirty:
+        self._dirty = False
+        self._write()
+
+  def _schedule_write(self):
+    self._dirty = True
+    if not self._flush_at_exit:
+      atexit.register(self.flush)
+      self._flush_at_exit = True
+    if self._write_timer is None:
+      self._write_timer = threading.Timer(self.write_delay, self.flush)
+      self._write_timer.daemon = True
+      self._write_timer.start()
 
   def param_info(self, key):
     if key in self.fork_params:
@@ -214,20 +349,47 @@ class opParams:
 
   def _update_params(self, param_info, force_live):
     if force_live or param_info.live:  # if is a live param, we want to get updates while openpilot is running
-      if not travis and sec_since_boot() - self._last_read_time >= self.read_frequency:  # make sure we aren't reading file too often
-        if self._read():
-          self._last_read_time = sec_since_boot()
+      if travis:
+        return
+      if self._dirty:  # don't overwrite our own pending puts
+        return
+      if self._snapshot is not None and self._snapshot.generation != self._generation:  # O(1), no syscalls
+        snapshot = self._snapshot.read()
+        if snapshot is not None:
+          self._generation, self._mtime, self.params = snapshot
+      if sec_since_boot() - self._last_read_time >= self.read_frequency:  # make sure we aren't checking the file too often
+        self._last_read_time = sec_since_boot()
+        # catch edits made to the file directly, only parse it if it changed
+        if self._get_mtime() != self._mtime and self._read():
+          self._publish()
+
+  def _get_mtime(self):
+    try:
+      return os.path.getmtime(self._params_file)
+    except OSError:
+      return None
 
   def _read(self):
     try:
+      mtime = self._get_mtime()
       with open(self._params_file, "r") as f:
         self.params = json.loads(f.read())
+      self._mtime = mtime
       return True
     except Exception as e:
       error(e)
       return False
 
+  def _publish(self):
+    if self._snapshot is not None and self._mtime is not None:
+      if self._snapshot.publish(self.params, self._mtime):
+        self._generation = self._snapshot.generation
+
   def _write(self):
     if not travis:
-      with open(self._params_file, "w") as f:
-        f.write(json.dumps(self.params, indent=2))  # can further speed it up by remove indentation but makes file hard to read
+      with self._write_lock:
+        # write to a temp file, fsync and rename so readers never see a half written file
+        contents = json.dumps(self.params, indent=2)  # can further speed it up by remove indentation but makes file hard to read
+        atomic_write_in_dir_neos(self._params_file, contents.encode(), mode=0o764)
+        self._mtime = self._get_mtime()
+        self._publish()
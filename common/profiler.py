@@ -1,45 +1,153 @@
 import time
+from bisect import bisect_right
+
+# log spaced histogram bins from 1 us to 10 s, 20 per decade (~12% wide)
+BINS_PER_DECADE = 20
+BIN_EDGES = [1e-6 * 10 ** (i / BINS_PER_DECADE) for i in range(7 * BINS_PER_DECADE + 1)]
+NUM_BINS = len(BIN_EDGES) + 1  # plus one below and one above the edges
+PUBLISH_INTERVAL = 5.  # seconds
+
+
+def bin_upper_edge(i):
+  return BIN_EDGES[min(i, len(BIN_EDGES) - 1)]
+
+
+def percentile(hist, count, q, max_time=float('inf')):
+  """Upper edge of the histogram bin holding the q-th percentile, at most max_time"""
+  if count == 0:
+    return 0.
+  target = q / 100. * count
+  seen = 0
+  for i, n in enumerate(hist):
+    seen += n
+    if seen >= target:
+      return min(bin_upper_edge(i), max_time)
+  return max_time
+
+
+class Checkpoint():
+  __slots__ = ('name', 'ignore', 'hist', 'count', 'total', 'max', 'tot')
+
+  def __init__(self, name, ignore):
+    self.name = name
+    self.ignore = ignore
+    self.tot = 0.  # since reset, for display
+    self.clear()
+
+  def clear(self):
+    self.hist = [0] * NUM_BINS
+    self.count = 0
+    self.total = 0.
+    self.max = 0.
+
+  def add(self, dt):
+    self.hist[bisect_right(BIN_EDGES, dt)] += 1
+    self.count += 1
+    self.total += dt
+    self.tot += dt
+    if dt > self.max:
+      self.max = dt
+
+  def percentile(self, q):
+    return percentile(self.hist, self.count, q, self.max)
+
 
 class Profiler():
-  def __init__(self, enabled=False):
-    self.enabled = enabled
-    self.cp = {}
-    self.cp_ignored = []
-    self.iter = 0
-    self.start_time = time.time()
-    self.last_time = self.start_time
-    self.tot = 0.
+  """Times the sections between checkpoints of a loop.
+
+  Every checkpoint keeps a fixed size histogram of its durations, so
+  percentiles are available without storing samples. With a process name
+  the histograms since the last publish are sent as <process>Profile every
+  publish_interval seconds from tick(), profiler_stats.py aggregates them
+  over processes. The clock is time.perf_counter, checkpoints cost about
+  a microsecond which is measured on start and published as overheadUs."""
+  def __init__(self, enabled=False, process=None, publish_interval=PUBLISH_INTERVAL):
+    self.process = process
+    self.publish_interval = publish_interval
+    self.pm = None
+    self.overhead = 0.
+    self.reset(enabled)
 
   def reset(self, enabled=False):
     self.enabled = enabled
     self.cp = {}
-    self.cp_ignored = []
     self.iter = 0
-    self.start_time = time.time()
+    self.window_iter = 0
+    self.start_time = time.perf_counter()
     self.last_time = self.start_time
+    self.last_publish = self.start_time
+    self.tot = 0.
+    if enabled and self.process is not None and self.pm is None:
+      import cereal.messaging_arne as messaging_arne
+      self.service = self.process + 'Profile'
+      self.pm = messaging_arne.PubMaster([self.service])
+      self.overhead = measure_overhead()
 
   def checkpoint(self, name, ignore=False):
     # ignore flag needed when benchmarking threads with ratekeeper
     if not self.enabled:
       return
-    tt = time.time()
-    if name not in self.cp:
-      self.cp[name] = 0.
-      if ignore:
-        self.cp_ignored.append(name)
-    self.cp[name] += tt - self.last_time
+    tt = time.perf_counter()
+    dt = tt - self.last_time
+    cp = self.cp.get(name)
+    if cp is None:
+      cp = self.cp[name] = Checkpoint(name, ignore)
+    cp.add(dt)
     if not ignore:
-      self.tot += tt - self.last_time
+      self.tot += dt
     self.last_time = tt
 
-  def display(self):
+  def tick(self):
+    """Ends an iteration of the loop, publishes if it is time to"""
     if not self.enabled:
       return
     self.iter += 1
+    self.window_iter += 1
+    if self.pm is not None and self.last_time - self.last_publish >= self.publish_interval:
+      self.publish()
+
+  def publish(self):
+    import cereal.messaging_arne as messaging_arne
+    dat = messaging_arne.new_message(self.service)
+    data = getattr(dat, self.service)
+    data.intervalSeconds = self.last_time - self.last_publish
+    data.iterations = self.window_iter
+    data.overheadUs = self.overhead * 1e6
+    checkpoints = data.init('checkpoints', len(self.cp))
+    for c, cp in zip(checkpoints, self.cp.values()):
+      c.name = cp.name
+      c.ignored = cp.ignore
+      c.count = cp.count
+      c.meanMs = cp.total / max(cp.count, 1) * 1e3
+      c.p50Ms = cp.percentile(50) * 1e3
+      c.p99Ms = cp.percentile(99) * 1e3
+      c.maxMs = cp.max * 1e3
+      c.histogram = cp.hist
+      cp.clear()
+    self.pm.send(self.service, dat)
+    self.window_iter = 0
+    self.last_publish = self.last_time
+
+  def display(self):
+    if not self.enabled:
+      return
+    self.tick()
     print("******* Profiling %d *******" % self.iter)
-    for n, ms in sorted(self.cp.items(), key=lambda x: -x[1]):
-      if n in self.cp_ignored:
-        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f   IGNORED" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
-      else:
-        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
+    for n, cp in sorted(self.cp.items(), key=lambda x: -x[1].tot):
+      ms = cp.tot
+      print("%30s: %9.2f  avg: %7.2f  p50: %7.2f  p99: %7.2f  max: %7.2f  percent: %3.0f%s" %
+            (n, ms*1000.0, ms*1000.0/self.iter, cp.percentile(50)*1000.0, cp.percentile(99)*1000.0, cp.max*1000.0,
+             ms/max(self.tot, 1e-9)*100, "   IGNORED" if cp.ignore else ""))
     print("Iter clock: %2.6f   TOTAL: %2.2f" % (self.tot/self.iter, self.tot))
+
+
+def measure_overhead(n=2000):
+  """Seconds a checkpoint costs, with a few checkpoints per iteration like the loops use"""
+  prof = Profiler(True)
+  names = ["a", "b", "c", "d"]
+  t = time.perf_counter()
+  for _ in range(n // len(names)):
+    for name in names:
+      prof.checkpoint(name)
+    prof.tick()
+  return (time.perf_counter() - t) / n
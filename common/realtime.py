@@ -3,6 +3,8 @@ import gc
 import os
 import time
 import multiprocessing
+import numpy as np
+from bisect import bisect_right
 
 from common.hardware import PC
 from common.common_pyx import sec_since_boot  # pylint: disable=no-name-in-module, import-error
@@ -37,9 +39,25 @@ def config_realtime_process(core, priority):
   set_core_affinity(core)
 
 
+RING_SIZE = 1024  # loop durations kept by Ratekeeper
+# Ratekeeper jitter histogram, bins of loop duration minus interval
+JITTER_BINS_MS = (-10., -5., -2., -1., -.5, -.1, .1, .5, 1., 2., 5., 10., 20., 50., 100.)
+# a loop longer than the interval by more than this missed its deadline, sleep overshoot doesn't count
+DEADLINE_MARGIN_MS = 1.
+
+
 class Ratekeeper():
-  def __init__(self, rate, print_delay_threshold=0.):
-    """Rate in Hz for ratekeeping. print_delay_threshold must be nonnegative."""
+  def __init__(self, rate, print_delay_threshold=0., summary_interval=None):
+    """Rate in Hz for ratekeeping. print_delay_threshold must be nonnegative.
+
+    Every loop duration goes into a ring of the last RING_SIZE ones and a
+    histogram of its jitter, loops that overran their interval are counted
+    as deadline misses. There is a single writer and readers take copies,
+    so no lock is needed. With
+    summary_interval (seconds) a ratekeeper_stats event with the stats since
+    the last one is logged, so loop timing can be read back from rlogs. Its
+    duration percentiles cover at most the last RING_SIZE loops of the
+    interval, the maximum covers all of them."""
     self._interval = 1. / rate
     self._next_frame_time = sec_since_boot() + self._interval
     self._print_delay_threshold = print_delay_threshold
@@ -47,6 +65,19 @@ class Ratekeeper():
     self._remaining = 0
     self._process_name = multiprocessing.current_process().name
 
+    self._durations = np.zeros(RING_SIZE)
+    self._num_durations = 0
+    self._last_frame_time = None
+    self._jitter_histogram = [0] * (len(JITTER_BINS_MS) + 1)
+    self._deadline_misses = 0
+    self._max_lag = 0.
+    self._summary_max_lag = 0.
+    self._summary_max_duration = 0.
+
+    self._summary_interval = summary_interval
+    self._next_summary_time = sec_since_boot() + summary_interval if summary_interval is not None else None
+    self._summary = (0, [0] * len(self._jitter_histogram), 0, 0)  # frame, jitter histogram, misses and durations at the last summary
+
   @property
   def frame(self):
     return self._frame
@@ -55,6 +86,43 @@ class Ratekeeper():
   def remaining(self):
     return self._remaining
 
+  @property
+  def deadline_misses(self):
+    """Loops that took longer than the interval plus DEADLINE_MARGIN_MS"""
+    return self._deadline_misses
+
+  @property
+  def max_lag(self):
+    return self._max_lag
+
+  @property
+  def jitter_histogram(self):
+    """Loop counts per bin of JITTER_BINS_MS, with one bin below and one above"""
+    return list(self._jitter_histogram)
+
+  def durations(self):
+    """The last RING_SIZE loop durations in seconds, oldest first"""
+    n = self._num_durations
+    durations = self._durations.copy()
+    if n <= RING_SIZE:
+      return durations[:n]
+    return np.roll(durations, -(n % RING_SIZE))
+
+  def stats(self, durations=None):
+    """Stats of all loops, the duration percentiles and maximum are of durations, by default the last RING_SIZE loops"""
+    if durations is None:
+      durations = self.durations()
+    p50, p99, dmax = np.percentile(durations, [50, 99, 100]) * 1e3 if len(durations) else (0., 0., 0.)
+    return {
+      'frames': self._frame,
+      'deadline_misses': self._deadline_misses,
+      'max_lag_ms': self._max_lag * 1e3,
+      'duration_p50_ms': p50,
+      'duration_p99_ms': p99,
+      'duration_max_ms': dmax,
+      'jitter_histogram': self.jitter_histogram,
+    }
+
   # Maintain loop rate by calling this at the end of each loop
   def keep_time(self):
     lagged = self.monitor_time()
@@ -65,11 +133,48 @@ class Ratekeeper():
   # this only monitor the cumulative lag, but does not enforce a rate
   def monitor_time(self):
     lagged = False
-    remaining = self._next_frame_time - sec_since_boot()
+    t = sec_since_boot()
+    remaining = self._next_frame_time - t
     self._next_frame_time += self._interval
     if self._print_delay_threshold is not None and remaining < -self._print_delay_threshold:
       print("%s lagging by %.2f ms" % (self._process_name, -remaining * 1000))
       lagged = True
+
+    if self._last_frame_time is not None:
+      duration = t - self._last_frame_time
+      self._durations[self._num_durations % RING_SIZE] = duration
+      self._num_durations += 1
+      self._summary_max_duration = max(self._summary_max_duration, duration)
+      jitter_ms = (duration - self._interval) * 1e3
+      self._jitter_histogram[bisect_right(JITTER_BINS_MS, jitter_ms)] += 1
+      # per loop, the lag behind _next_frame_time stays after a stall and drifts with the CAN clock
+      if jitter_ms > DEADLINE_MARGIN_MS:
+        self._deadline_misses += 1
+    self._last_frame_time = t
+    if remaining < 0:
+      self._max_lag = max(self._max_lag, -remaining)
+      self._summary_max_lag = max(self._summary_max_lag, -remaining)
+
     self._frame += 1
     self._remaining = remaining
+    if self._next_summary_time is not None and t >= self._next_summary_time:
+      self._log_summary()
+      self._next_summary_time = t + self._summary_interval
     return lagged
+
+  def _log_summary(self):
+    from selfdrive.swaglog import cloudlog
+    frame, histogram, misses, num_durations = self._summary
+    n = min(self._num_durations - num_durations, RING_SIZE)
+    durations = self.durations()
+    stats = self.stats(durations[len(durations) - n:])
+    stats['frames'] -= frame
+    stats['deadline_misses'] -= misses
+    stats['max_lag_ms'] = self._summary_max_lag * 1e3
+    stats['duration_max_ms'] = self._summary_max_duration * 1e3
+    stats['jitter_histogram'] = [n - m for n, m in zip(self._jitter_histogram, histogram)]
+    cloudlog.event("ratekeeper_stats", process=self._process_name, rate=1. / self._interval, **stats)
+    self._summary = (self._frame, self.jitter_histogram, self._deadline_misses, self._num_durations)
+    self._summary_max_lag = 0.
+    self._summary_max_duration = 0.
+    self._summary_max_duration = 0.
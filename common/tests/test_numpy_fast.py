@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import math
+import unittest
+import numpy as np
+
+from common.numpy_fast import interp, Interpolator
+
+
+def interp_linear(x, xp, fp):
+  # linear scan interp this module used before, the reference for bit exactness
+  N = len(xp)
+
+  def get_interp(xv):
+    hi = 0
+    while hi < N and xv > xp[hi]:
+      hi += 1
+    low = hi - 1
+    return fp[-1] if hi == N and xv > xp[low] else (
+      fp[0] if hi == 0 else
+      (xv - xp[low]) * (fp[hi] - fp[low]) / (xp[hi] - xp[low]) + fp[low])
+
+  return [get_interp(v) for v in x] if hasattr(x, '__iter__') else get_interp(x)
+
+
+def same(a, b):
+  return type(a) == type(b) and (a == b or (math.isnan(a) and math.isnan(b)))
+
+
+class TestInterp(unittest.TestCase):
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.tables = [([0., 5., 10., 20., 40.], [-.5, -.5, -.5, -.5, -.5]),
+                   ([0.], [1.]),
+                   ([0, 1, 2], [0, 10, 20]),
+                   ([0., 1., 1., 2.], [0., 1., 2., 3.]),  # duplicate breakpoint
+                   ([-2.6822, -1.7882, -0.8941, -0.447, -0.2235, 0.0, 0.2235, 0.447, 0.8941, 1.7882, 2.6822],
+                    [0.3245, 0.277, 0.11075, 0.08106, 0.06325, 0.0, -0.09, -0.09375, -0.125, -0.3, -0.35])]
+    for n in (2, 3, 13, 64):
+      self.tables.append((list(np.sort(rng.uniform(-50, 50, n))), list(rng.uniform(-5, 5, n))))
+    self.xs = [float('nan'), float('inf'), -float('inf'), -100., 100., 0, 1, 1.0, 2]
+    self.xs += list(rng.uniform(-60, 60, 500))
+    for xp, _ in self.tables:
+      self.xs += list(xp)
+
+  def test_interp(self):
+    for xp, fp in self.tables:
+      for x in self.xs:
+        self.assertTrue(same(interp(x, xp, fp), interp_linear(x, xp, fp)), (x, xp, fp))
+      self.assertEqual(interp(self.xs[3:], xp, fp), interp_linear(self.xs[3:], xp, fp))
+
+  def test_interpolator(self):
+    for xp, fp in self.tables:
+      f = Interpolator(xp, fp)
+      for x in self.xs:
+        self.assertTrue(same(f(x), interp_linear(x, xp, fp)), (x, xp, fp))
+
+  def test_batch(self):
+    for xp, fp in self.tables:
+      xp, fp = [float(v) for v in xp], [float(v) for v in fp]
+      f = Interpolator(xp, fp)
+      xs = np.array(self.xs, dtype=np.float64)
+      expected = np.array(interp_linear(xs.tolist(), xp, fp))
+      np.testing.assert_array_equal(f.batch(xs), expected)
+      np.testing.assert_array_equal(f.batch(xs.reshape(-1, 1)), expected.reshape(-1, 1))
+      self.assertEqual(f.batch(self.xs[-1]), expected[-1])
+
+
+if __name__ == "__main__":
+  unittest.main()
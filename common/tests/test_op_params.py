@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import common.op_params as op_params_module
+from common.op_params import opParams
+
+
+class TestOpParams(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.params_file = os.path.join(self.tmpdir, 'op_params.json')
+    self.patches = [mock.patch.object(op_params_module, 'travis', False),
+                    mock.patch.object(op_params_module, 'PARAMS_FILE', self.params_file),
+                    mock.patch.object(op_params_module, 'BACKUP_FILE', os.path.join(self.tmpdir, 'op_params_corrupt.json')),
+                    mock.patch.object(op_params_module, 'SNAPSHOT_FILE', os.path.join(self.tmpdir, 'op_params_snapshot'))]
+    for p in self.patches:
+      p.start()
+
+  def tearDown(self):
+    for p in self.patches:
+      p.stop()
+    shutil.rmtree(self.tmpdir)
+
+  def test_defaults_written(self):
+    op_params = opParams()
+    with open(self.params_file) as f:
+      self.assertEqual(json.load(f)['camera_offset'], 0.06)
+    self.assertEqual(op_params.get('camera_offset'), 0.06)
+
+  def test_live_update_through_snapshot(self):
+    writer, reader = opParams(), opParams()
+    writer.put('camera_offset', 0.1)
+    writer.flush()
+    with mock.patch.object(reader, '_read', wraps=reader._read) as read:
+      self.assertEqual(reader.get('camera_offset'), 0.1)
+      self.assertEqual(reader.get('camera_offset'), 0.1)
+      read.assert_not_called()  # the json file is never parsed by readers
+
+  def test_unchanged_file_not_parsed(self):
+    reader = opParams()
+    reader.read_frequency = 0.
+    with mock.patch.object(reader, '_read', wraps=reader._read) as read:
+      for _ in range(10):
+        reader.get('camera_offset')
+      read.assert_not_called()
+
+  def test_construction_uses_snapshot(self):
+    opParams()
+    with mock.patch.object(opParams, '_read') as read, \
+         mock.patch.object(op_params_module.json, 'loads', wraps=json.loads) as loads:
+      for _ in range(10):
+        self.assertEqual(opParams().get('camera_offset'), 0.06)
+      read.assert_not_called()
+      loads.assert_not_called()
+
+  def test_external_edit(self):
+    reader, other = opParams(), opParams()
+    reader.read_frequency = 0.
+    with open(self.params_file) as f:
+      params = json.load(f)
+    params['camera_offset'] = 0.2
+    with open(self.params_file, 'w') as f:
+      json.dump(params, f)
+    os.utime(self.params_file, (0, 0))  # make sure the mtime changes
+    self.assertEqual(reader.get('camera_offset'), 0.2)
+    # the reader republished the edit for everyone else
+    self.assertEqual(other.get('camera_offset'), 0.2)
+
+  def test_put_many_single_write(self):
+    op_params = opParams()
+    with mock.patch.object(op_params, '_write', wraps=op_params._write) as write:
+      op_params.put_many({'camera_offset': 0.1, 'speed_offset': 2})
+      op_params.put('camera_offset', 0.12)
+      op_params.flush()
+      op_params.flush()
+      self.assertEqual(write.call_count, 1)
+    with open(self.params_file) as f:
+      params = json.load(f)
+    self.assertEqual((params['camera_offset'], params['speed_offset']), (0.12, 2))
+    self.assertFalse([f for f in os.listdir(self.tmpdir) if f.startswith('.tmp')])
+
+  def test_put_many_validates_all(self):
+    op_params = opParams()
+    with self.assertRaises(Exception):
+      op_params.put_many({'camera_offset': 0.1, 'osm': 'yes'})
+    self.assertEqual(op_params.get('camera_offset'), 0.06)
+
+  def test_debounced_write(self):
+    op_params = opParams()
+    op_params.write_delay = 0.2
+    op_params.put('speed_offset', 0)
+    timer = op_params._write_timer
+    for i in range(1, 20):
+      op_params.put('speed_offset', i)
+    self.assertIs(op_params._write_timer, timer)
+    timer.join()
+    with open(self.params_file) as f:
+      self.assertEqual(json.load(f)['speed_offset'], 19)
+
+  def test_no_descriptor_leak(self):
+    fd_dir = '/proc/self/fd'
+    opParams()
+    open_fds = len(os.listdir(fd_dir))
+    op_params = [opParams() for _ in range(200)]
+    self.assertEqual(len(os.listdir(fd_dir)), open_fds)
+    self.assertIs(op_params[0]._snapshot, op_params[-1]._snapshot)
+
+  def test_corrupt_file_backed_up(self):
+    with open(self.params_file, 'w') as f:
+      f.write('{"camera_offset": ')
+    op_params = opParams()
+    self.assertTrue(os.path.isfile(op_params_module.BACKUP_FILE))
+    self.assertEqual(op_params.get('camera_offset'), 0.06)
+
+
+if __name__ == "__main__":
+  unittest.main()
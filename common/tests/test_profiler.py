@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import unittest
+
+from common.profiler import Profiler, Checkpoint, BINS_PER_DECADE, measure_overhead
+
+BIN_WIDTH = 10 ** (1 / BINS_PER_DECADE)
+
+
+class TestProfiler(unittest.TestCase):
+  def test_percentiles(self):
+    cp = Checkpoint("test", False)
+    samples = [i * 1e-5 for i in range(1, 1001)]  # 10 us to 10 ms
+    for dt in reversed(samples):
+      cp.add(dt)
+
+    self.assertEqual(cp.count, len(samples))
+    self.assertEqual(cp.max, samples[-1])
+    self.assertAlmostEqual(cp.total, sum(samples))
+    for q in (1, 50, 99):
+      exact = samples[int(q / 100 * len(samples)) - 1]
+      self.assertGreaterEqual(cp.percentile(q), exact)
+      self.assertLessEqual(cp.percentile(q), exact * BIN_WIDTH)
+    self.assertEqual(cp.percentile(100), samples[-1])
+
+  def test_checkpoints(self):
+    prof = Profiler(True)
+    for _ in range(10):
+      prof.checkpoint("wait", ignore=True)
+      prof.checkpoint("work")
+      prof.tick()
+    self.assertEqual(prof.iter, 10)
+    self.assertEqual(prof.cp["work"].count, 10)
+    self.assertTrue(prof.cp["wait"].ignore)
+    self.assertAlmostEqual(prof.tot, prof.cp["work"].tot)
+
+    prof.reset()
+    prof.checkpoint("work")
+    self.assertEqual(prof.cp, {})
+
+  def test_overhead(self):
+    # loops call a handful of checkpoints per iteration at up to 100 Hz
+    self.assertLess(min(measure_overhead() for _ in range(3)), 5e-6)
+
+
+if __name__ == "__main__":
+  unittest.main()
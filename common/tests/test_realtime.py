@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+import numpy as np
+
+import common.realtime as realtime
+from common.realtime import Ratekeeper, RING_SIZE, JITTER_BINS_MS
+
+
+class FakeClock():
+  def __init__(self):
+    self.t = 100.
+
+  def __call__(self):
+    return self.t
+
+
+class TestRatekeeper(unittest.TestCase):
+  def setUp(self):
+    self.clock = FakeClock()
+    patcher = mock.patch.object(realtime, 'sec_since_boot', self.clock)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def run_loops(self, rk, durations):
+    for d in durations:
+      self.clock.t += d
+      rk.monitor_time()
+
+  def test_durations_and_misses(self):
+    rk = Ratekeeper(100, print_delay_threshold=None)
+    durations = [0.01] * 50 + [0.025] + [0.01] * (RING_SIZE + 10)
+    self.run_loops(rk, durations)
+
+    # the first call has no previous frame to measure against
+    np.testing.assert_allclose(rk.durations(), durations[-RING_SIZE:])
+    self.assertEqual(len(rk.durations()), RING_SIZE)
+    # the 25 ms loop is 15 ms late and stays behind schedule from then on,
+    # but the loops after it are on time
+    self.assertEqual(rk.deadline_misses, 1)
+    self.assertAlmostEqual(rk.max_lag, 0.015)
+
+    hist = rk.jitter_histogram
+    self.assertEqual(sum(hist), len(durations) - 1)
+    self.assertEqual(hist[JITTER_BINS_MS.index(20.)], 1)  # 10 to 20 ms
+
+  def test_drift_is_not_a_miss(self):
+    rk = Ratekeeper(100, print_delay_threshold=None)
+    # a CAN paced loop slightly slower than its nominal rate
+    self.run_loops(rk, [0.0102] * 500)
+    self.assertEqual(rk.deadline_misses, 0)
+
+  def test_summary(self):
+    rk = Ratekeeper(100, print_delay_threshold=None, summary_interval=1.)
+    with mock.patch('selfdrive.swaglog.cloudlog') as cloudlog:
+      self.run_loops(rk, [0.01] * 250)
+    events = [c for c in cloudlog.event.call_args_list if c[0][0] == "ratekeeper_stats"]
+    self.assertEqual(len(events), 2)
+    self.assertEqual(events[1][1]['frames'], 100)
+    self.assertEqual(sum(events[1][1]['jitter_histogram']), 100)
+    self.assertAlmostEqual(events[1][1]['duration_p50_ms'], 10.)
+
+  def test_summary_covers_interval(self):
+    rk = Ratekeeper(100, print_delay_threshold=None, summary_interval=20.)
+    with mock.patch('selfdrive.swaglog.cloudlog') as cloudlog:
+      # a slow loop early in the first interval, further back than the ring reaches
+      self.run_loops(rk, [0.01] * 10 + [0.05] + [0.01] * 2000 + [0.02] * 1500)
+    events = [c[1] for c in cloudlog.event.call_args_list if c[0][0] == "ratekeeper_stats"]
+    self.assertEqual(len(events), 2)
+    self.assertAlmostEqual(events[0]['duration_max_ms'], 50.)
+    self.assertAlmostEqual(events[1]['duration_max_ms'], 20.)
+    self.assertAlmostEqual(events[1]['duration_p50_ms'], 20.)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Satellite info per second of get_sat_info one call at a time against
+get_sat_info_batch, for every satellite every interval seconds of a day.
+
+The ephemerides come from RINEX nav and sp3 files, or are downloaded for
+--date like AstroDog does."""
+import argparse
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+
+from laika.downloader import download_nav, download_orbits
+from laika.ephemeris import parse_rinex_nav_msg_gps, parse_rinex_nav_msg_glonass, parse_sp3_orbits, \
+                            get_sat_info_batch
+from laika.gps_time import GPSTime
+from laika.helpers import get_closest
+
+
+def load_ephems(args):
+  ephems = {}
+  if args.date:
+    day = GPSTime.from_datetime(datetime.strptime(args.date, "%Y-%m-%d"))
+    args.nav_gps = args.nav_gps or download_nav(day, args.cache_dir, 'GPS')
+    args.nav_glonass = args.nav_glonass or download_nav(day, args.cache_dir, 'GLONASS')
+    args.sp3 = args.sp3 or download_orbits(day, args.cache_dir)
+  if args.nav_gps or args.nav_glonass:
+    ephems['nav'] = ((parse_rinex_nav_msg_gps(args.nav_gps) if args.nav_gps else []) +
+                     (parse_rinex_nav_msg_glonass(args.nav_glonass) if args.nav_glonass else []))
+  if args.sp3:
+    ephems['sp3'] = parse_sp3_orbits(args.sp3, ['GPS', 'GLONASS'])
+  return ephems
+
+
+def sample(ephems, interval):
+  """The (ephemeris, time) pairs of every satellite every interval seconds
+  over the day in the middle of the ephemerides, picked like AstroDog does"""
+  by_prn = defaultdict(list)
+  for eph in ephems:
+    by_prn[eph.prn].append(eph)
+  # sp3 files of the days around are parsed too
+  start = sorted(eph.epoch for eph in ephems)[len(ephems) // 2]
+  start = GPSTime(start.week, start.tow - start.tow % 86400)
+
+  rows = []
+  for t in np.arange(0, 86400, interval):
+    t = start + float(t)
+    for prn_ephems in by_prn.values():
+      eph = get_closest(t, prn_ephems)
+      if eph is not None and eph.valid(t) and eph.healthy:
+        rows.append((eph, t))
+  return rows
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--date", help="day to download, YYYY-MM-DD")
+  parser.add_argument("--nav-gps", help="RINEX GPS nav file")
+  parser.add_argument("--nav-glonass", help="RINEX GLONASS nav file")
+  parser.add_argument("--sp3", nargs="*", help="sp3 orbit files")
+  parser.add_argument("--interval", type=float, default=30., help="seconds between evaluations")
+  parser.add_argument("--cache-dir", default="/tmp/gnss/")
+  args = parser.parse_args()
+
+  for source, ephems in load_ephems(args).items():
+    rows = sample(ephems, args.interval)
+    ephs = [eph for eph, _ in rows]
+    weeks = np.array([t.week for _, t in rows], dtype=np.float64)
+    tows = np.array([t.tow for _, t in rows], dtype=np.float64)
+
+    t = time.monotonic()
+    single = [eph.get_sat_info(t) for eph, t in rows]
+    single_time = time.monotonic() - t
+
+    t = time.monotonic()
+    pos, vel, clock_err, _ = get_sat_info_batch(ephs, weeks, tows)
+    batch_time = time.monotonic() - t
+
+    pos_err = max(np.abs(pos[i] - s[0]).max() for i, s in enumerate(single))
+    clock_diff = max(abs(clock_err[i] - s[2]) for i, s in enumerate(single))
+    print("%s: %d evaluations of %d ephemerides" % (source, len(rows), len(set(map(id, ephs)))))
+    print("  get_sat_info        %8.3f s  %10.0f /s" % (single_time, len(rows) / single_time))
+    print("  get_sat_info_batch  %8.3f s  %10.0f /s  (%.1fx)" % (batch_time, len(rows) / batch_time,
+                                                                 single_time / batch_time))
+    print("  max difference: position %.2e m, clock %.2e s" % (pos_err, clock_diff))
+
+
+if __name__ == "__main__":
+  main()
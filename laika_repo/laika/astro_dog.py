@@ -1,8 +1,10 @@
 from collections import defaultdict
 
+import numpy as np
+
 from .helpers import get_constellation, get_closest, get_el_az, TimeRangeHolder
 from .ephemeris import parse_sp3_orbits, parse_rinex_nav_msg_gps, \
-                       parse_rinex_nav_msg_glonass
+                       parse_rinex_nav_msg_glonass, get_sat_info_batch
 from .downloader import download_orbits, download_orbits_russia, download_nav, download_ionex, download_dcb
 from .downloader import download_cors_station
 from .trop import saast
@@ -293,6 +295,25 @@ class AstroDog(object):
     else:
       return None
 
+  def get_sat_info_batch(self, prns, times):
+    '''
+    get_sat_info for every (prns[i], times[i]) at once, times are GPSTimes.
+    The ephemerides are looked up per row and evaluated together.
+
+    returns:
+    positions (n, 3), velocities (n, 3), clock errors (n,) and clock error
+    rates (n,), all nan for rows get_sat_info returns None for
+    '''
+    ephems = []
+    for prn, time in zip(prns, times):
+      if get_constellation(prn) not in self.valid_const:
+        ephems.append(None)
+      elif self.pull_orbit:
+        ephems.append(self.get_orbit(prn, time))
+      else:
+        ephems.append(self.get_nav(prn, time))
+    return get_sat_info_batch(ephems, [t.week for t in times], [t.tow for t in times])
+
   def get_all_sat_info(self, time):
     if self.pull_orbit:
       ephs = self.get_orbits(time)
@@ -343,11 +364,15 @@ class AstroDog(object):
       else:
         raise NotImplementedError('Dont know this GLONASS frequency: ', signal, prn)
 
-  def get_delay(self, prn, time, rcv_pos, no_dgps=False, signal='C1C', freq=None):
-    sat_info = self.get_sat_info(prn, time)
-    if sat_info is None:
+  def get_delay(self, prn, time, rcv_pos, no_dgps=False, signal='C1C', freq=None, sat_pos=None):
+    # sat_pos at time can be passed in when it's already known, nan if it isn't available
+    if sat_pos is None:
+      sat_info = self.get_sat_info(prn, time)
+      if sat_info is None:
+        return None
+      sat_pos = sat_info[0]
+    elif np.isnan(sat_pos).any():
       return None
-    sat_pos = sat_info[0]
     el, az = get_el_az(rcv_pos, sat_pos)
     if el < 0.2:
       return None
@@ -1,9 +1,10 @@
 import numpy as np
+from collections import defaultdict
 from datetime import datetime
 from math import sin, cos, sqrt, fabs, atan2
 
 from .gps_time import GPSTime, utc_to_gpst
-from .constants import SPEED_OF_LIGHT, SECS_IN_MIN, SECS_IN_HR, SECS_IN_DAY, EARTH_ROTATION_RATE, EARTH_GM
+from .constants import SPEED_OF_LIGHT, SECS_IN_MIN, SECS_IN_HR, SECS_IN_DAY, SECS_IN_WEEK, EARTH_ROTATION_RATE, EARTH_GM
 from .helpers import get_constellation
 
 
@@ -89,25 +90,6 @@ class GLONASSEphemeris(Ephemeris):
     clock_err = eph['min_tauN'] + tdiff * (eph['GammaN'])
     clock_rate_err = eph['GammaN']
 
-    def glonass_diff_eq(state, acc):
-      J2 = 1.0826257e-3
-      mu = 3.9860044e14
-      omega = 7.292115e-5
-      ae = 6378136.0
-      r = np.sqrt(state[0]**2 + state[1]**2 + state[2]**2)
-      ders = np.zeros(6)
-      if r**2 < 0:
-        return ders
-      a = 1.5 * J2 * mu * (ae**2)/ (r**5)
-      b = 5 * (state[2]**2) / (r**2)
-      c = -mu/(r**3) - a*(1-b)
-
-      ders[0:3] = state[3:6]
-      ders[3] = (c + omega**2)*state[0] + 2*omega*state[4] + acc[0]
-      ders[4] = (c + omega**2)*state[1] - 2*omega*state[3] + acc[1]
-      ders[5] = (c - 2*a)*state[2] + acc[2]
-      return ders
-
     init_state = np.empty(6)
     init_state[0] = eph['x']
     init_state[1] = eph['y']
@@ -137,6 +119,55 @@ class GLONASSEphemeris(Ephemeris):
     vel = state[3:6]
     return pos, vel, clock_err, clock_rate_err
 
+  @staticmethod
+  def get_sat_info_batch(ephems, weeks, tows):
+    # same RK4 integration as get_sat_info, every row takes its own steps
+    # towards its time and rows that got there already take steps of 0
+    unique, inverse = unique_ephems(ephems)
+    toc = [utc_to_gpst(eph.data['toc']) for eph in unique]
+    tdiff = seconds_since(weeks, tows, toc, inverse)
+
+    min_tau, gamma = ephem_params(unique, inverse, 'min_tauN', 'GammaN')
+    clock_err = min_tau + tdiff * gamma
+    clock_rate_err = gamma
+
+    state = 1000*np.column_stack(ephem_params(unique, inverse, 'x', 'y', 'z', 'x_vel', 'y_vel', 'z_vel'))
+    acc = 1000*np.column_stack(ephem_params(unique, inverse, 'x_acc', 'y_acc', 'z_acc'))
+    tstep = 90
+    while True:
+      active = np.abs(tdiff) > 1e-9
+      if not active.any():
+        break
+      tt = np.where(active, np.sign(tdiff) * np.minimum(np.abs(tdiff), tstep), 0.)[:, None]
+      k1 = glonass_diff_eq(state, acc)
+      k2 = glonass_diff_eq(state + k1*tt/2, -acc)
+      k3 = glonass_diff_eq(state + k2*tt/2, -acc)
+      k4 = glonass_diff_eq(state + k3*tt, -acc)
+      state += (k1 + 2*k2 + 2*k3 + k4)*tt/6.0
+      tdiff = tdiff - tt[:, 0]
+
+    return state[:, 0:3], state[:, 3:6], clock_err, clock_rate_err
+
+
+def glonass_diff_eq(state, acc):
+  # state and acc have the components in their last axis, this works on
+  # a single state as well as on rows of them
+  J2 = 1.0826257e-3
+  mu = 3.9860044e14
+  omega = 7.292115e-5
+  ae = 6378136.0
+  r = np.sqrt(state[..., 0]**2 + state[..., 1]**2 + state[..., 2]**2)
+  ders = np.zeros(state.shape)
+  a = 1.5 * J2 * mu * (ae**2)/ (r**5)
+  b = 5 * (state[..., 2]**2) / (r**2)
+  c = -mu/(r**3) - a*(1-b)
+
+  ders[..., 0:3] = state[..., 3:6]
+  ders[..., 3] = (c + omega**2)*state[..., 0] + 2*omega*state[..., 4] + acc[..., 0]
+  ders[..., 4] = (c + omega**2)*state[..., 1] - 2*omega*state[..., 3] + acc[..., 1]
+  ders[..., 5] = (c - 2*a)*state[..., 2] + acc[..., 2]
+  return ders
+
 
 class PolyEphemeris(Ephemeris):
   def __init__(self, prn, data, epoch, healthy=True, eph_type=None, tgd=0):
@@ -165,6 +196,28 @@ class PolyEphemeris(Ephemeris):
     time_err_with_rel = time_err - 2*np.inner(sat_pos, sat_vel)/SPEED_OF_LIGHT**2
     return sat_pos, sat_vel, time_err_with_rel, time_err_rate
 
+  @staticmethod
+  def get_sat_info_batch(ephems, weeks, tows):
+    unique, inverse = unique_ephems(ephems)
+    dt = seconds_since(weeks, tows, [eph.data['t0'] for eph in unique], inverse)
+
+    def poly(key, deg_key):
+      # coefficients by power, padded to the highest degree of the batch
+      coefs = [np.asarray(eph.data[key], dtype=np.float64)[::-1] for eph in unique]
+      deg = max(eph.data[deg_key] for eph in unique)
+      coefs = np.array([np.pad(c, (0, deg + 1 - len(c))) for c in coefs])[inverse]
+      powers = np.arange(deg + 1)
+      val = np.sum(dt[:, None]**powers * coefs, axis=1)
+      rate = np.sum(powers[1:] * dt[:, None]**powers[:-1] * coefs[:, 1:], axis=1)
+      return val, rate
+
+    (x, vx), (y, vy), (z, vz) = poly('x', 'deg'), poly('y', 'deg'), poly('z', 'deg')
+    sat_pos = np.column_stack((x, y, z))
+    sat_vel = np.column_stack((vx, vy, vz))
+    time_err, time_err_rate = poly('clock', 'deg_t')
+    time_err_with_rel = time_err - 2*np.sum(sat_pos * sat_vel, axis=1)/SPEED_OF_LIGHT**2
+    return sat_pos, sat_vel, time_err_with_rel, time_err_rate
+
 
 class GPSEphemeris(Ephemeris):
   def __init__(self, data, epoch, healthy=True):
@@ -261,6 +314,125 @@ class GPSEphemeris(Ephemeris):
 
     return pos, vel, clock_err, clock_rate_err
 
+  @staticmethod
+  def get_sat_info_batch(ephems, weeks, tows):
+    # get_sat_info on arrays, see there for the steps
+    unique, inverse = unique_ephems(ephems)
+    (af0, af1, af2, sqrta, dn, m0, ecc, w, cus, cuc, crc, crs, cic, cis,
+     inc0, inc_dot0, omegadot, omega0) = ephem_params(unique, inverse, 'af0', 'af1', 'af2', 'sqrta', 'dn', 'm0', 'ecc', 'w',
+                                                      'cus', 'cuc', 'crc', 'crs', 'cic', 'cis', 'inc', 'inc_dot',
+                                                      'omegadot', 'omega0')
+    toe = [eph.data['toe'] for eph in unique]
+    toe_tow = np.array([t.tow for t in toe], dtype=np.float64)[inverse]
+
+    tdiff = seconds_since(weeks, tows, [eph.data['toc'] for eph in unique], inverse)
+    clock_err = af0 + tdiff * (af1 + tdiff * af2)
+    clock_rate_err = af1 + 2 * tdiff * af2
+
+    tdiff = seconds_since(weeks, tows, toe, inverse)
+    a = sqrta * sqrta
+    ma_dot = np.sqrt(EARTH_GM / (a * a * a)) + dn
+    ma = m0 + ma_dot * tdiff
+
+    # Newton iterations until the slowest row converged
+    ea = ma
+    ea_old = np.full_like(ma, 2222)
+    tempd1 = np.ones_like(ma)
+    while True:
+      iterating = np.abs(ea - ea_old) > 1.0E-14
+      if not iterating.any():
+        break
+      ea_old = np.where(iterating, ea, ea_old)
+      tempd1 = np.where(iterating, 1.0 - ecc * np.cos(ea_old), tempd1)
+      ea = np.where(iterating, ea + (ma - ea_old + ecc * np.sin(ea_old)) / tempd1, ea)
+    ea_dot = ma_dot / tempd1
+
+    einstein = -4.442807633E-10 * ecc * sqrta * np.sin(ea)
+
+    tempd2 = np.sqrt(1.0 - ecc * ecc)
+    al = np.arctan2(tempd2 * np.sin(ea), np.cos(ea) - ecc) + w
+    al_dot = tempd2 * ea_dot / tempd1
+    sin2al, cos2al = np.sin(2.0 * al), np.cos(2.0 * al)
+
+    cal = al + cus * sin2al + cuc * cos2al
+    cal_dot = al_dot * (1.0 + 2.0 * (cus * cos2al - cuc * sin2al))
+
+    r = a * tempd1 + crc * cos2al + crs * sin2al
+    r_dot = (a * ecc * np.sin(ea) * ea_dot +
+             2.0 * al_dot * (crs * cos2al - crc * sin2al))
+
+    inc = inc0 + inc_dot0 * tdiff + cic * cos2al + cis * sin2al
+    inc_dot = inc_dot0 + 2.0 * al_dot * (cis * cos2al - cic * sin2al)
+
+    x = r * np.cos(cal)
+    y = r * np.sin(cal)
+    x_dot = r_dot * np.cos(cal) - y * cal_dot
+    y_dot = r_dot * np.sin(cal) + x * cal_dot
+
+    om_dot = omegadot - EARTH_ROTATION_RATE
+    om = omega0 + tdiff * om_dot - EARTH_ROTATION_RATE * toe_tow
+    sin_om, cos_om = np.sin(om), np.cos(om)
+    sin_inc, cos_inc = np.sin(inc), np.cos(inc)
+
+    pos = np.column_stack((x * cos_om - y * cos_inc * sin_om,
+                           x * sin_om + y * cos_inc * cos_om,
+                           y * sin_inc))
+
+    tempd3 = y_dot * cos_inc - y * sin_inc * inc_dot
+    vel = np.column_stack((-om_dot * pos[:, 1] + x_dot * cos_om - tempd3 * sin_om,
+                           om_dot * pos[:, 0] + x_dot * sin_om + tempd3 * cos_om,
+                           y * cos_inc * inc_dot + y_dot * sin_inc))
+
+    return pos, vel, clock_err + einstein, clock_rate_err
+
+
+def unique_ephems(ephems):
+  # the batches mostly hold a few ephemerides many times, their
+  # parameters are gathered once and spread out with the inverse index
+  index = {}
+  inverse = np.array([index.setdefault(id(eph), len(index)) for eph in ephems], dtype=np.intp)
+  unique = list({id(eph): eph for eph in ephems}.values())
+  return unique, inverse
+
+
+def ephem_params(unique, inverse, *keys):
+  return [np.array([eph.data[key] for eph in unique], dtype=np.float64)[inverse] for key in keys]
+
+
+def seconds_since(weeks, tows, times, inverse):
+  # like GPSTime.__sub__, row wise from times[inverse] to (weeks, tows)
+  ref_weeks = np.array([t.week for t in times], dtype=np.float64)[inverse]
+  ref_tows = np.array([t.tow for t in times], dtype=np.float64)[inverse]
+  return (weeks - ref_weeks)*SECS_IN_WEEK + tows - ref_tows
+
+
+def get_sat_info_batch(ephems, weeks, tows):
+  '''
+  Evaluates ephems[i] at the GPS time (weeks[i], tows[i]) for every i in
+  vectorized numpy, ephemerides of different types can be mixed.
+
+  returns:
+  positions (n, 3), velocities (n, 3), clock errors (n,) and clock error
+  rates (n,), all nan for rows with a missing or unhealthy ephemeris
+  '''
+  n = len(ephems)
+  weeks = np.asarray(weeks, dtype=np.float64)
+  tows = np.asarray(tows, dtype=np.float64)
+  pos = np.full((n, 3), np.nan)
+  vel = np.full((n, 3), np.nan)
+  clock_err = np.full(n, np.nan)
+  clock_rate_err = np.full(n, np.nan)
+
+  rows_by_type = defaultdict(list)
+  for i, eph in enumerate(ephems):
+    if eph is not None and eph.healthy:
+      rows_by_type[type(eph)].append(i)
+  for eph_type, rows in rows_by_type.items():
+    rows = np.array(rows, dtype=np.intp)
+    sat_info = eph_type.get_sat_info_batch([ephems[i] for i in rows], weeks[rows], tows[rows])
+    pos[rows], vel[rows], clock_err[rows], clock_rate_err[rows] = sat_info
+  return pos, vel, clock_err, clock_rate_err
+
 
 def parse_sp3_orbits(file_names, SUPPORTED_CONSTELLATIONS):
   ephems = []
@@ -87,10 +87,11 @@ class GNSSMeasurement(object):
       self.processed = True
       return True
 
-  def correct(self, est_pos, dog):
+  def correct(self, est_pos, dog, recv_sat_pos=None):
+    # recv_sat_pos is the satellite position at the receive time, if it's already known
     for obs in self.observables:
       if obs[0] == 'C':  # or obs[0] == 'L':
-        delay = dog.get_delay(self.prn, self.recv_time, est_pos, signal=obs)
+        delay = dog.get_delay(self.prn, self.recv_time, est_pos, signal=obs, sat_pos=recv_sat_pos)
         if delay:
           self.observables_final[obs] = (self.observables[obs] +
                                          self.sat_clock_err*constants.SPEED_OF_LIGHT -
@@ -125,17 +126,27 @@ class GNSSMeasurement(object):
 
 
 def process_measurements(measurements, dog=None):
+  # same as GNSSMeasurement.process, with the sat info of all measurements evaluated at once
+  sat_times = [meas.recv_time - meas.observables['C1C']/constants.SPEED_OF_LIGHT for meas in measurements]
+  sat_pos, sat_vel, sat_clock_err, _ = dog.get_sat_info_batch([meas.prn for meas in measurements], sat_times)
   proc_measurements = []
-  for meas in measurements:
-    if meas.process(dog):
+  for i, meas in enumerate(measurements):
+    if not np.isnan(sat_clock_err[i]):
+      meas.sat_pos = sat_pos[i]
+      meas.sat_vel = sat_vel[i]
+      meas.sat_clock_err = sat_clock_err[i]
+      meas.processed = True
       proc_measurements.append(meas)
   return proc_measurements
 
 
 def correct_measurements(measurements, est_pos, dog=None):
+  # the delays need the satellite positions at receive time, those are evaluated at once
+  recv_sat_pos = dog.get_sat_info_batch([meas.prn for meas in measurements],
+                                        [meas.recv_time for meas in measurements])[0]
   corrected_measurements = []
-  for meas in measurements:
-    if meas.correct(est_pos, dog):
+  for meas, sat_pos in zip(measurements, recv_sat_pos):
+    if meas.correct(est_pos, dog, recv_sat_pos=sat_pos):
       corrected_measurements.append(meas)
   return corrected_measurements
 
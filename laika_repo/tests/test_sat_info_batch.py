@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from laika.ephemeris import GPSEphemeris, GLONASSEphemeris, PolyEphemeris, EphemerisType, get_sat_info_batch
+from laika.gps_time import GPSTime
+
+epoch = GPSTime(2086, 345600.0)
+
+gps_data = {'prn': 1, 'toc': epoch, 'toe': epoch, 'af0': -1.2e-4, 'af1': -3.4e-12, 'af2': 0.0,
+            'sqrta': 5153.65, 'dn': 4.5e-9, 'm0': 1.1, 'ecc': 8.7e-3, 'w': 0.85,
+            'cus': 7.6e-6, 'cuc': 2.1e-7, 'crc': 221.0, 'crs': 3.8, 'cic': -3.2e-8, 'cis': 1.1e-7,
+            'inc': 0.96, 'inc_dot': -1.6e-10, 'omegadot': -8.1e-9, 'omega0': -1.9, 'tgd': 5.1e-9}
+
+glonass_data = {'prn': 'R08', 'toc': epoch - 18, 'min_tauN': 1.3e-5, 'GammaN': 9.1e-13, 'freq_num': 6,
+                'x': -11458.4, 'y': 13876.2, 'z': 18024.3, 'x_vel': 1.63, 'y_vel': -1.92, 'z_vel': 2.31,
+                'x_acc': 9.3e-10, 'y_acc': -1.9e-9, 'z_acc': -2.8e-9}
+
+
+def poly_ephem(deg):
+  data = {'t0': epoch, 'deg': deg, 'deg_t': 1, 'clock': [2.1e-12, -1.4e-4]}
+  for i, axis in enumerate(['x', 'y', 'z']):
+    # highest power first, a few km/s with terms getting smaller with the power
+    data[axis] = [(-1)**p * (i + 2) * 10.**(3 - 4*p) for p in range(deg, 0, -1)] + [2.6e7 / (i + 2)]
+  return PolyEphemeris('G%02i' % deg, data, epoch, eph_type=EphemerisType.RAPID_ORBIT)
+
+
+class TestSatInfoBatch(unittest.TestCase):
+  def setUp(self):
+    second_gps = dict(gps_data, prn=2, m0=-2.3, omega0=0.4, toe=epoch + 7200, toc=epoch + 7200)
+    self.ephems = [GPSEphemeris(gps_data, epoch), GPSEphemeris(second_gps, epoch + 7200),
+                   GLONASSEphemeris(glonass_data, epoch), poly_ephem(3), poly_ephem(5)]
+    self.offsets = [-3900.5, -271.0, 0.0, 45.25, 180.0, 1799.9, 7000.0]
+
+  def test_matches_get_sat_info(self):
+    ephems = [eph for eph in self.ephems for _ in self.offsets]
+    times = [eph.epoch + offset for eph in self.ephems for offset in self.offsets]
+    pos, vel, clock_err, clock_rate_err = get_sat_info_batch(ephems, [t.week for t in times], [t.tow for t in times])
+
+    for i, (eph, time) in enumerate(zip(ephems, times)):
+      sat_info = eph.get_sat_info(time)
+      np.testing.assert_allclose(pos[i], sat_info[0], rtol=0, atol=1e-6)
+      np.testing.assert_allclose(vel[i], sat_info[1], rtol=0, atol=1e-9)
+      np.testing.assert_allclose(clock_err[i], sat_info[2], rtol=0, atol=1e-15)
+      np.testing.assert_allclose(clock_rate_err[i], sat_info[3], rtol=0, atol=1e-18)
+
+  def test_missing_and_unhealthy(self):
+    unhealthy = GPSEphemeris(gps_data, epoch, healthy=False)
+    ephems = [None, unhealthy, self.ephems[0]]
+    pos, vel, clock_err, clock_rate_err = get_sat_info_batch(ephems, [epoch.week] * 3, [epoch.tow] * 3)
+
+    self.assertTrue(np.isnan(pos[:2]).all() and np.isnan(vel[:2]).all())
+    self.assertTrue(np.isnan(clock_err[:2]).all() and np.isnan(clock_rate_err[:2]).all())
+    np.testing.assert_allclose(pos[2], self.ephems[0].get_sat_info(epoch)[0], rtol=0, atol=1e-6)
+
+    empty = get_sat_info_batch([], [], [])
+    self.assertEqual(empty[0].shape, (0, 3))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -36,6 +36,8 @@ public:
   uint8_t counter;
   uint8_t counter_fail;
 
+  bool updated;
+
   bool parse(uint64_t sec, uint16_t ts_, uint8_t * dat);
   bool update_counter_generic(int64_t v, int cnt_size);
 };
@@ -56,8 +58,13 @@ public:
             const std::vector<SignalParseOptions> &sigoptions);
   void UpdateCans(uint64_t sec, const capnp::List<cereal::CanData>::Reader& cans);
   void UpdateValid(uint64_t sec);
-  void update_string(std::string data, bool sendcan);
+  void update_string(const std::string &data, bool sendcan);
   std::vector<SignalValue> query_latest();
+
+  // Batched interface: the signals of all messages are kept in the order of query_all
+  int update_strings(const std::vector<std::string> &data, bool sendcan);
+  std::vector<SignalValue> query_all();
+  void query_states(SignalState *states);
 };
 
 class CANPacker {
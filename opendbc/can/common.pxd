@@ -65,6 +65,11 @@ cdef extern from "common_dbc.h":
     const char* name
     double value
 
+  cdef struct SignalState:
+    double value
+    uint16_t ts
+    bool updated
+
   cdef struct SignalPackValue:
     const char * name
     double value
@@ -78,6 +83,9 @@ cdef extern from "common.h":
     CANParser(int, string, vector[MessageParseOptions], vector[SignalParseOptions])
     void update_string(string, bool)
     vector[SignalValue] query_latest()
+    int update_strings(vector[string], bool)
+    vector[SignalValue] query_all()
+    void query_states(SignalState *)
 
   cdef cppclass CANPacker:
    CANPacker(string)
@@ -29,6 +29,13 @@ struct SignalValue {
   double value;
 };
 
+// Latest value of a signal, written by CANParser::query_states in a fixed order
+struct SignalState {
+  double value;
+  uint16_t ts;
+  bool updated;  // the message was parsed during the last update_strings
+};
+
 enum SignalType {
   DEFAULT,
   HONDA_CHECKSUM,
@@ -82,6 +82,7 @@ bool MessageState::parse(uint64_t sec, uint16_t ts_, uint8_t * dat) {
   }
   ts = ts_;
   seen = sec;
+  updated = true;
 
   return true;
 }
@@ -208,7 +209,7 @@ void CANParser::UpdateValid(uint64_t sec) {
   }
 }
 
-void CANParser::update_string(std::string data, bool sendcan) {
+void CANParser::update_string(const std::string &data, bool sendcan) {
   // format for board, make copy due to alignment issues, will be freed on out of scope
   auto amsg = kj::heapArray<capnp::word>((data.length() / sizeof(capnp::word)) + 1);
   memcpy(amsg.begin(), data.data(), data.length());
@@ -246,3 +247,49 @@ std::vector<SignalValue> CANParser::query_latest() {
 
   return ret;
 }
+
+// Parses a batch of Event strings, returns the number of trailing updates after which can wasn't valid
+int CANParser::update_strings(const std::vector<std::string> &data, bool sendcan) {
+  for (auto& kv : message_states) {
+    kv.second.updated = false;
+  }
+
+  int invalid_cnt = 0;
+  for (const auto& d : data) {
+    update_string(d, sendcan);
+    invalid_cnt = can_valid ? 0 : invalid_cnt + 1;
+  }
+  return invalid_cnt;
+}
+
+// Every tracked signal, in the order query_states writes them
+std::vector<SignalValue> CANParser::query_all() {
+  std::vector<SignalValue> ret;
+
+  for (const auto& kv : message_states) {
+    const auto& state = kv.second;
+    for (int i=0; i<state.parse_sigs.size(); i++) {
+      ret.push_back((SignalValue){
+        .address = state.address,
+        .ts = state.ts,
+        .name = state.parse_sigs[i].name,
+        .value = state.vals[i],
+      });
+    }
+  }
+
+  return ret;
+}
+
+void CANParser::query_states(SignalState *states) {
+  for (const auto& kv : message_states) {
+    const auto& state = kv.second;
+    for (int i=0; i<state.vals.size(); i++) {
+      *states++ = (SignalState){
+        .value = state.vals[i],
+        .ts = state.ts,
+        .updated = state.updated,
+      };
+    }
+  }
+}
@@ -4,34 +4,52 @@
 from libcpp.string cimport string
 from libcpp.vector cimport vector
 from libcpp.unordered_set cimport unordered_set
-from libc.stdint cimport uint32_t, uint64_t, uint16_t
+from libc.stdint cimport uint32_t, uint64_t, uint16_t, uint8_t, uintptr_t
 from libcpp.map cimport map
 from libcpp cimport bool
 
 from common cimport CANParser as cpp_CANParser
-from common cimport SignalParseOptions, MessageParseOptions, dbc_lookup, SignalValue, DBC
+from common cimport SignalParseOptions, MessageParseOptions, dbc_lookup, SignalValue, SignalState, DBC
 
 import os
 import numbers
 from collections import defaultdict
+import numpy as np
 
 cdef int CAN_INVALID_CNT = 5
 
+# memory layout of SignalState
+SIGNAL_STATE_DTYPE = np.dtype([('value', np.float64), ('ts', np.uint16), ('updated', np.bool_)], align=True)
+
 cdef class CANParser:
+  """
+  Parses the can messages of Event strings with the DBC.
+
+  Every tracked signal has a fixed index (signal_index[(address or message name, signal name)])
+  into the signals array, which holds the latest value, ts and whether the message was updated
+  by the last update_strings call. The vl and ts dicts are only brought up to date on access.
+  """
   cdef:
     cpp_CANParser *can
     const DBC *dbc
     map[string, uint32_t] msg_name_to_address
     map[uint32_t, string] address_to_msg_name
-    vector[SignalValue] can_values
     bool test_mode_enabled
+    SignalState *states
+    int num_signals
+    vector[uint8_t] dirty  # updated since vl/ts were last synced
+    vector[int] msg_first_signal
+    list msg_addresses
+    list signal_dicts
+    dict _vl
+    dict _ts
 
   cdef readonly:
     string dbc_name
-    dict vl
-    dict ts
     bool can_valid
     int can_invalid_cnt
+    object signals
+    dict signal_index
 
   def __init__(self, dbc_name, signals, checks=None, bus=0):
     if checks is None:
@@ -41,8 +59,8 @@ cdef class CANParser:
     self.dbc = dbc_lookup(dbc_name)
     if not self.dbc:
       raise RuntimeError("Can't lookup" + dbc_name)
-    self.vl = {}
-    self.ts = {}
+    self._vl = {}
+    self._ts = {}
 
     self.can_invalid_cnt = CAN_INVALID_CNT
 
@@ -54,10 +72,10 @@ cdef class CANParser:
 
       self.msg_name_to_address[name] = msg.address
       self.address_to_msg_name[msg.address] = name
-      self.vl[msg.address] = {}
-      self.vl[name] = {}
-      self.ts[msg.address] = {}
-      self.ts[name] = {}
+      self._vl[msg.address] = {}
+      self._vl[name] = {}
+      self._ts[msg.address] = {}
+      self._ts[name] = {}
 
     # Convert message names into addresses
     for i in range(len(signals)):
@@ -93,48 +111,78 @@ cdef class CANParser:
       message_options_v.push_back(mpo)
 
     self.can = new cpp_CANParser(bus, dbc_name, message_options_v, signal_options_v)
-    self.update_vl()
+    self.init_signals()
 
-  cdef unordered_set[uint32_t] update_vl(self):
-    cdef string sig_name
-    cdef unordered_set[uint32_t] updated_val
+  cdef init_signals(self):
+    cdef vector[SignalValue] all_values = self.can.query_all()
+    self.num_signals = all_values.size()
+    self.signal_index = {}
+    self.signal_dicts = []
+    self.msg_addresses = []
 
-    can_values = self.can.query_latest()
-    valid = self.can.can_valid
-
-    # Update invalid flag
-    self.can_invalid_cnt += 1
-    if valid:
-        self.can_invalid_cnt = 0
-    self.can_valid = self.can_invalid_cnt < CAN_INVALID_CNT
-
-
-    for cv in can_values:
+    cdef int i
+    for i in range(self.num_signals):
+      cv = all_values[i]
       # Cast char * directly to unicode
       name = <unicode>self.address_to_msg_name[cv.address].c_str()
       cv_name = <unicode>cv.name
 
-      self.vl[cv.address][cv_name] = cv.value
-      self.ts[cv.address][cv_name] = cv.ts
+      self.signal_index[(cv.address, cv_name)] = i
+      self.signal_index[(name, cv_name)] = i
+      self.signal_dicts.append((cv_name, self._vl[cv.address], self._vl[name], self._ts[cv.address], self._ts[name]))
+      if i == 0 or cv.address != all_values[i - 1].address:
+        self.msg_first_signal.push_back(i)
+        self.msg_addresses.append(cv.address)
 
-      self.vl[name][cv_name] = cv.value
-      self.ts[name][cv_name] = cv.ts
+    self.signals = np.zeros(self.num_signals, dtype=SIGNAL_STATE_DTYPE)
+    assert self.signals.itemsize == sizeof(SignalState)
+    self.states = <SignalState *><uintptr_t>self.signals.ctypes.data
+    self.can.query_states(self.states)
+    self.dirty.assign(self.num_signals, 1)
 
-      updated_val.insert(cv.address)
-
-    return updated_val
+  cdef sync_vl(self):
+    cdef int i
+    for i in range(self.num_signals):
+      if self.dirty[i]:
+        name, vl_address, vl_name, ts_address, ts_name = self.signal_dicts[i]
+        vl_address[name] = vl_name[name] = self.states[i].value
+        ts_address[name] = ts_name[name] = self.states[i].ts
+        self.dirty[i] = 0
+
+  property vl:
+    def __get__(self):
+      self.sync_vl()
+      return self._vl
+
+  property ts:
+    def __get__(self):
+      self.sync_vl()
+      return self._ts
 
   def update_string(self, dat, sendcan=False):
-    self.can.update_string(dat, sendcan)
-    return self.update_vl()
+    return self.update_strings([dat], sendcan)
 
   def update_strings(self, strings, sendcan=False):
-    updated_vals = set()
+    cdef vector[string] data = strings
+    cdef int invalid_cnt = self.can.update_strings(data, sendcan)
+    self.can.query_states(self.states)
+
+    # Update invalid flag, counts up for every string after which can wasn't valid
+    if invalid_cnt < data.size():
+      self.can_invalid_cnt = invalid_cnt
+    else:
+      self.can_invalid_cnt += invalid_cnt
+    self.can_valid = self.can_invalid_cnt < CAN_INVALID_CNT
 
-    for s in strings:
-      updated_val = self.update_string(s, sendcan)
-      updated_vals.update(updated_val)
+    cdef int i
+    for i in range(self.num_signals):
+      if self.states[i].updated:
+        self.dirty[i] = 1
 
+    updated_vals = set()
+    for i in range(self.msg_first_signal.size()):
+      if self.states[self.msg_first_signal[i]].updated:
+        updated_vals.add(self.msg_addresses[i])
     return updated_vals
 
 cdef class CANDefine():
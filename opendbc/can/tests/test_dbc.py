@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+import os
+import unittest
+import numpy as np
+
+from opendbc import DBC_PATH
+from opendbc.can.dbc import dbc, can_rows
+
+DBCS = ["toyota_prius_2017_pt_generated", "honda_civic_touring_2016_can_generated",
+        "hyundai_kia_generic", "chrysler_pacifica_2017_hybrid"]
+
+
+class TestDecodeColumns(unittest.TestCase):
+  def test_matches_decode(self):
+    rng = np.random.RandomState(0)
+    for name in DBCS:
+      can_dbc = dbc(os.path.join(DBC_PATH, name + ".dbc"))
+      addresses = list(can_dbc.msgs.keys()) + [0x7ff]  # plus an unknown address
+      msgs = [(int(rng.choice(addresses)), int(rng.randint(3)), rng.bytes(rng.randint(1, 9))) for _ in range(3000)]
+      columns = can_dbc.decode_columns(can_rows(msgs))
+
+      decoded = set()
+      for msg_name, (address, idxs, signals) in columns.items():
+        self.assertTrue(np.all(np.diff(idxs) > 0))
+        for i, idx in enumerate(idxs):
+          expected_name, expected = can_dbc.decode(msgs[idx])
+          self.assertEqual(expected_name, msg_name)
+          self.assertEqual(expected, {k: v[i] for k, v in signals.items()})
+          decoded.add(idx)
+      self.assertEqual(decoded, {i for i, m in enumerate(msgs) if m[0] in can_dbc.msgs})
+
+  def test_bus_and_signal_filter(self):
+    can_dbc = dbc(os.path.join(DBC_PATH, "toyota_prius_2017_pt_generated.dbc"))
+    msg = ('STEER_ANGLE_SENSOR', {'STEER_ANGLE': -6.0, 'STEER_RATE': 4, 'STEER_FRACTION': -0.2})
+    dat = can_dbc.encode(*msg)
+    rows = can_rows([(0x25, 0, dat), (0x25, 1, dat), (0x25, 0, dat)])
+
+    columns = can_dbc.decode_columns(rows, bus=0, arr=['STEER_ANGLE'])
+    self.assertEqual(list(columns['STEER_ANGLE_SENSOR'].idxs), [0, 2])
+    self.assertEqual(list(columns['STEER_ANGLE_SENSOR'].signals), ['STEER_ANGLE'])
+    self.assertEqual(list(columns['STEER_ANGLE_SENSOR'].signals['STEER_ANGLE']), [-6.0, -6.0])
+
+
+if __name__ == "__main__":
+  unittest.main()
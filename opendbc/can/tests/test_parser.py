@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import unittest
+
+from opendbc.can.packer import CANPacker
+from opendbc.can.parser import CANParser
+from selfdrive.boardd.boardd import can_list_to_can_capnp
+
+DBC = "toyota_prius_2017_pt_generated"
+STEER_ADDR, BRAKE_ADDR = 37, 166
+
+
+class TestCANParser(unittest.TestCase):
+  def setUp(self):
+    self.packer = CANPacker(DBC)
+    signals = [("STEER_ANGLE", "STEER_ANGLE_SENSOR", 0), ("STEER_RATE", "STEER_ANGLE_SENSOR", 0),
+               ("BRAKE_PEDAL", "BRAKE", 0)]
+    self.parser = CANParser(DBC, signals, [], 0)
+
+  def steer(self, angle):
+    msg = self.packer.make_can_msg("STEER_ANGLE_SENSOR", 0, {"STEER_ANGLE": angle, "STEER_RATE": 2 * angle})
+    return can_list_to_can_capnp([msg])
+
+  def brake(self, pedal):
+    return can_list_to_can_capnp([self.packer.make_can_msg("BRAKE", 0, {"BRAKE_PEDAL": pedal})])
+
+  def value(self, msg, signal):
+    return self.parser.signals['value'][self.parser.signal_index[(msg, signal)]]
+
+  def test_signal_index(self):
+    for msg, addr in (("STEER_ANGLE_SENSOR", STEER_ADDR), ("BRAKE", BRAKE_ADDR)):
+      for signal in self.parser.vl[msg]:
+        self.assertEqual(self.parser.signal_index[(msg, signal)], self.parser.signal_index[(addr, signal)])
+    self.assertEqual(sorted(self.parser.signal_index.values()), sorted(list(range(3)) * 2))
+
+  def test_batch_keeps_last_value(self):
+    updated = self.parser.update_strings([self.steer(3.), self.steer(6.)])
+    self.assertEqual(updated, {STEER_ADDR})
+    self.assertEqual(self.value("STEER_ANGLE_SENSOR", "STEER_ANGLE"), 6.)
+    self.assertEqual(self.value(STEER_ADDR, "STEER_RATE"), 12.)
+
+    updated_flags = self.parser.signals['updated']
+    self.assertTrue(updated_flags[self.parser.signal_index[("STEER_ANGLE_SENSOR", "STEER_ANGLE")]])
+    self.assertFalse(updated_flags[self.parser.signal_index[("BRAKE", "BRAKE_PEDAL")]])
+
+  def test_vl_synced_on_access(self):
+    vl = self.parser.vl
+    self.parser.update_strings([self.steer(4.5)])
+    self.assertEqual(self.parser.vl["STEER_ANGLE_SENSOR"]["STEER_ANGLE"], 4.5)
+    self.parser.update_string(self.brake(20))
+    self.assertEqual(self.parser.vl["BRAKE"]["BRAKE_PEDAL"], 20)
+    self.assertEqual(self.parser.vl[BRAKE_ADDR]["BRAKE_PEDAL"], 20)
+
+    # untouched signals keep their values and the dicts are updated in place
+    self.assertEqual(self.parser.vl["STEER_ANGLE_SENSOR"]["STEER_ANGLE"], 4.5)
+    self.assertFalse(self.parser.signals['updated'][self.parser.signal_index[("STEER_ANGLE_SENSOR", "STEER_ANGLE")]])
+    self.assertIs(self.parser.vl, vl)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -174,8 +174,8 @@ class Controls:
       self.events.add(EventName.whitePandaUnsupported, static=True)
 
     # controlsd is driven by can recv, expected at 100Hz
-    self.rk = Ratekeeper(100, print_delay_threshold=None)
-    self.prof = Profiler(False)  # off by default
+    self.rk = Ratekeeper(100, print_delay_threshold=None, summary_interval=60.)
+    self.prof = Profiler(not travis, 'controlsd')
 
   def update_events(self, CS, CS_arne182):
     """Compute carEvents from carState"""
@@ -654,7 +654,7 @@ class Controls:
     while True:
       self.step()
       self.rk.monitor_time()
-      self.prof.display()
+      self.prof.tick()
 def send_params(a, b, c):
   params = Params()
   params.put("DistanceTraveled", a)
@@ -8,7 +8,7 @@ from common.numpy_fast import interp, clip
 from selfdrive.config import Conversions as CV
 from common.travis_checker import travis
 
-from selfdrive.controls.lib.dynamic_follow.auto_df import predict
+from selfdrive.controls.lib.dynamic_follow.auto_df import Predictor
 from selfdrive.controls.lib.dynamic_follow.df_manager import dfManager
 from selfdrive.controls.lib.dynamic_follow.support import LeadData, CarData, dfData, dfProfiles
 
@@ -31,6 +31,17 @@ class DynamicFollow:
     self.predict_rate = 1 / 4.
     self.skip_every = round(0.25 / mpc_rate)
     self.model_input_len = round(45 / mpc_rate)  # int: model input time
+    self.model_features = ['v_ego', 'v_lead', 'a_lead', 'x_lead']
+    self.predictor = Predictor()
+
+    # np.interp(x, model_scales[name], [0, 1]) for all features at once: (x - min) * scale, clipped
+    self._scale_min = np.array([self.model_scales[name][0] for name in self.model_features])
+    self._scale_mul = np.array([1. / (self.model_scales[name][1] - self.model_scales[name][0]) for name in self.model_features])
+    self._model_row = np.zeros(len(self.model_features))
+    # rows of the ring buffer the model sees, oldest first relative to the write position
+    self._model_sample_offsets = np.arange(0, self.model_input_len, self.skip_every)
+    self._model_sample_idxs = np.zeros_like(self._model_sample_offsets)
+    self._model_input = np.zeros((len(self._model_sample_offsets), len(self.model_features)), dtype=np.float32)
 
     # Dynamic follow variables
     self.default_TR = 1.8
@@ -56,7 +67,10 @@ class DynamicFollow:
 
     self.last_cost = 0.0
     self.last_predict_time = 0.0
-    self.auto_df_model_data = []
+    # ring buffer of normalized model features, auto_df_model_idx is the next row to write (the oldest once full)
+    self.auto_df_model_data = np.zeros((self.model_input_len, len(self.model_features)), dtype=np.float32)
+    self.auto_df_model_idx = 0
+    self.auto_df_model_len = 0
     self._get_live_params()  # so they're defined just in case
 
   def update(self, CS, libmpc):
@@ -83,10 +97,6 @@ class DynamicFollow:
     if df_out.is_auto:  # todo: find some way to share prediction between the two mpcs to reduce processing overhead
       self._get_pred()  # sets self.model_profile, all other checks are inside function
 
-  def _norm(self, x, name):
-    self.x = x
-    return np.interp(x, self.model_scales[name], [0, 1])
-
   def _send_cur_state(self):
     if self.mpc_id == 1 and self.pm is not None:
       dat = messaging_arne.new_message()
@@ -117,22 +127,35 @@ class DynamicFollow:
     self.df_data.v_egos = self._remove_old_entries(self.df_data.v_egos, cur_time, self.v_ego_retention)
     self.df_data.v_egos.append({'v_ego': self.car_data.v_ego, 'time': cur_time})
 
-    # Store data for auto-df model
-    self.auto_df_model_data.append([self._norm(self.car_data.v_ego, 'v_ego'),
-                                    self._norm(self.lead_data.v_lead, 'v_lead'),
-                                    self._norm(self.lead_data.a_lead, 'a_lead'),
-                                    self._norm(self.lead_data.x_lead, 'x_lead')])
-    while len(self.auto_df_model_data) > self.model_input_len:
-      del self.auto_df_model_data[0]
+    self._store_model_data()
+
+  def _store_model_data(self):
+    """Writes the normalized features of this iteration into the auto-df ring buffer"""
+    row = self._model_row
+    row[0], row[1], row[2], row[3] = self.car_data.v_ego, self.lead_data.v_lead, self.lead_data.a_lead, self.lead_data.x_lead
+    row -= self._scale_min
+    row *= self._scale_mul
+    np.clip(row, 0., 1., out=row)
+    self.auto_df_model_data[self.auto_df_model_idx] = row
+    self.auto_df_model_idx = (self.auto_df_model_idx + 1) % self.model_input_len
+    self.auto_df_model_len = min(self.auto_df_model_len + 1, self.model_input_len)
 
   def _get_pred(self):
     cur_time = sec_since_boot()
     if self.car_data.cruise_enabled and self.lead_data.status and not travis:
       if cur_time - self.last_predict_time > self.predict_rate:
-        if len(self.auto_df_model_data) == self.model_input_len:
-          pred = predict(np.array(self.auto_df_model_data[::self.skip_every], dtype=np.float32).flatten())
+        if self.auto_df_model_len == self.model_input_len:
+          self.model_profile = self._predict_profile()
           self.last_predict_time = cur_time
-          self.model_profile = int(np.argmax(pred))
+
+  def _predict_profile(self):
+    """Runs the model on every skip_every-th row of the full ring buffer, oldest first"""
+    idxs = self._model_sample_idxs
+    np.add(self._model_sample_offsets, self.auto_df_model_idx, out=idxs)
+    np.remainder(idxs, self.model_input_len, out=idxs)
+    np.take(self.auto_df_model_data, idxs, axis=0, out=self._model_input)
+    pred = self.predictor.predict(self._model_input.reshape(-1))
+    return int(np.argmax(pred))
 
   def _remove_old_entries(self, lst, cur_time, retention):
     return [sample for sample in lst if cur_time - sample['time'] <= retention]
@@ -19,3 +19,30 @@ def predict(x):
   l2 = np.dot(l1, w[2]) + b[2]
   l2 = softmax(l2)
   return l2
+
+
+class Predictor:
+  """
+  Same model as predict, for calling at a fixed rate without allocating.
+  Weights are transposed into contiguous float32 (out, in) matrices once and
+  every layer writes into its own preallocated output, so the returned
+  array is overwritten by the next call.
+  """
+  def __init__(self, weights=w, biases=b):
+    self.weights = [np.ascontiguousarray(np.asarray(layer, dtype=np.float32).T) for layer in weights]
+    self.biases = [np.asarray(layer, dtype=np.float32) for layer in biases]
+    self.outputs = [np.empty(len(layer), dtype=np.float32) for layer in biases]
+    self.input_size = self.weights[0].shape[1]
+
+  def predict(self, x):
+    """x: float32 array of input_size elements"""
+    last = len(self.weights) - 1
+    for i, (weight, bias, out) in enumerate(zip(self.weights, self.biases, self.outputs)):
+      np.dot(weight, x, out=out)
+      out += bias
+      if i < last:
+        np.maximum(out, 0, out=out)
+      x = out
+    np.exp(x, out=x)
+    x /= np.sum(x)
+    return x
@@ -2,6 +2,7 @@
 import math
 from datetime import datetime
 import time
+import threading
 import numpy as np
 from common.params import Params
 from common.numpy_fast import interp
@@ -28,7 +29,7 @@ default_brake_distance = op_params.get('default_brake_distance')
 eco_mode = op_params.get('eco_mode')
 
 if not travis:
-  curvature_factor = opParams().get('curvature_factor')
+  curvature_factor = op_params.get('curvature_factor')
 else:
   curvature_factor = 1.0
 
@@ -100,6 +101,57 @@ def limit_accel_in_turns(v_ego, angle_steers, a_target, CP, angle_later):
   return a_target
 
 
+class LiveParams():
+  """
+  Planner parameters that can change while driving. A daemon thread reads them every interval
+  and pushes the changed ones to callback as {planner attribute: value}, so the planner loop
+  never touches a params file.
+  """
+  def __init__(self, op_params, params, callback, interval=1.):
+    self.op_params = op_params
+    self.params = params
+    self.callback = callback
+    self.interval = interval
+    self.values = {}
+    self.thread = None
+    self._stop = threading.Event()
+
+  def read(self):
+    values = {'mpc_offset': self.op_params.get('mpc_offset'),
+              'speed_offset': self.op_params.get('speed_offset')}
+    try:
+      values['offset'] = int(self.params.get("SpeedLimitOffset", encoding='utf8'))
+    except (TypeError, ValueError):
+      self.params.delete("SpeedLimitOffset")
+      values['offset'] = 0
+    values['osm'] = self.params.get("LimitSetSpeed", encoding='utf8') == "1"
+    return values
+
+  def update(self):
+    values = self.read()
+    changed = {k: v for k, v in values.items() if k not in self.values or self.values[k] != v}
+    self.values = values
+    if changed:
+      self.callback(changed)
+
+  def start(self):
+    self.update()
+    self.thread = threading.Thread(target=self._run, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self._stop.set()
+    if self.thread is not None:
+      self.thread.join()
+
+  def _run(self):
+    while not self._stop.wait(self.interval):
+      try:
+        self.update()
+      except Exception:
+        cloudlog.exception("planner live params update failed")
+
+
 class Planner():
   def __init__(self, CP):
     self.CP = CP
@@ -125,12 +177,21 @@ class Planner():
     self.params = Params()
     self.first_loop = True
     self.offset = 0
-    self.last_time = 0
+    self.mpc_offset = op_params.get('mpc_offset')
+    self.speed_offset = 0.0
+    self.live_params = None
+    if not travis:
+      self.live_params = LiveParams(op_params, self.params, self._update_live_params)
+      self.live_params.start()
+
+  def _update_live_params(self, changed):
+    for name, value in changed.items():
+      setattr(self, name, value)
 
   def choose_solution(self, v_cruise_setpoint, enabled, lead_1, lead_2, steeringAngle, model_enabled):
     center_x = -2.5 # Wheel base 2.5m
     lead1_check = True
-    mpc_offset = opParams().get('mpc_offset')
+    mpc_offset = self.mpc_offset
     lead2_check = True
     if steeringAngle > 100: # only at high angles
       center_y = -1+2.5/math.tan(steeringAngle/1800.*math.pi) # Car Width 2m. Left side considered in left hand turn
@@ -180,19 +241,8 @@ class Planner():
     """Gets called when new radarState is available"""
     cur_time = sec_since_boot()
 
-    # we read offset value every 5 seconds
-    fixed_offset = 0.0
-    if not travis:
-      fixed_offset = op_params.get('speed_offset')
-      if self.last_time > 5:
-        try:
-          self.offset = int(self.params.get("SpeedLimitOffset", encoding='utf8'))
-        except (TypeError,ValueError):
-          self.params.delete("SpeedLimitOffset")
-          self.offset = 0
-        self.osm = self.params.get("LimitSetSpeed", encoding='utf8') == "1"
-        self.last_time = 0
-      self.last_time = self.last_time + 1
+    # offset, osm and speed_offset are kept up to date by self.live_params
+    fixed_offset = self.speed_offset
 
     gas_button_status = arne_sm['arne182Status'].gasbuttonstatus
     if eco_mode and gas_button_status == 0:
@@ -2,6 +2,8 @@
 from cereal import car
 from common.params import Params
 from common.realtime import Priority, config_realtime_process
+from common.profiler import Profiler
+from common.travis_checker import travis
 from selfdrive.swaglog import cloudlog
 from selfdrive.controls.lib.planner import Planner
 from selfdrive.controls.lib.vehicle_model import VehicleModel
@@ -35,14 +37,19 @@ def plannerd_thread(sm=None, pm=None, arne_sm=None):
   sm['liveParameters'].steerRatio = CP.steerRatio
   sm['liveParameters'].stiffnessFactor = 1.0
 
+  prof = Profiler(not travis, 'plannerd')
   while True:
     sm.update()
     arne_sm.update(0)
+    prof.checkpoint("Sample", ignore=True)
 
     if sm.updated['model']:
       PP.update(sm, pm, CP, VM)
+      prof.checkpoint("Path planner")
     if sm.updated['radarState']:
       PL.update(sm, pm, CP, VM, PP, arne_sm)
+      prof.checkpoint("Planner")
+    prof.tick()
 
 
 def main(sm=None, pm=None, arne_sm=None):
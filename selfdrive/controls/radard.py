@@ -8,6 +8,8 @@ from cereal import car
 from common.numpy_fast import interp
 from common.params import Params
 from common.realtime import Ratekeeper, Priority, config_realtime_process
+from common.profiler import Profiler
+from common.travis_checker import travis
 from selfdrive.config import RADAR_TO_CAMERA
 from selfdrive.controls.lib.cluster.fastcluster_py import cluster_points_centroid
 from selfdrive.controls.lib.radar_helpers import Cluster, Track
@@ -193,15 +195,18 @@ def radard_thread(sm=None, pm=None, can_sock=None):
 
   RI = RadarInterface(CP)
 
-  rk = Ratekeeper(1.0 / CP.radarTimeStep, print_delay_threshold=None)
+  rk = Ratekeeper(1.0 / CP.radarTimeStep, print_delay_threshold=None, summary_interval=60.)
   RD = RadarD(CP.radarTimeStep, RI.delay)
+  prof = Profiler(not travis, 'radard')
 
   # TODO: always log leads once we can hide them conditionally
   enable_lead = True #CP.openpilotLongitudinalControl or not CP.radarOffCan
 
   while 1:
     can_strings = messaging.drain_sock_raw(can_sock, wait_for_one=True)
+    prof.checkpoint("Sample", ignore=True)
     rr = RI.update(can_strings)
+    prof.checkpoint("Radar interface")
 
     if rr is None:
       continue
@@ -210,6 +215,7 @@ def radard_thread(sm=None, pm=None, can_sock=None):
 
     dat = RD.update(sm, rr, enable_lead)
     dat.radarState.cumLagMs = -rk.remaining*1000.
+    prof.checkpoint("Radard")
 
     pm.send('radarState', dat)
 
@@ -225,8 +231,10 @@ def radard_thread(sm=None, pm=None, can_sock=None):
         "vRel": float(tracks[ids].vRel),
       }
     pm.send('liveTracks', dat)
+    prof.checkpoint("Sent")
 
     rk.monitor_time()
+    prof.tick()
 
 
 def main(sm=None, pm=None, can_sock=None):
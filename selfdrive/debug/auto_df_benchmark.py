@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# type: ignore
+"""Measures the per-iteration cost of the auto-df model input and prediction
+in DynamicFollow, against the list based input and predict() it replaced."""
+
+import gc
+import time
+import argparse
+import numpy as np
+from selfdrive.controls.lib.dynamic_follow import DynamicFollow
+from selfdrive.controls.lib.dynamic_follow.auto_df import Predictor, predict
+
+
+def old_input(data, row, model_input_len, skip_every):
+  data.append(row)
+  while len(data) > model_input_len:
+    del data[0]
+  return np.array(data[::skip_every], dtype=np.float32).flatten()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--iterations", type=int, default=5000)
+  args = parser.parse_args()
+
+  df = DynamicFollow(mpc_id=0)
+  rng = np.random.RandomState(0)
+  samples = rng.uniform([0., 0., -3., 5.], [35., 35., 3., 120.], size=(args.iterations + df.model_input_len, 4))
+  names = ['v_ego', 'v_lead', 'a_lead', 'x_lead']
+
+  # fill the buffers so every iteration predicts
+  old_data = []
+  for v_ego, v_lead, a_lead, x_lead in samples[:df.model_input_len]:
+    df.car_data.v_ego = v_ego
+    df.update_lead(v_lead, a_lead, x_lead, status=True)
+    df._store_model_data()
+    old_input(old_data, [np.interp(x, df.model_scales[n], [0, 1]) for x, n in zip((v_ego, v_lead, a_lead, x_lead), names)],
+              df.model_input_len, df.skip_every)
+
+  times = {'list input + predict': [], 'ring buffer + Predictor': []}
+  collections = {}
+  for name in times:
+    gc_before = sum(s['collections'] for s in gc.get_stats())
+    for v_ego, v_lead, a_lead, x_lead in samples[df.model_input_len:]:
+      t = time.perf_counter()
+      if name == 'list input + predict':
+        row = [np.interp(x, df.model_scales[n], [0, 1]) for x, n in zip((v_ego, v_lead, a_lead, x_lead), names)]
+        np.argmax(predict(old_input(old_data, row, df.model_input_len, df.skip_every)))
+      else:
+        df.car_data.v_ego = v_ego
+        df.update_lead(v_lead, a_lead, x_lead, status=True)
+        df._store_model_data()
+        df._predict_profile()
+      times[name].append(time.perf_counter() - t)
+    collections[name] = sum(s['collections'] for s in gc.get_stats()) - gc_before
+
+  x = np.ascontiguousarray(rng.uniform(size=Predictor().input_size).astype(np.float32))
+  predictor = Predictor()
+  for name, f in (('predict()', predict), ('Predictor.predict()', predictor.predict)):
+    t = time.perf_counter()
+    for _ in range(args.iterations):
+      f(x)
+    print("%28s: %8.1f us" % (name, (time.perf_counter() - t) / args.iterations * 1e6))
+
+  for name, ts in times.items():
+    print("%28s: %8.1f us avg  %8.1f us max  %d gc collections" % (name, np.mean(ts) * 1e6, np.max(ts) * 1e6, collections[name]))
+
+
+if __name__ == "__main__":
+  main()
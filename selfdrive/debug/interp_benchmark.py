@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Times common.numpy_fast.interp on the tables of its hot call sites, against
+the linear scan it replaced, Interpolator and Interpolator.batch."""
+
+import timeit
+import argparse
+import numpy as np
+from common.numpy_fast import interp, Interpolator
+from common.tests.test_numpy_fast import interp_linear
+
+CALL_SITES = {
+  # radard.KalmanParams
+  'radard K': ([dt * 0.01 for dt in range(1, 11)],
+               [0.12288, 0.14557, 0.16523, 0.18282, 0.19887, 0.21372, 0.22761, 0.24069, 0.2531, 0.26491], 0.05),
+  # planner.calc_cruise_accel_limits
+  'planner a_cruise_min': ([0., 5., 10., 20., 40.], [-3.5, -3.5, -3.5, -2.5, -1.5], 13.),
+  # longcontrol, stopping factor
+  'longcontrol factor': ([2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0], [3.0, 2.1, 1.5, 1.0, 0.6, 0.29, 0.0], 4.2),
+  # pid, typical kpBP/kpV
+  'pid k_p': ([0., 5., 35.], [3.6, 2.4, 1.5], 22.),
+  # dynamic follow, relative velocity TR mod
+  'dynamic follow v_rel': ([-26.8224, -20.0288, -15.6871, -11.1965, -7.8645, -4.9472, -3.0541, -2.2244, -1.5045, -0.7908,
+                            -0.3196, 0.0, 0.5588, 1.3682, 1.898, 2.7316, 4.4704],
+                           [.76, 0.62323, 0.49488, 0.40656, 0.32227, 0.23914, 0.12269, 0.10483, 0.08074, 0.04886,
+                            0.0072, 0.0, -0.05648, -0.0792, -0.15675, -0.23289, -0.315], 1.5),
+}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--number", type=int, default=100000)
+  args = parser.parse_args()
+
+  print("%24s %12s %12s %12s" % ("", "linear", "interp", "Interpolator"))
+  for name, (xp, fp, x) in CALL_SITES.items():
+    f = Interpolator(xp, fp)
+    times = [timeit.timeit(lambda: g(x, xp, fp), number=args.number) for g in (interp_linear, interp)]
+    times.append(timeit.timeit(lambda: f(x), number=args.number))
+    print("%24s %9.3f us %9.3f us %9.3f us" % ((name,) + tuple(t / args.number * 1e6 for t in times)))
+
+  xp, fp, _ = CALL_SITES['dynamic follow v_rel']
+  f = Interpolator(xp, fp)
+  xs = np.random.RandomState(0).uniform(-30, 6, 1000)
+  n = max(args.number // 1000, 10)
+  t_list = timeit.timeit(lambda: interp(xs, xp, fp), number=n) / n
+  t_batch = timeit.timeit(lambda: f.batch(xs), number=n) / n
+  print("1000 points: interp %.1f us, Interpolator.batch %.1f us" % (t_list * 1e6, t_batch * 1e6))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# type: ignore
+"""Measures the per-cycle cost of the MapsdThread geometry.
+
+Pass tiles recorded by mapd (/data/osm_tiles/*.npz) to benchmark a real area,
+without arguments a dense urban street grid is generated."""
+
+import time
+import argparse
+import numpy as np
+import overpy
+from selfdrive.mapd.tile_cache import Tile, decode_result, tile_key
+from selfdrive.mapd.spatial_index import SpatialIndex
+from selfdrive.mapd.mapd_helpers import MAPS_LOOKAHEAD_DISTANCE, Way, circle_through_points, rate_curvature_points
+from selfdrive.mapd.car_frame import circles_through_points, rate_curvature
+
+
+def street_grid(lat0=48.137, lon0=11.575, n=60, spacing=0.0008, nodes_per_block=4):
+  """Dense urban grid, n x n blocks with intermediate nodes on every block edge"""
+  result = overpy.Result()
+  node_ids = {}
+  steps = n * nodes_per_block
+  for i in range(steps + 1):
+    for j in range(steps + 1):
+      if i % nodes_per_block and j % nodes_per_block:
+        continue
+      node_ids[i, j] = len(node_ids) + 1
+      result.append(overpy.Node(node_id=node_ids[i, j], lat=lat0 + i * spacing / nodes_per_block,
+                                lon=lon0 + j * spacing * 1.5 / nodes_per_block, tags={}, attributes={}, result=result))
+  way_id = 0
+  for street in range(0, steps + 1, nodes_per_block):
+    for start in range(0, steps, nodes_per_block):
+      for idxs in ([(street, k) for k in range(start, start + nodes_per_block + 1)],
+                   [(k, street) for k in range(start, start + nodes_per_block + 1)]):
+        way_id += 1
+        tags = {'highway': 'residential' if street % 5 else 'primary', 'maxspeed': '50', 'lanes': '2'}
+        result.append(overpy.Way(way_id=way_id, node_ids=[node_ids[i] for i in idxs], tags=tags, attributes={}, result=result))
+  return result, (lat0 + n * spacing / 2, lon0 + n * spacing * 1.5 / 2)
+
+
+def curvature_loop(pnts):
+  circles = np.asarray([circle_through_points(*p, direction=True) for p in zip(pnts, pnts[1:], pnts[2:])])
+  curvature = 1. / np.nan_to_num(circles[:, 2])
+  rate = [0] + [rate_curvature_points(*p) for p in zip(pnts[1:], pnts[2:], curvature[0:], curvature[1:])]
+  return curvature, rate
+
+
+def curvature_batched(pnts):
+  curvature = 1. / np.nan_to_num(circles_through_points(pnts, direction=True)[:, 2])
+  return curvature, rate_curvature(pnts, curvature)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("tiles", nargs='*', help="recorded mapd tiles (.npz)")
+  parser.add_argument("--cycles", type=int, default=200)
+  args = parser.parse_args()
+
+  index = SpatialIndex()
+  if args.tiles:
+    for path in args.tiles:
+      with np.load(path) as arrays:
+        index = index.insert(Tile(path, decode_result(arrays)))
+    lat, lon = np.mean([[float(n.lat), float(n.lon)] for n in index.real_nodes], axis=0)
+  else:
+    result, (lat, lon) = street_grid()
+    index = index.insert(Tile(tile_key(lat, lon), result))
+  print("%d nodes, %d ways" % (len(index), sum(len(b.result.ways) for b in index.batches)))
+
+  query_result = index.query_result
+  rng = np.random.RandomState(0)
+  positions = [(lat + rng.uniform(-0.005, 0.005), lon + rng.uniform(-0.005, 0.005), rng.choice([0., 90., 180., 270.]))
+               for _ in range(args.cycles)]
+
+  times = {'closest': [], 'lookahead': [], 'curvature loop': [], 'curvature batched': []}
+  cur_way = None
+  for lat, lon, heading in positions:
+    t = time.perf_counter()
+    cur_way = Way.closest(query_result, lat, lon, heading, cur_way)
+    times['closest'].append(time.perf_counter() - t)
+    if cur_way is None:
+      continue
+
+    t = time.perf_counter()
+    pnts, valid = cur_way.get_lookahead(lat, lon, heading, MAPS_LOOKAHEAD_DISTANCE)
+    times['lookahead'].append(time.perf_counter() - t)
+    if pnts is None or pnts.shape[0] <= 3:
+      continue
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+      for name, f in (('curvature loop', curvature_loop), ('curvature batched', curvature_batched)):
+        t = time.perf_counter()
+        f(pnts)
+        times[name].append(time.perf_counter() - t)
+
+  for name, ts in times.items():
+    if len(ts):
+      print("%20s: %8.3f ms avg  %8.3f ms max  (%d samples)" % (name, np.mean(ts) * 1e3, np.max(ts) * 1e3, len(ts)))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Aggregates the common.profiler histograms published by controlsd, plannerd,
+radard and mapd and prints p50/p99/max per checkpoint since start."""
+
+import argparse
+from collections import defaultdict
+import cereal.messaging_arne as messaging_arne
+from common.profiler import NUM_BINS, percentile
+
+PROCESSES = ['controlsd', 'plannerd', 'radard', 'mapd']
+
+
+class Stats():
+  def __init__(self):
+    self.hist = [0] * NUM_BINS
+    self.count = 0
+    self.total = 0.
+    self.max = 0.
+    self.ignored = False
+
+  def merge(self, c):
+    for i, n in enumerate(c.histogram):
+      self.hist[i] += n
+    self.count += c.count
+    self.total += c.meanMs * c.count
+    self.max = max(self.max, c.maxMs)
+    self.ignored = c.ignored
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("processes", nargs='*', default=PROCESSES, choices=PROCESSES)
+  parser.add_argument("--addr", default="127.0.0.1")
+  args = parser.parse_args()
+
+  poller = messaging_arne.Poller()
+  socks = {messaging_arne.sub_sock(p + 'Profile', poller=poller, addr=args.addr): p for p in args.processes}
+  stats = defaultdict(Stats)
+  overhead = {}
+
+  while True:
+    updated = False
+    for sock in poller.poll(1000):
+      process = socks[sock]
+      for msg in messaging_arne.drain_sock(sock):
+        data = getattr(msg, process + 'Profile')
+        overhead[process] = data.overheadUs
+        for c in data.checkpoints:
+          stats[(process, c.name)].merge(c)
+        updated = True
+    if not updated:
+      continue
+
+    print("%10s %24s %9s %9s %9s %9s %9s" % ("process", "checkpoint", "count", "mean ms", "p50 ms", "p99 ms", "max ms"))
+    for (process, name), s in sorted(stats.items()):
+      print("%10s %24s %9d %9.3f %9.3f %9.3f %9.3f%s" %
+            (process, name, s.count, s.total / max(s.count, 1), percentile(s.hist, s.count, 50) * 1e3,
+             percentile(s.hist, s.count, 99) * 1e3, s.max, "  ignored" if s.ignored else ""))
+    print("checkpoint overhead: " + ", ".join("%s %.2f us" % kv for kv in sorted(overhead.items())))
+    print()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Upload throughput of loggerd.uploader against a local fake upload server
+with the link emulated for each NetworkType: a single streamed PUT, like the
+uploader did before, against block uploads with UPLOAD_WORKERS in parallel.
+
+The profiles add request latency and cap the bytes/s of a single connection
+(TCP window over RTT) and of the whole link."""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import selfdrive.loggerd.uploader as uploader
+from selfdrive.loggerd.tests.loggerd_tests_common import FakeUploadServer, fake_upload_api
+
+MB = 1024 * 1024
+
+# NetworkType: (latency s, connection bytes/s, link bytes/s)
+PROFILES = {
+  'wifi': (0.01, 4 * MB, 12 * MB),
+  'cell4G': (0.05, 0.75 * MB, 3 * MB),
+  'cell3G': (0.15, 0.15 * MB, 0.5 * MB),
+  'cell2G': (0.5, 0.02 * MB, 0.03 * MB),
+}
+
+
+def upload(up, root, key, workers):
+  uploader.UPLOAD_CHUNK_SIZE = os.path.getsize(os.path.join(root, key)) if workers == 1 else 4 * MB
+  t = time.monotonic()
+  assert up.do_upload(key, os.path.join(root, key)) is None and up.last_resp.status_code == 201
+  return time.monotonic() - t
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--size", type=float, default=16., help="file size in MB")
+  parser.add_argument("--network", choices=list(PROFILES), nargs='*', default=['wifi', 'cell4G', 'cell3G'])
+  args = parser.parse_args()
+
+  # the fake server only answers once a whole request body went through the emulated link
+  uploader.UPLOAD_TIMEOUT = 600
+
+  root = tempfile.mkdtemp()
+  try:
+    key = "2020-01-01--00-00-00--0/fcamera.hevc"
+    os.mkdir(os.path.join(root, os.path.dirname(key)))
+    with open(os.path.join(root, key), "wb") as f:
+      f.write(os.urandom(int(args.size * MB)))
+
+    for network in args.network:
+      server = FakeUploadServer(*PROFILES[network]).start()
+      uploader.Api = fake_upload_api(server)
+      up = uploader.Uploader("0000000000000000", root)
+
+      single = upload(up, root, key, 1)
+      blocks = upload(up, root, key, uploader.UPLOAD_WORKERS)
+      print("%8s: single put %6.2f MB/s   %d blocks in parallel %6.2f MB/s" %
+            (network, args.size / single, uploader.UPLOAD_WORKERS, args.size / blocks))
+      server.stop()
+  finally:
+    shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+  main()
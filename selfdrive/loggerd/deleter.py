@@ -1,41 +1,154 @@
 #!/usr/bin/env python3
 import os
+import time
 import shutil
 import threading
+import psutil
 from selfdrive.swaglog import cloudlog
-from selfdrive.loggerd.config import ROOT, get_available_bytes, get_available_percent
-from selfdrive.loggerd.uploader import listdir_by_creation
+from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.uploader import get_directory_sort, UPLOAD_ATTR_NAME
+from common.xattr import getxattr
 
 MIN_BYTES = 5 * 1024 * 1024 * 1024
 MIN_PERCENT = 10
 
 
-def deleter_thread(exit_event):
-  while not exit_event.is_set():
-    out_of_bytes = get_available_bytes(default=MIN_BYTES + 1) < MIN_BYTES
-    out_of_percent = get_available_percent(default=MIN_PERCENT + 1) < MIN_PERCENT
+def get_bytes_to_free():
+  """Bytes to delete to get back above both MIN_BYTES and MIN_PERCENT"""
+  try:
+    statvfs = os.statvfs(ROOT)
+  except OSError:
+    return 0
+  available = statvfs.f_bavail * statvfs.f_frsize
+  return max(MIN_BYTES - available, statvfs.f_blocks * statvfs.f_frsize * MIN_PERCENT // 100 - available)
+
+
+class Segment():
+  def __init__(self, name, mtime, size, locked, files):
+    self.name = name
+    self.sort = get_directory_sort(name)
+    self.mtime = mtime
+    self.size = size
+    self.locked = locked
+    self.files = files  # not uploaded yet
+
+  @property
+  def uploaded(self):
+    return not self.files
+
+  def update_uploaded(self, path):
+    def is_uploaded(fn):
+      try:
+        return getxattr(os.path.join(path, fn), UPLOAD_ATTR_NAME)
+      except OSError:
+        return True  # gone
+    self.files = [fn for fn in self.files if not is_uploaded(fn)]
+
+
+class SegmentIndex():
+  """Disk usage, lock and upload state of the segments under root.
+
+  refresh() only rescans the segment directories whose mtime changed, files
+  and locks being created or removed bump it. Upload xattrs don't, they are
+  reread for the segments that weren't fully uploaded yet."""
+  MTIME_SETTLE_NS = 1e9  # directory mtimes are coarse, rescan until they are older than this
+
+  def __init__(self, root):
+    self.root = root
+    self.segments = {}
 
-    if out_of_percent or out_of_bytes:
-      # remove the earliest directory we can
-      dirs = listdir_by_creation(ROOT)
-      for delete_dir in dirs:
-        delete_path = os.path.join(ROOT, delete_dir)
+  def scan_segment(self, name, mtime):
+    path = os.path.join(self.root, name)
+    size, locked, files = 0, False, []
+    try:
+      with os.scandir(path) as it:
+        for f in it:
+          if f.name.endswith(".lock"):
+            locked = True
+            continue
+          try:
+            size += f.stat(follow_symlinks=False).st_blocks * 512
+          except OSError:
+            continue
+          files.append(f.name)
+    except OSError:
+      return None
 
-        if any(name.endswith(".lock") for name in os.listdir(delete_path)):
-          continue
+    if time.time_ns() - mtime < self.MTIME_SETTLE_NS:
+      mtime = None
+    return Segment(name, mtime, size, locked, files)
 
+  def refresh(self):
+    seen = set()
+    try:
+      with os.scandir(self.root) as it:
+        for d in it:
+          try:
+            if not d.is_dir(follow_symlinks=False):
+              continue
+            mtime = d.stat().st_mtime_ns
+          except OSError:
+            continue
+          seen.add(d.name)
+          segment = self.segments.get(d.name)
+          if segment is None or segment.mtime != mtime:
+            segment = self.scan_segment(d.name, mtime)
+            if segment is not None:
+              self.segments[d.name] = segment
+    except OSError:
+      cloudlog.exception("deleter refresh failed")
+
+    for name in set(self.segments) - seen:
+      del self.segments[name]
+
+    for segment in self.segments.values():
+      if not segment.locked and not segment.uploaded:
+        segment.update_uploaded(os.path.join(self.root, segment.name))
+
+  def select(self, bytes_to_free):
+    """Segments to delete for bytes_to_free, taken greedily with already uploaded
+    ones first and oldest first within those, until enough bytes are freed.
+    Locked segments are in use and never picked."""
+    candidates = sorted((s for s in self.segments.values() if not s.locked), key=lambda s: (not s.uploaded, s.sort))
+    selected = []
+    for segment in candidates:
+      if bytes_to_free <= 0:
+        break
+      selected.append(segment)
+      bytes_to_free -= segment.size
+    return selected
+
+  def remove(self, name):
+    self.segments.pop(name, None)
+
+
+def deleter_thread(exit_event):
+  index = SegmentIndex(ROOT)
+  while not exit_event.is_set():
+    bytes_to_free = get_bytes_to_free()
+
+    if bytes_to_free > 0:
+      index.refresh()
+      selected = index.select(bytes_to_free)
+      for segment in selected:
+        delete_path = os.path.join(ROOT, segment.name)
         try:
-          cloudlog.info("deleting %s" % delete_path)
+          cloudlog.info("deleting %s (%d bytes, uploaded %s)" % (delete_path, segment.size, segment.uploaded))
           shutil.rmtree(delete_path)
-          break
         except OSError:
           cloudlog.exception("issue deleting %s" % delete_path)
-      exit_event.wait(.1)
+        index.remove(segment.name)
+      exit_event.wait(.1 if selected else 5)
     else:
       exit_event.wait(30)
 
 
 def main():
+  # Set low io priority, deleting must not starve loggerd's writes
+  proc = psutil.Process()
+  if psutil.LINUX:
+    proc.ionice(psutil.IOPRIO_CLASS_BE, value=7)
+
   deleter_thread(threading.Event())
 
 
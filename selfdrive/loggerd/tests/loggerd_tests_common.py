@@ -1,9 +1,14 @@
 import os
+import re
+import time
 import errno
 import shutil
 import random
 import tempfile
 import unittest
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import selfdrive.loggerd.uploader as uploader
 
@@ -52,6 +57,92 @@ class MockApiIgnore():
   def get_token(self):
     return "fake-token"
 
+class FakeUploadHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def do_PUT(self):
+    server = self.server
+    time.sleep(server.latency)
+    url = urlsplit(self.path)
+    query = parse_qs(url.query)
+    length = int(self.headers['Content-Length'])
+    dat = b""
+    while len(dat) < length:
+      chunk = self.rfile.read(min(64 * 1024, length - len(dat)))
+      if not chunk:
+        break
+      server.throttle(len(chunk))
+      dat += chunk
+
+    with server.lock:
+      comp = query.get("comp", [None])[0]
+      server.requests.append((url.path, comp))
+      if comp == "block":
+        if server.fail_blocks is not None and len(server.blocks) >= server.fail_blocks:
+          status = 500
+        else:
+          server.blocks[(url.path, query["blockid"][0])] = dat
+          status = 201
+      elif comp == "blocklist":
+        ids = re.findall(r"<Latest>(.*?)</Latest>", dat.decode())
+        if all((url.path, i) in server.blocks for i in ids):
+          server.blobs[url.path] = b"".join(server.blocks.pop((url.path, i)) for i in ids)
+          status = 201
+        else:
+          status = 400
+      else:
+        server.blobs[url.path] = dat
+        status = 201
+
+    self.send_response(status)
+    self.send_header("Content-Length", "0")
+    self.end_headers()
+
+  def log_message(self, *args):
+    pass
+
+class FakeUploadServer(ThreadingHTTPServer):
+  '''Blob store speaking the block upload protocol of the upload urls.
+  latency is added to every request, connection_rate and link_rate limit the
+  bytes/s of a single connection and of all of them together.'''
+  daemon_threads = True
+
+  def __init__(self, latency=0., connection_rate=None, link_rate=None):
+    super().__init__(("127.0.0.1", 0), FakeUploadHandler)
+    self.latency = latency
+    self.connection_rate = connection_rate
+    self.link_rate = link_rate
+    self.lock = threading.Lock()
+    self.link_free = 0.
+    self.fail_blocks = None  # fail block uploads once this many are stored
+    self.blobs = {}
+    self.blocks = {}
+    self.requests = []
+    self.url = "http://127.0.0.1:%d" % self.server_port
+
+  def throttle(self, size):
+    wait = size / self.connection_rate if self.connection_rate else 0.
+    if self.link_rate:
+      with self.lock:
+        now = time.monotonic()
+        self.link_free = max(self.link_free, now) + size / self.link_rate
+        wait = max(wait, self.link_free - now)
+    time.sleep(wait)
+
+  def start(self):
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+def fake_upload_api(server):
+  class MockApiServer(MockApi):
+    def get(self, *args, **kwargs):
+      return MockResponse('{"url": "%s/%s?sig=fake", "headers": {"x-ms-blob-type": "BlockBlob"}}' % (server.url, kwargs['path']), 200)
+  return MockApiServer
+
 class MockParams():
   def __init__(self):
     self.params = {
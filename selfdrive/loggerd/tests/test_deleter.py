@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import os
+import threading
+import unittest
+
+import selfdrive.loggerd.deleter as deleter
+from selfdrive.loggerd.uploader import UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
+from common.xattr import setxattr
+
+from selfdrive.loggerd.tests.loggerd_tests_common import UploaderTestCase
+
+
+class TestDeleter(UploaderTestCase):
+  def setUp(self):
+    super(TestDeleter, self).setUp()
+    self.get_bytes_to_free = deleter.get_bytes_to_free
+    deleter.ROOT = self.root
+    self.index = deleter.SegmentIndex(self.root)
+
+  def tearDown(self):
+    deleter.get_bytes_to_free = self.get_bytes_to_free
+    super(TestDeleter, self).tearDown()
+
+  def make_segment(self, num, size_mb=0.1, lock=False, uploaded=False):
+    seg_dir = self.seg_format.format(num)
+    for fn in ["qlog.bz2", "rlog.bz2"]:
+      f_path = self.make_file_with_data(seg_dir, fn, size_mb, lock=lock)
+      if uploaded:
+        setxattr(f_path, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+    return seg_dir
+
+  def selected(self, bytes_to_free):
+    self.index.refresh()
+    return [s.name for s in self.index.select(bytes_to_free)]
+
+  def test_select(self):
+    segs = [self.make_segment(i) for i in range(4)]
+    locked = self.make_segment(4, lock=True)
+    uploaded = self.make_segment(10, uploaded=True)
+    seg_size = self.index.scan_segment(segs[0], 0).size
+
+    self.assertEqual(self.selected(0), [])
+    self.assertEqual(self.selected(1), [uploaded])
+    self.assertEqual(self.selected(seg_size + 1), [uploaded, segs[0]])
+    self.assertEqual(self.selected(100 * seg_size), [uploaded] + segs)
+    self.assertNotIn(locked, self.selected(100 * seg_size))
+
+  def test_refresh(self):
+    segs = [self.make_segment(i) for i in range(3)]
+    self.assertEqual(self.selected(1), [segs[0]])
+
+    for fn in ["qlog.bz2", "rlog.bz2"]:
+      setxattr(os.path.join(self.root, segs[2], fn), UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+    self.assertEqual(self.selected(1), [segs[2]])
+
+    new = self.make_segment(50, uploaded=True)
+    self.assertEqual(self.selected(self.index.segments[segs[2]].size + 1), [segs[2], new])
+
+    os.remove(os.path.join(self.root, segs[0], "qlog.bz2"))
+    os.remove(os.path.join(self.root, segs[0], "rlog.bz2"))
+    os.rmdir(os.path.join(self.root, segs[0]))
+    self.index.refresh()
+    self.assertNotIn(segs[0], self.index.segments)
+
+  def test_deleter_thread(self):
+    segs = [self.make_segment(i) for i in range(5)]
+    self.make_segment(20, uploaded=True)
+    seg_size = self.index.scan_segment(segs[0], 0).size
+
+    # free space is short by two and a half segments
+    total = 6 * seg_size
+    deleter.get_bytes_to_free = lambda: int(2.5 * seg_size) - (total - sum(
+      self.index.scan_segment(d, 0).size for d in os.listdir(self.root)))
+
+    exit_event = threading.Event()
+    thread = threading.Thread(target=deleter.deleter_thread, args=[exit_event], daemon=True)
+    thread.start()
+    exit_event.wait(1)
+    exit_event.set()
+    thread.join()
+
+    self.assertEqual(sorted(os.listdir(self.root)), segs[2:])
+
+
+if __name__ == "__main__":
+  unittest.main()
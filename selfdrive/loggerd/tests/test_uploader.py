@@ -10,7 +10,7 @@ import selfdrive.loggerd.uploader as uploader
 
 from common.xattr import getxattr
 
-from selfdrive.loggerd.tests.loggerd_tests_common import UploaderTestCase
+from selfdrive.loggerd.tests.loggerd_tests_common import UploaderTestCase, FakeUploadServer, fake_upload_api
 
 class TestLogHandler(logging.Handler):
   def __init__(self):
@@ -140,5 +140,110 @@ class TestUploader(UploaderTestCase):
       self.assertFalse(getxattr(f_path, uploader.UPLOAD_ATTR_NAME), "File upload when locked")
 
 
+class TestUploadQueue(UploaderTestCase):
+  def setUp(self):
+    super(TestUploadQueue, self).setUp()
+    self.up = uploader.Uploader("0000000000000000", self.root)
+
+  def gen_files(self, seg_dir, lock=False):
+    return [self.make_file_with_data(seg_dir, t, 0.01, lock=lock)
+            for t in ["bootlog.bz2", "qlog.bz2", "rlog.bz2", "dcamera.hevc", "fcamera.hevc"]]
+
+  def upload_all(self, with_raw=True):
+    keys = []
+    while True:
+      d = self.up.next_file_to_upload(with_raw=with_raw)
+      if d is None:
+        return keys
+      self.assertTrue(self.up.upload(*d))
+      keys.append(d[0])
+
+  def test_order(self):
+    seg_nums = [20, 0, 10, 2, 1]
+    for i in seg_nums:
+      self.gen_files(self.seg_format.format(i))
+
+    segs = [self.seg_format.format(i) for i in sorted(seg_nums)]
+    exp_order = [f"{seg}/qlog.bz2" for seg in segs]
+    for seg in segs:
+      exp_order += [f"{seg}/{f}" for f in ["rlog.bz2", "fcamera.hevc", "dcamera.hevc"]]
+    exp_order += [f"{seg}/bootlog.bz2" for seg in segs]
+    self.assertEqual(self.upload_all(), exp_order)
+
+  def test_without_raw(self):
+    self.gen_files(self.seg_dir)
+    self.assertEqual(self.upload_all(with_raw=False), [f"{self.seg_dir}/qlog.bz2"])
+    self.assertEqual(len(self.upload_all()), 4)
+
+  def test_incremental_updates(self):
+    f_paths = self.gen_files(self.seg_dir, lock=True)
+    self.assertIsNone(self.up.next_file_to_upload(with_raw=True))
+
+    for f_path in f_paths:
+      os.remove(f_path + ".lock")
+    os.remove(os.path.join(self.root, self.seg_dir, "qlog.bz2"))
+    seg_dir2 = self.seg_format2.format(self.seg_num)
+    self.gen_files(seg_dir2)
+
+    self.assertEqual(self.upload_all(with_raw=False), [f"{seg_dir2}/qlog.bz2"])
+    self.assertEqual(self.up.next_file_to_upload(with_raw=True)[0], f"{self.seg_dir}/rlog.bz2")
+
+
+class TestChunkedUpload(UploaderTestCase):
+  def setUp(self):
+    super(TestChunkedUpload, self).setUp()
+    self.server = FakeUploadServer().start()
+    uploader.Api = fake_upload_api(self.server)
+    uploader.fake_upload = False
+    self.chunk_size = uploader.UPLOAD_CHUNK_SIZE
+    uploader.UPLOAD_CHUNK_SIZE = 64 * 1024
+    self.up = uploader.Uploader("0000000000000000", self.root)
+
+  def tearDown(self):
+    uploader.UPLOAD_CHUNK_SIZE = self.chunk_size
+    self.server.stop()
+    super(TestChunkedUpload, self).tearDown()
+
+  def upload(self, fn):
+    key = os.path.join(self.seg_dir, fn)
+    return self.up.upload(key, os.path.join(self.root, key)), "/" + key
+
+  def read(self, path):
+    with open(os.path.join(self.root, path[1:]), "rb") as f:
+      return f.read()
+
+  def test_small_file(self):
+    self.make_file_with_data(self.seg_dir, "qlog.bz2", 0.01)
+    success, path = self.upload("qlog.bz2")
+    self.assertTrue(success)
+    self.assertEqual(self.server.requests, [(path, None)])
+    self.assertEqual(self.server.blobs[path], self.read(path))
+
+  def test_blocks(self):
+    self.make_file_with_data(self.seg_dir, "fcamera.hevc", 1)
+    success, path = self.upload("fcamera.hevc")
+    self.assertTrue(success)
+    self.assertEqual(sorted(self.server.requests), [(path, "block")] * 16 + [(path, "blocklist")])
+    self.assertEqual(self.server.blobs[path], self.read(path))
+    self.assertFalse(getxattr(self.root + path, uploader.UPLOAD_PROGRESS_ATTR_NAME))
+
+  def test_resume(self):
+    self.make_file_with_data(self.seg_dir, "fcamera.hevc", 1)
+    self.server.fail_blocks = 5
+    success, path = self.upload("fcamera.hevc")
+    self.assertFalse(success)
+    self.assertNotIn(path, self.server.blobs)
+    self.assertTrue(getxattr(self.root + path, uploader.UPLOAD_PROGRESS_ATTR_NAME))
+
+    # only the missing blocks are sent again
+    stored = len(self.server.blocks)
+    self.server.fail_blocks = None
+    self.server.requests = []
+    success, path = self.upload("fcamera.hevc")
+    self.assertTrue(success)
+    self.assertEqual(self.server.requests.count((path, "block")), 16 - stored)
+    self.assertEqual(self.server.blobs[path], self.read(path))
+
+
 if __name__ == "__main__":
   unittest.main()
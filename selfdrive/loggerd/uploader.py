@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import heapq
 import threading
 import time
 import json
@@ -8,8 +9,12 @@ import re
 import subprocess
 import ctypes
 import inspect
+import base64
 import requests
 import traceback
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from selfdrive.swaglog import cloudlog
 #from selfdrive.loggerd.config import ROOT
@@ -23,6 +28,12 @@ from selfdrive.loggerd.xattr_cache import getxattr, setxattr
 NetworkType = log.ThermalData.NetworkType
 UPLOAD_ATTR_NAME = 'user.upload'
 UPLOAD_ATTR_VALUE = b'1'
+UPLOAD_PROGRESS_ATTR_NAME = 'user.upload_progress'
+
+# files larger than one chunk are uploaded as blocks, UPLOAD_WORKERS at a time
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_WORKERS = 4
+UPLOAD_TIMEOUT = 10
 
 fake_upload = os.getenv("FAKEUPLOAD") is not None
 
@@ -49,6 +60,30 @@ def raise_on_thread(t, exctype):
     ctypes.pythonapi.PyThreadState_SetAsyncExc(tid, 0)
     raise SystemError("PyThreadState_SetAsyncExc failed")
 
+def get_upload_progress(fn, stamp):
+  '''Bitmask of the blocks of fn the server acknowledged, 0 if the file changed since'''
+  try:
+    progress = getxattr(fn, UPLOAD_PROGRESS_ATTR_NAME)
+  except OSError:
+    return 0
+  if not progress:
+    return 0
+  progress_stamp, done = progress.decode().rsplit(' ', 1)
+  return int(done, 16) if progress_stamp == stamp else 0
+
+def set_upload_progress(fn, stamp, done):
+  try:
+    setxattr(fn, UPLOAD_PROGRESS_ATTR_NAME, ('%s %x' % (stamp, done)).encode() if done else b'')
+  except OSError:
+    cloudlog.event("uploader_setxattr_failed", fn=fn, attr=UPLOAD_PROGRESS_ATTR_NAME)
+
+def block_id(i):
+  # all block ids of a blob need the same length
+  return base64.b64encode(b'%08d' % i).decode()
+
+def block_url(url, query):
+  return url + ('&' if '?' in url else '?') + query
+
 def get_directory_sort(d):
   return list(map(lambda s: s.rjust(10, '0'), d.rsplit('--', 1)))
 
@@ -84,73 +119,145 @@ def is_on_hotspot():
   except Exception:
     return False
 
-class Uploader():
-  def __init__(self, dongle_id, root):
-    self.dongle_id = dongle_id
-    self.api = Api(dongle_id)
-    self.root = root
+class UploadQueue():
+  """Files waiting for upload under root, in the order next_file_to_upload
+  picks them: immediate priority files first, then high priority ones, then
+  everything else, oldest segment first within each.
 
-    self.upload_thread = None
+  The queue is built from the upload xattrs once and then kept up to date
+  incrementally. refresh() only rescans the segment directories whose mtime
+  changed, which happens whenever a file or lock is created or removed in
+  them. Entries that are replaced or dropped stay in the heaps until they
+  reach the top and are skipped there."""
+  IMMEDIATE, HIGH, OTHER = 0, 1, 2
+  MTIME_SETTLE_NS = 1e9  # directory mtimes are coarse, rescan until they are older than this
 
-    self.last_resp = None
-    self.last_exc = None
+  def __init__(self, root, immediate_priority, high_priority):
+    self.root = root
+    self.immediate_priority = immediate_priority
+    self.high_priority = high_priority
 
-    self.immediate_priority = {"qlog.bz2": 0, "qcamera.ts": 1}
-    self.high_priority = {"rlog.bz2": 0, "fcamera.hevc": 1, "dcamera.hevc": 2, "ecamera.hevc": 3}
+    self.heaps = ([], [], [])
+    self.pending = {}  # key -> heap entry
+    self.segments = {}  # logname -> (mtime, keys)
 
-  def get_upload_sort(self, name):
+  def _entry(self, logname, name):
+    segment_sort = get_directory_sort(logname)
     if name in self.immediate_priority:
-      return self.immediate_priority[name]
+      return (self.IMMEDIATE, segment_sort, self.immediate_priority[name], name, logname)
     if name in self.high_priority:
-      return self.high_priority[name] + 100
-    return 1000
+      return (self.HIGH, segment_sort, self.high_priority[name], name, logname)
+    return (self.OTHER, segment_sort, 0, name, logname)
+
+  def _drop_segment(self, logname):
+    _, keys = self.segments.pop(logname, (None, ()))
+    for key in keys:
+      self.pending.pop(key, None)
 
-  def gen_upload_files(self):
-    if not os.path.isdir(self.root):
+  def _scan_segment(self, logname, mtime):
+    self._drop_segment(logname)
+    path = os.path.join(self.root, logname)
+    try:
+      names = os.listdir(path)
+    except OSError:
       return
-    for logname in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logname)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
-      if any(name.endswith(".lock") for name in names):
-        continue
 
-      for name in sorted(names, key=self.get_upload_sort):
+    keys = []
+    if not any(name.endswith(".lock") for name in names):
+      for name in names:
+        if name.endswith(".tmp"):
+          continue
         key = os.path.join(logname, name)
         fn = os.path.join(path, name)
         # skip files already uploaded
         try:
           is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
         except OSError:
-          cloudlog.event("uploader_getxattr_failed", exc=self.last_exc, key=key, fn=fn)
+          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
           is_uploaded = True  # deleter could have deleted
         if is_uploaded:
           continue
-        yield (name, key, fn)
 
-  def next_file_to_upload(self, with_raw):
-    upload_files = list(self.gen_upload_files())
+        entry = self._entry(logname, name)
+        self.pending[key] = entry
+        heapq.heappush(self.heaps[entry[0]], entry)
+        keys.append(key)
 
-    # try to upload qlog files first
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return (key, fn)
+    if time.time_ns() - mtime < self.MTIME_SETTLE_NS:
+      mtime = None
+    self.segments[logname] = (mtime, keys)
 
-    if with_raw:
-      # then upload the full log files, rear and front camera files
-      for name, key, fn in upload_files:
-        if name in self.high_priority:
-          return (key, fn)
+  def refresh(self):
+    seen = set()
+    try:
+      with os.scandir(self.root) as it:
+        for d in it:
+          try:
+            if not d.is_dir():
+              continue
+            mtime = d.stat().st_mtime_ns
+          except OSError:
+            continue
+          seen.add(d.name)
+          if d.name not in self.segments or self.segments[d.name][0] != mtime:
+            self._scan_segment(d.name, mtime)
+    except OSError:
+      pass
+
+    for logname in set(self.segments) - seen:
+      self._drop_segment(logname)
 
-      # then upload other files
-      for name, key, fn in upload_files:
-        if not name.endswith('.lock') and not name.endswith(".tmp"):
-          return (key, fn)
+  def discard(self, key):
+    self.pending.pop(key, None)
 
+  def peek(self, with_raw):
+    """Returns (key, fn) of the next file to upload or None"""
+    for category in (self.IMMEDIATE, self.HIGH, self.OTHER) if with_raw else (self.IMMEDIATE,):
+      heap = self.heaps[category]
+      while len(heap):
+        _, _, _, name, logname = entry = heap[0]
+        key = os.path.join(logname, name)
+        if self.pending.get(key) is entry:
+          return (key, os.path.join(self.root, key))
+        heapq.heappop(heap)
     return None
 
+  def __len__(self):
+    return len(self.pending)
+
+
+class Uploader():
+  def __init__(self, dongle_id, root):
+    self.dongle_id = dongle_id
+    self.api = Api(dongle_id)
+    self.root = root
+
+    self.upload_thread = None
+
+    self.last_resp = None
+    self.last_exc = None
+
+    self.immediate_priority = {"qlog.bz2": 0, "qcamera.ts": 1}
+    self.high_priority = {"rlog.bz2": 0, "fcamera.hevc": 1, "dcamera.hevc": 2, "ecamera.hevc": 3}
+    self.upload_queue = UploadQueue(root, self.immediate_priority, self.high_priority)
+
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=UPLOAD_WORKERS)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+    self.executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+
+  def get_upload_sort(self, name):
+    if name in self.immediate_priority:
+      return self.immediate_priority[name]
+    if name in self.high_priority:
+      return self.high_priority[name] + 100
+    return 1000
+
+  def next_file_to_upload(self, with_raw):
+    self.upload_queue.refresh()
+    return self.upload_queue.peek(with_raw)
+
   def do_upload(self, key, fn):
     try:
       url_resp = self.api.get("v1.3/"+self.dongle_id+"/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
@@ -172,12 +279,67 @@ class Uploader():
 
         self.last_resp = FakeResponse()
       else:
-        with open(fn, "rb") as f:
-          self.last_resp = requests.put(url, data=f, headers=headers, timeout=10)
+        self.last_resp = self.put_file(url, headers, fn)
     except Exception as e:
       self.last_exc = (e, traceback.format_exc())
       raise
 
+  def put_file(self, url, headers, fn):
+    st = os.stat(fn)
+    if st.st_size <= UPLOAD_CHUNK_SIZE:
+      with open(fn, "rb") as f:
+        return self.session.put(url, data=f, headers=headers, timeout=UPLOAD_TIMEOUT)
+    return self.put_blocks(url, headers, fn, st)
+
+  def put_block(self, url, headers, fn, i):
+    with open(fn, "rb") as f:
+      f.seek(i * UPLOAD_CHUNK_SIZE)
+      dat = f.read(UPLOAD_CHUNK_SIZE)
+    return self.session.put(block_url(url, "comp=block&blockid=" + quote(block_id(i))),
+                            data=dat, headers=headers, timeout=UPLOAD_TIMEOUT)
+
+  def put_blocks(self, url, headers, fn, st):
+    '''Uploads fn as blocks that are committed with a block list at the end.
+    Blocks the server acknowledged are stored in an xattr of the file, an
+    upload that failed or was killed resumes with the missing blocks.'''
+    stamp = "%d %d %d" % (UPLOAD_CHUNK_SIZE, st.st_size, st.st_mtime_ns)
+    num_blocks = -(-st.st_size // UPLOAD_CHUNK_SIZE)
+    done = get_upload_progress(fn, stamp)
+
+    futures = {self.executor.submit(self.put_block, url, headers, fn, i): i
+               for i in range(num_blocks) if not (done >> i) & 1}
+    failed, exc = None, None
+    for future in as_completed(futures):
+      if future.cancelled():
+        continue
+      try:
+        resp = future.result()
+      except Exception as e:
+        resp, exc = None, exc or e
+      if resp is not None and resp.status_code in (200, 201):
+        done |= 1 << futures[future]
+        set_upload_progress(fn, stamp, done)
+        continue
+
+      # let running blocks finish, they are kept for the next attempt
+      if failed is None:
+        failed = resp
+      for f in futures:
+        f.cancel()
+
+    if exc is not None:
+      raise exc
+    if failed is not None:
+      return failed
+
+    block_list = "".join("<Latest>%s</Latest>" % block_id(i) for i in range(num_blocks))
+    resp = self.session.put(block_url(url, "comp=blocklist"), headers=headers, timeout=UPLOAD_TIMEOUT,
+                            data='<?xml version="1.0" encoding="utf-8"?><BlockList>%s</BlockList>' % block_list)
+    if resp.status_code < 500:
+      # committed, or the server lost the blocks, start over next time
+      set_upload_progress(fn, stamp, 0)
+    return resp
+
   def normal_upload(self, key, fn):
     self.last_resp = None
     self.last_exc = None
@@ -204,6 +366,7 @@ class Uploader():
       try:
         # tag files of 0 size as uploaded
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+        self.upload_queue.discard(key)
       except OSError:
         cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
       success = True
@@ -215,6 +378,7 @@ class Uploader():
         try:
           # tag file as uploaded
           setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+          self.upload_queue.discard(key)
         except OSError:
           cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
         success = True
@@ -0,0 +1,110 @@
+"""Batched NumPy versions of the per-point geometry in mapd_helpers.
+
+Everything here works on whole (N, 3) arrays of (lat, lon, alt) or car frame
+points at once instead of looping over nodes in Python."""
+import math
+import numpy as np
+from functools import lru_cache
+
+# WGS84, same constants as common/transformations/coordinates.cc
+A = 6378137.
+ESQ = 6.69437999014 * 0.001
+
+
+def geodetic2ecef_batch(geodetic):
+  geodetic = np.asarray(geodetic, dtype=np.float64)
+  lat = np.radians(geodetic[:, 0])
+  lon = np.radians(geodetic[:, 1])
+  alt = geodetic[:, 2]
+  xi = np.sqrt(1.0 - ESQ * np.sin(lat)**2)
+  ecef = np.empty_like(geodetic)
+  ecef[:, 0] = (A / xi + alt) * np.cos(lat) * np.cos(lon)
+  ecef[:, 1] = (A / xi + alt) * np.cos(lat) * np.sin(lon)
+  ecef[:, 2] = (A / xi * (1.0 - ESQ) + alt) * np.sin(lat)
+  return ecef
+
+
+class CarFrame():
+  """Transform from geodetic coordinates into the car frame (x forward, y left)
+  at a given position and heading, as done by Way.points_in_car_frame"""
+  def __init__(self, lat, lon, heading):
+    self.origin = geodetic2ecef_batch([[lat, lon, 0.]])[0]
+
+    lat, lon = math.radians(lat), math.radians(lon)
+    ned2ecef = np.array([[-math.sin(lat) * math.cos(lon), -math.sin(lon), -math.cos(lat) * math.cos(lon)],
+                         [-math.sin(lat) * math.sin(lon), math.cos(lon), -math.cos(lat) * math.sin(lon)],
+                         [math.cos(lat), 0., -math.sin(lat)]])
+    heading = math.radians(-heading + 90)
+    c, s = math.cos(heading), math.sin(heading)
+    rot = np.array([[c, s, 0.], [-s, c, 0.], [0., 0., 1.]])
+    # ecef -> ned, swap north/east, then rotate with heading, all in one matrix
+    self.ecef2car = np.ascontiguousarray(rot.dot(ned2ecef.T[(1, 0, 2), :]))
+
+  def from_ecef(self, ecef):
+    return (ecef - self.origin).dot(self.ecef2car.T)
+
+  def from_geodetic(self, geodetic):
+    return self.from_ecef(geodetic2ecef_batch(geodetic))
+
+
+@lru_cache(maxsize=4)
+def car_frame(lat, lon, heading):
+  """All ways of one mapd cycle are transformed with the same frame"""
+  return CarFrame(lat, lon, heading)
+
+
+def circles_through_points(pnts, direction=False):
+  """circle_through_points for every consecutive triple of pnts.
+  Returns an (N - 2, 3) array of (x, y, radius)."""
+  x1, y1 = pnts[:-2, 0], pnts[:-2, 1]
+  x2, y2 = pnts[1:-1, 0], pnts[1:-1, 1]
+  x3, y3 = pnts[2:, 0], pnts[2:, 1]
+  s1, s2, s3 = x1**2 + y1**2, x2**2 + y2**2, x3**2 + y3**2
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    A = x1 * (y2 - y3) - y1 * (x2 - x3) + x2 * y3 - x3 * y2
+    B = s1 * (y3 - y2) + s2 * (y1 - y3) + s3 * (y2 - y1)
+    C = s1 * (x2 - x3) + s2 * (x3 - x1) + s3 * (x1 - x2)
+    D = s1 * (x3 * y2 - x2 * y3) + s2 * (x1 * y3 - x3 * y1) + s3 * (x2 * y1 - x1 * y2)
+    off_line = np.abs((y3 - y1) * x2 - (x3 - x1) * y2 + x3 * y1 - y3 * x1) / np.sqrt((y3 - y1)**2 + (x3 - x1)**2)
+
+    radius = np.sqrt((B**2 + C**2 - 4 * A * D) / (4 * A**2))
+    if direction:
+      left = (x2 - x1) * (y3 - y1) - (y2 - y1) * (x3 - x1) > 0
+      radius = np.where(left, radius, -radius)
+    radius = np.where(off_line > 0.1, radius, 10000.)
+    return np.column_stack([-B / (2 * A), -C / (2 * A), radius])
+
+
+def rate_curvature(pnts, curvature):
+  """rate_curvature_points for every point pair, with a leading 0 so the result lines up with curvature"""
+  step = np.sqrt((pnts[2:-1, 0] - pnts[1:-2, 0])**2 + (pnts[2:-1, 1] - pnts[1:-2, 1])**2)
+  c2, c3 = curvature[:-1], curvature[1:]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    rate = np.where(np.abs(c3) > np.abs(c2), np.abs((c3 - c2) / step), 0.)
+  return np.concatenate([[0.], rate])
+
+
+def path_distances(pnts):
+  """Cumulative distance along a polyline"""
+  return np.concatenate([[0.], np.cumsum(np.linalg.norm(np.diff(pnts, axis=0), axis=1))])
+
+
+def closest_arc_length(pnts, dist):
+  """Distance along the polyline pnts, with cumulative distances dist, of its
+  point closest to the origin in x and y, e.g. the car for car frame points"""
+  if len(pnts) < 2:
+    return dist[0]
+  start = pnts[:-1, :2]
+  seg = np.diff(pnts[:, :2], axis=0)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    t = np.clip(np.nan_to_num(-np.sum(start * seg, axis=1) / np.sum(seg**2, axis=1)), 0., 1.)
+  i = np.argmin(np.sum((start + t[:, None] * seg)**2, axis=1))
+  return dist[i] + t[i] * (dist[i + 1] - dist[i])
+
+
+def segment_argmin(values, starts, lengths):
+  """Index of the first minimum of values within each segment"""
+  seg = np.repeat(np.arange(len(starts)), lengths)
+  order = np.lexsort((values, seg))
+  return order[starts]
@@ -2,23 +2,24 @@
 
 import time
 import math
-import overpy
-import socket
-import requests
 import threading
 import numpy as np
 # setup logging
 import logging
 import logging.handlers
-from scipy import spatial
 import selfdrive.crash as crash
 from common.params import Params
-from collections import defaultdict
 import cereal.messaging as messaging
 import cereal.messaging_arne as messaging_arne
+from common.profiler import Profiler
+from common.travis_checker import travis
 from selfdrive.version import version, dirty
 from common.transformations.coordinates import geodetic2ecef
-from selfdrive.mapd.mapd_helpers import MAPS_LOOKAHEAD_DISTANCE, Way, circle_through_points, rate_curvature_points
+from selfdrive.mapd.mapd_helpers import MAPS_LOOKAHEAD_DISTANCE, Way
+from selfdrive.mapd.car_frame import circles_through_points, rate_curvature, path_distances
+from selfdrive.mapd.tile_cache import TileCache, position_ahead, tiles_around
+from selfdrive.mapd.overpass_client import Endpoint, OverpassClient, OverpassUnavailable
+from selfdrive.mapd.spatial_index import SpatialIndex
 
 #DEFAULT_SPEEDS_BY_REGION_JSON_FILE = BASEDIR + "/selfdrive/mapd/default_speeds_by_region.json"
 #from selfdrive.mapd import default_speeds_generator
@@ -55,43 +56,29 @@ class QueryThread(LoggerThread):
         LoggerThread.__init__(self, threadID, name)
         self.sharedParams = sharedParams
         # memorize some parameters
-        self.OVERPASS_API_LOCAL = "http://192.168.43.1:12345/api/interpreter"
-        socket.setdefaulttimeout(15)
         self.distance_to_edge = 500
-        self.OVERPASS_API_URL = "https://z.overpass-api.de/api/interpreter"
-        self.OVERPASS_API_URL2 = "https://lz4.overpass-api.de/api/interpreter"
-        self.OVERPASS_HEADERS = {
-            'User-Agent': 'NEOS (comma.ai)',
-            'Accept-Encoding': 'gzip'
-        }
+        self.overpass = OverpassClient([
+            Endpoint("http://192.168.43.1:12345/api/interpreter", timeout=15.0, local=True),
+            Endpoint("https://z.overpass-api.de/api/interpreter", timeout=15.0),
+            Endpoint("https://lz4.overpass-api.de/api/interpreter", timeout=10.0),
+        ])
         self.prev_ecef = None
-
-    def is_connected_to_local(self, timeout=3.0):
-        try:
-            requests.get(self.OVERPASS_API_LOCAL, timeout=timeout)
-            self.logger.debug("connection local active")
-            return True
-        except:
-            self.logger.error("No local server available.")
-            return False
-
-    def is_connected_to_internet(self, timeout=1.0):
-        try:
-            requests.get(self.OVERPASS_API_URL, timeout=timeout)
-            self.logger.debug("connection 1 active")
-            return True
-        except:
-            self.logger.error("No internet connection available.")
-            return False
-
-    def is_connected_to_internet2(self, timeout=1.0):
-        try:
-            requests.get(self.OVERPASS_API_URL2, timeout=timeout)
-            self.logger.debug("connection 2 active")
-            return True
-        except:
-            self.logger.error("No internet connection available.")
-            return False
+        self.tile_cache = TileCache()
+        self.spatial_index = SpatialIndex()
+
+    def fetch_tiles(self, keys):
+        """Downloads tiles in parallel, joining prefetches that are already running"""
+        futures = [self.overpass.prefetch(key, self.tile_cache.fetch, self.overpass, key) for key in keys]
+        for future in futures:
+            future.result()
+
+    def prefetch_ahead(self, gps, radius):
+        """Starts downloading the region the car is heading to before it reaches the edge of the current one"""
+        if gps.accuracy >= 5.0 or self.overpass.best_endpoint() is None:
+            return
+        lat, lon = position_ahead(gps.latitude, gps.longitude, gps.bearing, radius)
+        for key in self.tile_cache.missing_tiles(tiles_around(lat, lon, radius / 2)):
+            self.overpass.prefetch(key, self.tile_cache.fetch, self.overpass, key)
 
     def build_way_query(self, lat, lon, heading, radius=50):
         """Builds a query to find all highways within a given radius around a point"""
@@ -139,6 +126,8 @@ class QueryThread(LoggerThread):
             else:
                 continue
 
+            self.prefetch_ahead(last_gps, radius)
+
             last_query_pos = self.sharedParams.get('last_query_pos', None)
             if last_query_pos is not None:
                 cur_ecef = geodetic2ecef((last_gps.latitude, last_gps.longitude, last_gps.altitude))
@@ -162,57 +151,45 @@ class QueryThread(LoggerThread):
             if last_gps is not None and last_gps.accuracy < 5.0:
                 q, lat, lon = self.build_way_query(last_gps.latitude, last_gps.longitude, last_gps.bearing, radius=radius)
                 try:
-                    if self.is_connected_to_local():
-                        api = overpy.Overpass(url=self.OVERPASS_API_LOCAL)
-                        api.timeout = 15.0
+                    tiles = tiles_around(lat, lon, radius)
+                    missing_tiles = self.tile_cache.missing_tiles(tiles)
+                    if not missing_tiles:
+                        self.logger.debug("all tiles cached, skipping overpass query")
                         self.distance_to_edge = radius * 3 / 8
-                    elif self.is_connected_to_internet():
-                        api = overpy.Overpass(url=self.OVERPASS_API_URL)
-                        self.logger.error("Using origional Server")
-                        self.distance_to_edge = radius/4
-                    elif self.is_connected_to_internet2():
-                        api = overpy.Overpass(url=self.OVERPASS_API_URL2)
-                        api.timeout = 10.0
-                        self.logger.error("Using backup Server")
-                        self.distance_to_edge = radius/4
                     else:
-                        continue
-                    new_result = api.query(q)
-                    self.logger.debug("new_result = %s" % str(new_result))
-                    # Build kd-tree
-                    nodes = []
-                    real_nodes = []
-                    node_to_way = defaultdict(list)
-                    location_info = {}
-
-                    for n in new_result.nodes:
-                        nodes.append((float(n.lat), float(n.lon), 0))
-                        real_nodes.append(n)
-
-                    for way in new_result.ways:
-                        for n in way.nodes:
-                            node_to_way[n.id].append(way)
-
-                    for area in new_result.areas:
-                        if area.tags.get('admin_level', '') == "2":
-                            location_info['country'] = area.tags.get('ISO3166-1:alpha2', '')
-                        elif area.tags.get('admin_level', '') == "4":
-                            location_info['region'] = area.tags.get('name', '')
-
-                    nodes = np.asarray(nodes)
-                    nodes = geodetic2ecef(nodes)
-                    tree = spatial.KDTree(nodes)
-                    self.logger.debug("query thread, ... %s %s" % (str(nodes), str(tree)))
-
-                    # write result
+                        try:
+                            self.fetch_tiles(missing_tiles)
+                        except OverpassUnavailable as e:
+                            self.logger.error("No overpass server available: %s" % str(e))
+                            continue
+                        endpoint = self.overpass.best_endpoint()
+                        if endpoint is not None and endpoint.local:
+                            self.distance_to_edge = radius * 3 / 8
+                        else:
+                            self.distance_to_edge = radius/4
+                        self.logger.debug("overpass endpoints: %s" % str(self.overpass.endpoints))
+                    # Slide the index: tiles that left the circle are evicted and new ones inserted,
+                    # the KD-trees of all other tiles are reused as they are
+                    index = self.spatial_index.evict(self.spatial_index.keys - set(tiles))
+                    for key in tiles:
+                        if key not in index.keys:
+                            tile = self.tile_cache.get(key)
+                            if tile is not None:
+                                index = index.insert(tile)
+                    self.spatial_index = index
+                    self.logger.debug("spatial index with %d nodes in %d tiles" % (len(index), len(index.batches)))
+
+                    # write result, the index is built above so the lock is only held for the assignments.
+                    # The result, its position and cache_valid are published together
+                    query_result = index.query_result
                     query_lock = self.sharedParams.get('query_lock', None)
                     if query_lock is not None:
                         query_lock.acquire()
+                        self.sharedParams['last_query_result'] = query_result
                         last_gps_mod = last_gps.as_builder()
                         last_gps_mod.latitude = lat
                         last_gps_mod.longitude = lon
                         last_gps = last_gps_mod.as_reader()
-                        self.sharedParams['last_query_result'] = new_result, tree, real_nodes, node_to_way, location_info
                         self.prev_ecef = geodetic2ecef((last_gps.latitude, last_gps.longitude, last_gps.altitude))
                         self.sharedParams['last_query_pos'] = last_gps
                         self.sharedParams['cache_valid'] = True
@@ -241,6 +218,7 @@ class MapsdThread(LoggerThread):
         LoggerThread.__init__(self, threadID, name)
         self.sharedParams = sharedParams
         self.pm = messaging.PubMaster(['liveMapData'])
+        self.prof = Profiler(not travis, 'mapd')
         self.logger.debug("entered mapsd_thread, ... %s" % ( str(self.pm)))
     def run(self):
         self.logger.debug("Entered run method for thread :" + str(self.name))
@@ -264,6 +242,8 @@ class MapsdThread(LoggerThread):
                 continue
             else:
                 start = time.time()
+            self.prof.tick()
+            self.prof.checkpoint("Wait", ignore=True)
             self.logger.debug("starting new cycle in endless loop")
             query_lock = self.sharedParams.get('query_lock', None)
             query_lock.acquire()
@@ -300,7 +280,14 @@ class MapsdThread(LoggerThread):
                     fix_ok = False
             elif not had_good_gps:
                 had_good_gps = True
-            if not fix_ok or self.sharedParams['last_query_result'] is None or not self.sharedParams['cache_valid']:
+            # Published by QueryThread together with cache_valid, keep our own reference for this cycle.
+            # The index is immutable, so the closest way is searched without the lock
+            query_lock = self.sharedParams.get('query_lock', None)
+            query_lock.acquire()
+            query_result = self.sharedParams['last_query_result']
+            cache_valid = self.sharedParams['cache_valid']
+            query_lock.release()
+            if not fix_ok or query_result is None or not cache_valid:
                 self.logger.debug("fix_ok %s" % fix_ok)
                 self.logger.error("Error in fix_ok logic")
                 cur_way = None
@@ -319,9 +306,8 @@ class MapsdThread(LoggerThread):
                 heading = gps.bearing
                 speed = gps.speed
 
-                query_lock.acquire()
-                cur_way = Way.closest(self.sharedParams['last_query_result'], lat, lon, heading, cur_way)
-                query_lock.release()
+                cur_way = Way.closest(query_result, lat, lon, heading, cur_way)
+                self.prof.checkpoint("Closest way")
 
                 if cur_way is not None:
                     self.logger.debug("cur_way is not None ...")
@@ -344,8 +330,7 @@ class MapsdThread(LoggerThread):
                     if curvature_valid:
                     # Compute the curvature for each point
                         with np.errstate(divide='ignore'):
-                            circles = [circle_through_points(*p, direction=True) for p in zip(pnts, pnts[1:], pnts[2:])]
-                            circles = np.asarray(circles)
+                            circles = circles_through_points(pnts, direction=True)
                             radii = np.nan_to_num(circles[:, 2])
                             radii[abs(radii) < 15.] = 10000
 
@@ -355,8 +340,7 @@ class MapsdThread(LoggerThread):
                                 radii = radii*2.8
 
                             curvature = 1. / radii
-                        rate = [rate_curvature_points(*p) for p in zip(pnts[1:], pnts[2:],curvature[0:],curvature[1:])]
-                        rate = ([0] + rate)
+                        rate = rate_curvature(pnts, curvature)
 
                         curvature = np.abs(curvature)
                         curvature = np.multiply(np.minimum(np.multiply(rate,4000)+0.7,1.1),curvature)
@@ -365,11 +349,7 @@ class MapsdThread(LoggerThread):
                         dist_to_closest = pnts[closest, 0]  # We can use x distance here since it should be close
 
                         # Compute distance along path
-                        dists = list()
-                        dists.append(0)
-                        for p, p_prev in zip(pnts, pnts[1:, :]):
-                            dists.append(dists[-1] + np.linalg.norm(p - p_prev))
-                        dists = np.asarray(dists)
+                        dists = path_distances(pnts)
                         dists = dists - dists[closest] + dist_to_closest
                         dists = dists[1:-1]
 
@@ -455,6 +435,7 @@ class MapsdThread(LoggerThread):
             dat.liveMapData.mapValid = map_valid
             self.logger.debug("Sending ... liveMapData ... %s", str(dat))
             self.pm.send('liveMapData', dat)
+            self.prof.checkpoint("Lookahead and send")
 
 class MessagedGPSThread(LoggerThread):
     def __init__(self, threadID, name, sharedParams={}):
@@ -5,7 +5,8 @@ from datetime import datetime
 from common.basedir import BASEDIR
 from common.op_params import opParams
 from selfdrive.config import Conversions as CV
-from common.transformations.coordinates import LocalCoord, geodetic2ecef
+from common.transformations.coordinates import geodetic2ecef
+from selfdrive.mapd.car_frame import car_frame, closest_arc_length, geodetic2ecef_batch, path_distances, segment_argmin
 
 LOOKAHEAD_TIME = 10.
 MAPS_LOOKAHEAD_DISTANCE = 50 * LOOKAHEAD_TIME
@@ -171,18 +172,105 @@ def geocode_maxspeed(tags, location_info):
   max_speed = parse_speed_unit(max_speed)
   return max_speed
 
+def way_points(way):
+  """(lat, lon, 0) array of a way's nodes, computed once per overpy way"""
+  if not hasattr(way, '_points'):
+    way._points = np.asarray([(float(node.lat), float(node.lon), 0.) for node in way.get_nodes(resolve_missing=False)])
+  return way._points
+
+def way_ecef(way):
+  if not hasattr(way, '_ecef'):
+    way._ecef = geodetic2ecef_batch(way_points(way))
+  return way._ecef
+
+def way_backwards(way, heading):
+  """True if heading points from the last towards the first node of the way"""
+  points = way_points(way)
+  angle=heading - math.atan2(points[0, 1]-points[-1, 1],points[0, 0]-points[-1, 0])*180/3.14159265358979 - 180
+  if angle < -180:
+    angle = angle + 360
+  if angle > 180:
+    angle = angle - 360
+  return abs(angle) > 90
+
+STOP_HIGHWAY_TAGS = ('stop', 'give_way', 'mini_roundabout', 'traffic_signals')
+
+class WayProfile():
+  """Parsed speed tags and the arc length of the speed limiting nodes of a way,
+  so the 10 Hz lookahead finds the nodes ahead with a binary search instead of
+  re-parsing tags and visiting every node on every cycle"""
+  def __init__(self, way):
+    self.tags = tags = way.tags
+    points = way_points(way)
+
+    # Cumulative distance along the way at every node
+    self.dist = path_distances(way_ecef(way))
+    self.length = self.dist[-1]
+
+    # Speed limits, conditional limits depend on the time and are parsed when needed
+    self.maxspeed_directional = {
+      False: parse_speed_unit(tags['maxspeed:forward']) if 'maxspeed:forward' in tags else None,
+      True: parse_speed_unit(tags['maxspeed:backward']) if 'maxspeed:backward' in tags else None,
+    }
+    self.has_directional = {False: 'maxspeed:forward' in tags, True: 'maxspeed:backward' in tags}
+    self.conditional = 'maxspeed:conditional' in tags
+    self.maxspeed = None if self.conditional else parse_speed_tags(tags)
+
+    self.roundabout_speed = None
+    if tags.get('junction') in ('roundabout', 'circular') and len(points) > 1:
+      latmin, lonmin = np.min(points[:, :2], axis=0)
+      latmax, lonmax = np.max(points[:, :2], axis=0)
+      if way._node_ids[0] == way._node_ids[-1]:
+        a = 111132.954*math.cos(float(latmax+latmin)/360*3.141592)*float(lonmax-lonmin)
+      else:
+        if way._node_ids[1] == way._node_ids[-1]:
+          circle = [0,0,30]
+        else:
+          circle = circle_through_points([points[0, 0],points[0, 1],1], [points[1, 0],points[1, 1],1], [points[-1, 0],points[-1, 1],1],True)
+        a = 111132.954*math.cos(float(latmax+latmin)/360*3.141592)*float(circle[2])*2
+      self.roundabout_speed = np.sqrt(2.0*a)
+
+    # Stops, signals, crossings and traffic calming along the way
+    self.feature_idx = []
+    self.feature_nodes = []
+    for i, n in enumerate(way.get_nodes(resolve_missing=False)):
+      if n.tags.get('highway') in STOP_HIGHWAY_TAGS or n.tags.get('railway') == 'level_crossing' or 'traffic_calming' in n.tags:
+        self.feature_idx.append(i)
+        self.feature_nodes.append(n)
+    self.feature_idx = np.array(self.feature_idx, dtype=np.int64)
+    self.feature_dist = self.dist[self.feature_idx]
+
+  def features_ahead(self, start, length, backwards):
+    """Indices into feature_nodes of the features at most length ahead of arc length start, nearest first"""
+    if backwards:
+      lo, hi = np.searchsorted(self.feature_dist, [start - length, start], side='left')
+      return range(hi - 1, lo - 1, -1)
+    lo, hi = np.searchsorted(self.feature_dist, [start, start + length], side='right')
+    return range(lo, hi)
+
+  def max_speed(self, backwards):
+    if self.has_directional[backwards]:
+      return self.maxspeed_directional[backwards]
+    return self.parsed_maxspeed()
+
+  def parsed_maxspeed(self):
+    """parse_speed_tags of the way, cached unless it depends on the time of day"""
+    if self.conditional:
+      return parse_speed_tags(self.tags)
+    return self.maxspeed
+
+def way_profile(way):
+  if not hasattr(way, '_profile'):
+    way._profile = WayProfile(way)
+  return way._profile
+
 class Way:
   def __init__(self, way, query_results):
     self.id = way.id
     self.way = way
     self.query_results = query_results
 
-    points = list()
-
-    for node in self.way.get_nodes(resolve_missing=False):
-      points.append((float(node.lat), float(node.lon), 0.))
-
-    self.points = np.asarray(points)
+    self.points = way_points(way)
 
   @classmethod
   def closest(cls, query_results, lat, lon, heading, prev_way=None):
@@ -196,7 +284,7 @@ class Way:
     #      way = prev_way.next_way(heading)
     #      if way is not None and way.on_way(lat, lon, heading):
     #        return way
-        
+
       results, tree, real_nodes, node_to_way, location_info = query_results
 
     cur_pos = geodetic2ecef((lat, lon, 0))
@@ -206,82 +294,61 @@ class Way:
     if not nodes:
       nodes = [tree.query(cur_pos)[1]]
 
-    ways = []
+    ways = {}
     for n in nodes:
       real_node = real_nodes[n]
-      ways += node_to_way[real_node.id]
-    ways = set(ways)
-
-    closest_way = None
-    best_score = None
-    for way in ways:
-      way = Way(way, query_results)
-      # don't consider backward facing roads
-      if 'oneway' in way.way.tags and way.way.tags['oneway'] == 'yes':
-        angle=heading - math.atan2(way.way.nodes[0].lon-way.way.nodes[-1].lon,way.way.nodes[0].lat-way.way.nodes[-1].lat)*180/3.14159265358979 - 180
-        if angle < -180:
-          angle = angle + 360
-        if angle > 180:
-          angle = angle - 360
-        backwards = abs(angle) > 90
-        if backwards:
-          continue
-
-      points = way.points_in_car_frame(lat, lon, heading, True)
-
-      on_way = way.on_way(lat, lon, heading, points)
-      if not on_way:
-        continue
-
-      # Create mask of points in front and behind
-      x = points[:, 0]
-      y = points[:, 1]
-      angles = np.arctan2(y, x)
-      front = np.logical_and((-np.pi / 2) < angles, angles < (np.pi / 2))
-      if all(front):
-        angles[angles==0] = np.pi
-        front = np.logical_and((-np.pi / 2) < angles,angles < (np.pi / 2))
-      behind = np.logical_not(front)
-
-      dists = np.linalg.norm(points, axis=1)
-
-      # Get closest point behind the car
-      dists_behind = np.copy(dists)
-      dists_behind[front] = np.NaN
-      closest_behind = points[np.nanargmin(dists_behind)]
-
-      # Get closest point in front of the car
-      dists_front = np.copy(dists)
-      dists_front[behind] = np.NaN
-      closest_front = points[np.nanargmin(dists_front)]
-
-      # fit line: y = a*x + b
-      x1, y1, _ = closest_behind
-      x2, y2, _ = closest_front
-      a = (y2 - y1) / max((x2 - x1), 1e-5)
-      b = y1 - a * x1
-
-      # With a factor of 60 a 20m offset causes the same error as a 20 degree heading error
-      # (A 20 degree heading offset results in an a of about 1/3)
-      score = abs(a) * (abs(b) + 1) * 3. + abs(b)
-
-      # Prefer same type of road
-      if prev_way is not None:
-        if way.way.tags.get('highway', '') == prev_way.way.tags.get('highway', ''):
-          score *= 0.5
-
-      if closest_way is None or score < best_score:
-        closest_way = way
-        best_score = score
-        
-    if best_score is None:
+      for way in node_to_way[real_node.id]:
+        ways[way.id] = way
+
+    # don't consider backward facing roads
+    ways = [way for way in ways.values() if not (way.tags.get('oneway') == 'yes' and way_backwards(way, heading))]
+    if not ways:
       return None
-    
+
+    # Transform all candidate ways into the car frame at once
+    lengths = np.array([len(way._node_ids) for way in ways])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    points = car_frame(lat, lon, heading).from_ecef(np.vstack([way_ecef(way) for way in ways]))
+    x = points[:, 0]
+    y = points[:, 1]
+
+    on_way = np.logical_and(np.minimum.reduceat(x, starts) <= 0., np.maximum.reduceat(x, starts) > 0.)
+
+    # Create mask of points in front and behind
+    angles = np.arctan2(y, x)
+    front = np.logical_and((-np.pi / 2) < angles, angles < (np.pi / 2))
+    all_front = np.repeat(np.logical_and.reduceat(front, starts), lengths)
+    front[np.logical_and(all_front, angles == 0)] = False
+    dists = np.linalg.norm(points, axis=1)
+
+    # Closest point behind and in front of the car for every way
+    closest_behind = points[segment_argmin(np.where(front, np.inf, dists), starts, lengths)]
+    closest_front = points[segment_argmin(np.where(front, dists, np.inf), starts, lengths)]
+
+    # fit line: y = a*x + b
+    x1, y1 = closest_behind[:, 0], closest_behind[:, 1]
+    x2, y2 = closest_front[:, 0], closest_front[:, 1]
+    a = (y2 - y1) / np.maximum(x2 - x1, 1e-5)
+    b = y1 - a * x1
+
+    # With a factor of 60 a 20m offset causes the same error as a 20 degree heading error
+    # (A 20 degree heading offset results in an a of about 1/3)
+    score = np.abs(a) * (np.abs(b) + 1) * 3. + np.abs(b)
+
+    # Prefer same type of road
+    if prev_way is not None:
+      prev_highway = prev_way.way.tags.get('highway', '')
+      score[[way.tags.get('highway', '') == prev_highway for way in ways]] *= 0.5
+
+    score[~on_way] = np.inf
+    best = int(np.argmin(score))
+    best_score = score[best]
+
     # Normal score is < 5
     if best_score > 50:
       return None
 
-    return closest_way
+    return Way(ways[best], query_results)
 
   def __str__(self):
     return "%s %s" % (self.id, self.way.tags)
@@ -290,24 +357,12 @@ class Way:
     """Extracts the (conditional) speed limit from a way"""
     if not self.way:
       return None
-    angle=heading - math.atan2(self.way.nodes[0].lon-self.way.nodes[-1].lon,self.way.nodes[0].lat-self.way.nodes[-1].lat)*180/3.14159265358979 - 180
-    if angle < -180:
-      angle = angle + 360
-    if angle > 180:
-      angle = angle - 360
-    backwards = abs(angle) > 90
-    if backwards:
-      if 'maxspeed:backward' in self.way.tags:
-        max_speed = self.way.tags['maxspeed:backward']
-        max_speed = parse_speed_unit(max_speed)
-        return max_speed
-    else:
-      if 'maxspeed:forward' in self.way.tags:
-        max_speed = self.way.tags['maxspeed:forward']
-        max_speed = parse_speed_unit(max_speed)
-        return max_speed
+    profile = way_profile(self.way)
+    backwards = way_backwards(self.way, heading)
+    if profile.has_directional[backwards]:
+      return profile.maxspeed_directional[backwards]
 
-    max_speed = parse_speed_tags(self.way.tags)
+    max_speed = profile.parsed_maxspeed()
     if not max_speed:
       location_info = self.query_results[4]
       max_speed = geocode_maxspeed(self.way.tags, location_info)
@@ -323,76 +378,31 @@ class Way:
     speed_ahead_dist = None
     lookahead_ways = 5
     way = self
+    dist_to_way = 0.  # along the road to where the way is entered
     for i in range(lookahead_ways):
-      way_pts = way.points_in_car_frame(lat, lon, heading, True)
-      #print way_pts
-      # Check current lookahead distance
-      if way_pts[0,0] < 0 and way_pts[-1,0] < 0:
+      if dist_to_way > 2 * lookahead:
+        #print "max_dist break"
         break
-      elif way_pts[0,0] < 0:
-        max_dist = np.linalg.norm(way_pts[-1, :])
-      elif way_pts[-1,0] < 0:
-        max_dist = np.linalg.norm(way_pts[0, :])
+      profile = way_profile(way.way)
+      backwards = way_backwards(way.way, heading)
+      if i == 0:
+        # where the car is on the current way, the ways after it are entered at an end
+        start = closest_arc_length(car_frame(lat, lon, heading).from_ecef(way_ecef(way.way)), profile.dist)
       else:
-        max_dist = min(np.linalg.norm(way_pts[1, :]),np.linalg.norm(way_pts[0, :]),np.linalg.norm(way_pts[-1, :]))
-         
+        start = profile.length if backwards else 0.
 
-      if max_dist > 2 * lookahead:
-        #print "max_dist break"
+      if profile.roundabout_speed is not None:
+        speed_ahead = profile.roundabout_speed
+        speed_ahead_dist = min(999.9, dist_to_way)
         break
-      try:
-        if way.way.tags['junction']=='roundabout' or way.way.tags['junction']=='circular':
-          latmin = 181
-          lonmin = 181
-          latmax = -181
-          lonmax = -181
-          for n in way.way.nodes:
-            lonmax = max(n.lon,lonmax)
-            lonmin = min(n.lon,lonmin)
-            latmax = max(n.lat,latmax)
-            latmin = min(n.lat,latmin)
-          if way.way.nodes[0].id == way.way.nodes[-1].id:
-            a = 111132.954*math.cos(float(latmax+latmin)/360*3.141592)*float(lonmax-lonmin)
-          else:
-            if way.way.nodes[1].id == way.way.nodes[-1].id:
-              circle = [0,0,30]
-            else:
-              circle = circle_through_points([way.way.nodes[0].lat,way.way.nodes[0].lon,1], [way.way.nodes[1].lat,way.way.nodes[1].lon,1], [way.way.nodes[-1].lat,way.way.nodes[-1].lon,1],True)
-            a = 111132.954*math.cos(float(latmax+latmin)/360*3.141592)*float(circle[2])*2
-          speed_ahead = np.sqrt(2.0*a)
-          min_dist = 999.9
-          for w in way_pts:
-            min_dist = min(min_dist, float(np.linalg.norm(w)))
-          speed_ahead_dist = min_dist
+      if profile.has_directional[backwards]:
+        spd = profile.maxspeed_directional[backwards]
+        if spd is not None and spd < current_speed_limit:
+          speed_ahead = spd
+          speed_ahead_dist = dist_to_way
           break
-      except KeyError:
-        pass
-      angle=heading - math.atan2(way.way.nodes[0].lon-way.way.nodes[-1].lon,way.way.nodes[0].lat-way.way.nodes[-1].lat)*180/3.14159265358979 - 180
-      if angle < -180:
-        angle = angle + 360
-      if angle > 180:
-        angle = angle - 360
-      backwards = abs(angle) > 90
-      if backwards:
-        if 'maxspeed:backward' in way.way.tags:
-          spd = way.way.tags['maxspeed:backward']
-          spd = parse_speed_unit(spd)
-          if spd is not None and spd < current_speed_limit:
-            speed_ahead = spd
-            min_dist = min(np.linalg.norm(way_pts[1, :]),np.linalg.norm(way_pts[0, :]),np.linalg.norm(way_pts[-1, :]))
-            speed_ahead_dist = min_dist
-            break
-      else:
-        if 'maxspeed:forward' in way.way.tags:
-          spd = way.way.tags['maxspeed:forward']
-          spd = parse_speed_unit(spd)
-          if spd is not None and spd < current_speed_limit:
-            speed_ahead = spd
-            min_dist = min(np.linalg.norm(way_pts[1, :]),np.linalg.norm(way_pts[0, :]),np.linalg.norm(way_pts[-1, :]))
-            speed_ahead_dist = min_dist
-            break
       if 'maxspeed' in way.way.tags:
-        spd = parse_speed_tags(way.way.tags)
+        spd = profile.parsed_maxspeed()
         #print "spd found"
         #print spd
         if not spd:
@@ -402,20 +412,19 @@ class Way:
           #print spd
         if spd is not None and spd < current_speed_limit:
           speed_ahead = spd
-          min_dist = min(np.linalg.norm(way_pts[1, :]),np.linalg.norm(way_pts[0, :]),np.linalg.norm(way_pts[-1, :]))
-          speed_ahead_dist = min_dist
+          speed_ahead_dist = dist_to_way
           #print "slower speed found"
-          #print min_dist
           
           break
-      way_pts = way.points_in_car_frame(lat, lon, heading, False)
-      #print(way_pts)
+      # Only the precomputed stop, signal, crossing and calming nodes ahead within the lookahead can limit the speed
+      features = profile.features_ahead(start, 2 * lookahead - dist_to_way, backwards)
 
       try:
-        count = 0
         loop_must_break = False
-        for n in way.way.nodes:
-          if 'highway' in n.tags and (n.tags['highway']=='stop' or n.tags['highway']=='give_way' or n.tags['highway']=='mini_roundabout' or (n.tags['highway']=='traffic_signals' and traffic_lights)) and way_pts[count,0] > 0:
+        for k in features:
+          n = profile.feature_nodes[k]
+          x = dist_to_way + abs(profile.feature_dist[k] - start)
+          if 'highway' in n.tags and (n.tags['highway']=='stop' or n.tags['highway']=='give_way' or n.tags['highway']=='mini_roundabout' or (n.tags['highway']=='traffic_signals' and traffic_lights)) and x > 0:
             if traffic_status == 'DEAD':
               pass
             elif traffic_confidence >= 50 and n.tags['highway']=='traffic_signals' and (traffic_status == 'GREEN' or (traffic_status == 'NONE' and not last_not_none_signal == 'SLOW')):
@@ -428,8 +437,8 @@ class Way:
             if 'direction' in n.tags:
               if backwards and (n.tags['direction']=='backward' or n.tags['direction']=='both'):
                 #print("backward")
-                if way_pts[count, 0] > 0:
-                  speed_ahead_dist = max(0. , way_pts[count, 0] - 3.0)
+                if x > 0:
+                  speed_ahead_dist = max(0. , x - 3.0)
                   #print(speed_ahead_dist)
                   speed_ahead = 7/3.6
                   if n.tags['highway']=='stop':
@@ -441,8 +450,8 @@ class Way:
                   break
               elif not backwards and (n.tags['direction']=='forward' or n.tags['direction']=='both'):
                 #print("forward")
-                if way_pts[count, 0] > 0:
-                  speed_ahead_dist = max(0. , way_pts[count, 0] - 3.0)
+                if x > 0:
+                  speed_ahead_dist = max(0. , x - 3.0)
                   #print(speed_ahead_dist)
                   speed_ahead = 7/3.6
                   if n.tags['highway']=='stop':
@@ -461,7 +470,7 @@ class Way:
                   if direction > 180:
                     direction = direction - 360
                   if abs(direction) > 135:
-                    speed_ahead_dist = max(0. , way_pts[count, 0] - 3.0)
+                    speed_ahead_dist = max(0. , x - 3.0)
                     #print(speed_ahead_dist)
                     speed_ahead = 7/3.6
                     if n.tags['highway']=='stop':
@@ -476,8 +485,8 @@ class Way:
             elif 'traffic_signals:direction' in n.tags:
               if backwards and (n.tags['traffic_signals:direction']=='backward' or n.tags['traffic_signals:direction']=='both'):
                 #print("backward")
-                if way_pts[count, 0] > 0:
-                  speed_ahead_dist = max(0. , way_pts[count, 0] - 6.0)
+                if x > 0:
+                  speed_ahead_dist = max(0. , x - 6.0)
                   #print(speed_ahead_dist)
                   speed_ahead = 5/3.6
                   if n.tags['highway']=='traffic_signals':
@@ -486,8 +495,8 @@ class Way:
                   break
               elif not backwards and (n.tags['traffic_signals:direction']=='forward' or n.tags['traffic_signals:direction']=='both'):
                 #print("forward")
-                if way_pts[count, 0] > 0:
-                  speed_ahead_dist = max(0. , way_pts[count, 0] - 6.0)
+                if x > 0:
+                  speed_ahead_dist = max(0. , x - 6.0)
                   #print(speed_ahead_dist)
                   speed_ahead = 5/3.6
                   if n.tags['highway']=='traffic_signals':
@@ -503,7 +512,7 @@ class Way:
                   if direction > 180:
                     direction = direction - 360
                   if abs(direction) > 135:
-                    speed_ahead_dist = max(0. , way_pts[count, 0] - 6.0)
+                    speed_ahead_dist = max(0. , x - 6.0)
                     #print(speed_ahead_dist)
                     speed_ahead = 5/3.6
                     if n.tags['highway']=='traffic_signals':
@@ -514,15 +523,15 @@ class Way:
                 pass
             else:
               if n.tags['highway']=='mini_roundabout':
-                if way_pts[count, 0] > 0:
-                  speed_ahead_dist = max(0. , way_pts[count, 0] - 5.0)
+                if x > 0:
+                  speed_ahead_dist = max(0. , x - 5.0)
                   #print(speed_ahead_dist)
                   speed_ahead = 15/3.6
                   loop_must_break = True
                   break
-              if way_pts[count, 0] > 0 and traffic_lights_without_direction:
+              if x > 0 and traffic_lights_without_direction:
                 #print("no direction")
-                speed_ahead_dist = max(0. , way_pts[count, 0] - 10.0)
+                speed_ahead_dist = max(0. , x - 10.0)
                 #print(speed_ahead_dist)
                 speed_ahead = 5/3.6
                 if n.tags['highway']=='stop':
@@ -533,33 +542,33 @@ class Way:
                 loop_must_break = True
                 break
           if 'railway' in n.tags and n.tags['railway']=='level_crossing':
-            if way_pts[count, 0] > 0 and traffic_confidence >= 50 and traffic_status == 'SLOW':
+            if x > 0 and traffic_confidence >= 50 and traffic_status == 'SLOW':
               speed_ahead = 0
-              speed_ahead_dist = max(0. , way_pts[count, 0] - 10.0)
+              speed_ahead_dist = max(0. , x - 10.0)
               loop_must_break = True
               break
           if 'traffic_calming' in n.tags:
-            if way_pts[count, 0] > 0:
+            if x > 0:
               if n.tags['traffic_calming']=='bump' or n.tags['traffic_calming']=='hump':
                 speed_ahead = 2.24
-                speed_ahead_dist = way_pts[count, 0]
+                speed_ahead_dist = x
                 loop_must_break = True
                 break
               elif n.tags['traffic_calming']=='chicane' or n.tags['traffic_calming']=='choker':
                 speed_ahead = 20/3.6
-                speed_ahead_dist = way_pts[count, 0]
+                speed_ahead_dist = x
                 loop_must_break = True
                 break
               elif n.tags['traffic_calming']=='yes':
                 speed_ahead = 40/3.6
-                speed_ahead_dist = way_pts[count, 0]
+                speed_ahead_dist = x
                 loop_must_break = True
                 break
-          count += 1
         if loop_must_break: break
       except (KeyError, IndexError, ValueError):
         pass
       # Find next way
+      dist_to_way += start if backwards else profile.length - start
       way = way.next_way(heading)
       if not way:
         #print "no way break"
@@ -605,22 +614,11 @@ class Way:
     return np.min(np.linalg.norm(points, axis=1))
 
   def points_in_car_frame(self, lat, lon, heading, flip):
-    lc = LocalCoord.from_geodetic([lat, lon, 0.])
+    points_carframe = car_frame(lat, lon, heading).from_ecef(way_ecef(self.way))
 
-    # Build rotation matrix
-    heading = math.radians(-heading + 90)
-    c, s = np.cos(heading), np.sin(heading)
-    rot = np.array([[c, s, 0.], [-s, c, 0.], [0., 0., 1.]])
-
-    # Convert to local coordinates
-    points_carframe = lc.geodetic2ned(self.points).T
-
-    # Rotate with heading of car
-    points_carframe = np.dot(rot, points_carframe[(1, 0, 2), :]).T
-    
     if points_carframe[-1,0] < points_carframe[0,0] and flip:
       points_carframe = np.flipud(points_carframe)
-      
+
     return points_carframe
 
   def next_way(self, heading):
@@ -678,7 +676,7 @@ class Way:
               return way
         except (KeyError, IndexError):
           pass
-      ways = [w for w in ways if (w.nodes[0] == node or w.nodes[-1] == node)]
+      ways = [w for w in ways if (w._node_ids[0] == node.id or w._node_ids[-1] == node.id)]
       if len(ways) == 1:
         way = Way(ways[0], self.query_results)
         #print "only one way found"
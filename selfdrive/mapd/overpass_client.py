@@ -0,0 +1,149 @@
+import time
+import threading
+import overpy
+import requests
+from xml.sax import SAXException
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+OVERPASS_HEADERS = {
+  'User-Agent': 'NEOS (comma.ai)',
+  'Accept-Encoding': 'gzip'
+}
+
+FAILURE_THRESHOLD = 3  # consecutive failures before an endpoint is taken out of rotation
+COOLDOWN = 10.  # seconds, doubled on every failed retry
+MAX_COOLDOWN = 300.
+LATENCY_ALPHA = 0.3
+
+
+class OverpassUnavailable(Exception):
+  pass
+
+
+class Endpoint():
+  """Overpass server with latency/failure tracking and a circuit breaker.
+
+  After FAILURE_THRESHOLD consecutive failures the circuit opens and the
+  endpoint is skipped for a cooldown. Once it has passed a single trial
+  request is let through (half open), success closes the circuit again,
+  failure reopens it with a doubled cooldown."""
+  CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+  def __init__(self, url, timeout, local=False):
+    self.url = url
+    self.timeout = timeout
+    self.local = local
+
+    self.state = Endpoint.CLOSED
+    self.latency = 0.
+    self.failure_rate = 0.
+    self.consecutive_failures = 0
+    self.requests = 0
+    self.failures = 0
+    self.cooldown = COOLDOWN
+    self.open_until = 0.
+
+  def available(self, now):
+    if self.state == Endpoint.OPEN and now >= self.open_until:
+      self.state = Endpoint.HALF_OPEN
+    return self.state != Endpoint.OPEN
+
+  def record_success(self, latency):
+    self.requests += 1
+    self.latency = latency if self.latency == 0. else (1 - LATENCY_ALPHA) * self.latency + LATENCY_ALPHA * latency
+    self.failure_rate *= (1 - LATENCY_ALPHA)
+    self.consecutive_failures = 0
+    self.cooldown = COOLDOWN
+    self.state = Endpoint.CLOSED
+
+  def record_failure(self, now):
+    self.requests += 1
+    self.failures += 1
+    self.failure_rate = (1 - LATENCY_ALPHA) * self.failure_rate + LATENCY_ALPHA
+    self.consecutive_failures += 1
+    if self.state == Endpoint.HALF_OPEN:
+      self.cooldown = min(self.cooldown * 2, MAX_COOLDOWN)
+    if self.state == Endpoint.HALF_OPEN or self.consecutive_failures >= FAILURE_THRESHOLD:
+      self.state = Endpoint.OPEN
+      self.open_until = now + self.cooldown
+
+  def score(self):
+    # Untested endpoints score 0 and keep their configured order
+    return self.latency * (1. + 4. * self.failure_rate)
+
+  def __repr__(self):
+    return "%s (%s, %.2fs, %.0f%% failed)" % (self.url, self.state, self.latency, self.failure_rate * 100)
+
+
+class OverpassClient():
+  """Overpass client sharing keep-alive connections between queries.
+
+  Queries go to the healthiest endpoint first and fall through to the next
+  one on failure, every request has its own timeout. Background prefetches
+  run on a small thread pool."""
+  def __init__(self, endpoints, max_workers=2):
+    self.endpoints = endpoints
+    # reentrant, done callbacks of finished prefetches run in the submitting thread
+    self.lock = threading.RLock()
+    self.parser = overpy.Overpass()
+
+    self.session = requests.Session()
+    self.session.headers.update(OVERPASS_HEADERS)
+    adapter = HTTPAdapter(pool_connections=len(endpoints), pool_maxsize=max_workers + 1)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+    self.executor = ThreadPoolExecutor(max_workers=max_workers)
+    self.pending = {}
+
+  def ranked_endpoints(self):
+    now = time.monotonic()
+    with self.lock:
+      available = [e for e in self.endpoints if e.available(now)]
+    return sorted(available, key=lambda e: e.score())
+
+  def best_endpoint(self):
+    ranked = self.ranked_endpoints()
+    return ranked[0] if len(ranked) else None
+
+  def parse(self, response):
+    if response.headers.get("Content-Type", "").startswith("application/json"):
+      return self.parser.parse_json(response.content)
+    return self.parser.parse_xml(response.content)
+
+  def query(self, q):
+    """Runs a query, returns an overpy.Result or raises OverpassUnavailable"""
+    errors = []
+    for endpoint in self.ranked_endpoints():
+      t = time.monotonic()
+      try:
+        response = self.session.post(endpoint.url, data=q.encode('utf8'), timeout=endpoint.timeout)
+        response.raise_for_status()
+        result = self.parse(response)
+      except (requests.RequestException, overpy.exception.OverPyException, SAXException, ValueError) as e:
+        with self.lock:
+          endpoint.record_failure(time.monotonic())
+        errors.append("%s: %s" % (endpoint.url, e))
+        continue
+
+      with self.lock:
+        endpoint.record_success(time.monotonic() - t)
+      return result
+    raise OverpassUnavailable("; ".join(errors) if errors else "all endpoints unavailable")
+
+  def prefetch(self, key, fn, *args):
+    """Runs fn(*args) in the background unless a prefetch for key is still running"""
+    with self.lock:
+      future = self.pending.get(key)
+      if future is not None and not future.done():
+        return future
+      future = self.executor.submit(fn, *args)
+      self.pending[key] = future
+      future.add_done_callback(lambda f: self._prefetch_done(key, f))
+      return future
+
+  def _prefetch_done(self, key, future):
+    with self.lock:
+      if self.pending.get(key) is future:
+        del self.pending[key]
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class NodeToWay():
+  """Read-only node id -> ways lookup over several batches.
+  Ways crossing batch borders are in several batches, the first copy wins."""
+  def __init__(self, batches):
+    self.batches = batches
+
+  def __getitem__(self, node_id):
+    ways = []
+    seen = set()
+    for batch in self.batches:
+      for way in batch.node_to_way.get(node_id, ()):
+        if way.id not in seen:
+          seen.add(way.id)
+          ways.append(way)
+    return ways
+
+  def __contains__(self, node_id):
+    return any(node_id in batch.node_to_way for batch in self.batches)
+
+
+class SpatialIndex():
+  """Immutable spatial index over batches of OSM nodes.
+
+  A batch is any object with key, result, real_nodes, tree (a KD-tree over the
+  ecef positions of real_nodes, or None), node_to_way and location_info, e.g. a
+  tile_cache.Tile. insert() and evict() never modify an index, they return a
+  new one that shares the untouched batches. The query thread can therefore
+  slide its window by building the next index on the side and publishing it
+  with a single reference assignment, while readers keep using the snapshot
+  they already hold without taking a lock."""
+  def __init__(self, batches=()):
+    self.batches = tuple(batches)
+    self.keys = frozenset(b.key for b in self.batches)
+    self.node_to_way = NodeToWay(self.batches)
+
+    # Nodes of ways crossing batch borders are in several batches, keep the
+    # first copy and map the indices of every tree to it
+    self.real_nodes = []
+    self.trees = []
+    positions = {}
+    for batch in self.batches:
+      for node in batch.real_nodes:
+        if node.id not in positions:
+          positions[node.id] = len(self.real_nodes)
+          self.real_nodes.append(node)
+      if batch.tree is not None:
+        idxs = np.array([positions[node.id] for node in batch.real_nodes], dtype=np.int64)
+        self.trees.append((idxs, batch.tree))
+
+    self.location_info = {}
+    for batch in self.batches:
+      for k, v in batch.location_info.items():
+        self.location_info.setdefault(k, v)
+
+  def __len__(self):
+    return len(self.real_nodes)
+
+  def insert(self, batch):
+    return SpatialIndex([b for b in self.batches if b.key != batch.key] + [batch])
+
+  def evict(self, keys):
+    keys = set(keys)
+    return SpatialIndex([b for b in self.batches if b.key not in keys])
+
+  def query_ball_point(self, x, r):
+    idxs = set()
+    for tree_idxs, tree in self.trees:
+      idxs.update(tree_idxs[tree.query_ball_point(x, r)].tolist())
+    return sorted(idxs)
+
+  def query(self, x):
+    best = (np.inf, None)
+    for tree_idxs, tree in self.trees:
+      d, i = tree.query(x)
+      if d < best[0]:
+        best = (d, int(tree_idxs[i]))
+    return best
+
+  @property
+  def query_result(self):
+    """The (results, tree, real_nodes, node_to_way, location_info) tuple used by mapd_helpers.Way"""
+    return [b.result for b in self.batches], self, self.real_nodes, self.node_to_way, self.location_info
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+import unittest
+
+import numpy as np
+
+from selfdrive.mapd.car_frame import closest_arc_length, path_distances
+
+
+class TestClosestArcLength(unittest.TestCase):
+  def test_projects_onto_segment(self):
+    pnts = np.array([[-10., 1., 0.], [0., 1., 0.], [10., 1., 0.], [10., 11., 0.]])
+    self.assertAlmostEqual(closest_arc_length(pnts, path_distances(pnts)), 10.)
+    pnts = np.array([[-5., -3., 0.], [5., -3., 0.]])
+    self.assertAlmostEqual(closest_arc_length(pnts, path_distances(pnts)), 5.)
+
+  def test_reversed(self):
+    pnts = np.array([[10., 11., 0.], [10., 1., 0.], [0., 1., 0.], [-10., 1., 0.]])
+    self.assertAlmostEqual(closest_arc_length(pnts, path_distances(pnts)), 20.)
+
+  def test_past_the_end(self):
+    pnts = np.array([[5., 0., 0.], [15., 0., 0.], [15., 0., 0.]])
+    self.assertAlmostEqual(closest_arc_length(pnts, path_distances(pnts)), 0.)
+    self.assertAlmostEqual(closest_arc_length(pnts[:1], path_distances(pnts[:1])), 0.)
+
+
+if __name__ == "__main__":
+  unittest.main()
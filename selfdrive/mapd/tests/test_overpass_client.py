@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import time
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from selfdrive.mapd.overpass_client import Endpoint, OverpassClient, OverpassUnavailable, FAILURE_THRESHOLD
+
+OSM_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+  <node id="1" lat="48.1" lon="11.5"/>
+  <node id="2" lat="48.2" lon="11.6"><tag k="highway" v="traffic_signals"/></node>
+  <way id="10"><nd ref="1"/><nd ref="2"/><tag k="highway" v="primary"/></way>
+</osm>
+"""
+
+
+class StubOverpass(BaseHTTPRequestHandler):
+  def do_POST(self):
+    self.server.queries.append(self.rfile.read(int(self.headers['Content-Length'])))
+    if self.server.fail:
+      self.send_response(504)
+      self.end_headers()
+      return
+    self.send_response(200)
+    self.send_header("Content-Type", "application/osm3s+xml")
+    self.send_header("Content-Length", str(len(OSM_XML)))
+    self.end_headers()
+    self.wfile.write(OSM_XML)
+
+  def log_message(self, *args):
+    pass
+
+
+class TestOverpassClient(unittest.TestCase):
+  def setUp(self):
+    self.servers = []
+
+  def tearDown(self):
+    for server in self.servers:
+      server.shutdown()
+      server.server_close()
+
+  def start_server(self, fail=False):
+    server = HTTPServer(("127.0.0.1", 0), StubOverpass)
+    server.fail = fail
+    server.queries = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    self.servers.append(server)
+    return server, "http://127.0.0.1:%d/api/interpreter" % server.server_port
+
+  def test_query(self):
+    server, url = self.start_server()
+    client = OverpassClient([Endpoint(url, timeout=1.)])
+    result = client.query("way(1,2,3,4);out;")
+    self.assertEqual([n.id for n in result.nodes], [1, 2])
+    self.assertEqual(result.ways[0].tags['highway'], 'primary')
+    self.assertEqual(server.queries, [b"way(1,2,3,4);out;"])
+    self.assertEqual(client.endpoints[0].state, Endpoint.CLOSED)
+    self.assertGreater(client.endpoints[0].latency, 0.)
+
+  def test_failover_and_circuit_breaker(self):
+    bad_server, bad_url = self.start_server(fail=True)
+    good_server, good_url = self.start_server()
+    bad, good = Endpoint(bad_url, timeout=1.), Endpoint(good_url, timeout=1.)
+    client = OverpassClient([bad, good])
+
+    for _ in range(FAILURE_THRESHOLD):
+      self.assertEqual(len(client.query("out;").ways), 1)
+    self.assertEqual(bad.state, Endpoint.OPEN)
+    self.assertEqual(len(bad_server.queries), FAILURE_THRESHOLD)
+
+    # open circuit is skipped
+    client.query("out;")
+    self.assertEqual(len(bad_server.queries), FAILURE_THRESHOLD)
+
+    # after the cooldown a single trial request goes through and closes the circuit
+    bad_server.fail = False
+    bad.open_until = time.monotonic()
+    bad.latency = 0.
+    client.query("out;")
+    self.assertEqual(len(bad_server.queries), FAILURE_THRESHOLD + 1)
+    self.assertEqual(bad.state, Endpoint.CLOSED)
+
+  def test_unavailable(self):
+    _, url = self.start_server(fail=True)
+    client = OverpassClient([Endpoint(url, timeout=1.), Endpoint("http://127.0.0.1:1/api/interpreter", timeout=0.5)])
+    with self.assertRaises(OverpassUnavailable):
+      client.query("out;")
+    self.assertTrue(all(e.failures == 1 for e in client.endpoints))
+
+  def test_prefetch_deduplicates(self):
+    server, url = self.start_server()
+    client = OverpassClient([Endpoint(url, timeout=1.)])
+    release = threading.Event()
+
+    def slow_query(q):
+      release.wait(1.)
+      return client.query(q)
+
+    f1 = client.prefetch((1, 2), slow_query, "out;")
+    f2 = client.prefetch((1, 2), slow_query, "out;")
+    self.assertIs(f1, f2)
+    release.set()
+    self.assertEqual(len(f1.result().nodes), 2)
+    self.assertEqual(len(server.queries), 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
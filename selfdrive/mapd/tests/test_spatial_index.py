@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import unittest
+from collections import namedtuple
+
+from scipy import spatial
+
+from selfdrive.mapd.spatial_index import SpatialIndex
+
+Node = namedtuple('Node', ['id', 'x'])
+
+
+class Batch():
+  def __init__(self, key, nodes, location_info=None):
+    self.key = key
+    self.result = None
+    self.real_nodes = [Node(i, x) for i, x in nodes]
+    self.tree = spatial.KDTree([(n.x, 0., 0.) for n in self.real_nodes])
+    self.node_to_way = {}
+    self.location_info = location_info or {}
+
+
+class TestSpatialIndex(unittest.TestCase):
+  def setUp(self):
+    # node 3 is on a way crossing the border, both tiles have it
+    self.index = SpatialIndex([Batch((0, 0), [(1, 0.), (2, 10.), (3, 20.)], {'country': 'DE'}),
+                               Batch((0, 1), [(3, 20.), (4, 30.)], {'country': 'AT', 'region': 'Tirol'})])
+
+  def test_border_nodes_once(self):
+    self.assertEqual([n.id for n in self.index.real_nodes], [1, 2, 3, 4])
+    self.assertEqual(len(self.index), 4)
+
+  def test_queries(self):
+    nodes = self.index.real_nodes
+    self.assertEqual([nodes[i].id for i in self.index.query_ball_point((20., 0., 0.), 11.)], [2, 3, 4])
+    d, i = self.index.query((29., 0., 0.))
+    self.assertEqual((d, nodes[i].id), (1., 4))
+    self.assertEqual(self.index.location_info, {'country': 'DE', 'region': 'Tirol'})
+
+  def test_evict(self):
+    index = self.index.evict([(0, 0)])
+    self.assertEqual([index.real_nodes[i].id for i in index.query_ball_point((20., 0., 0.), 11.)], [3, 4])
+    self.assertEqual(len(self.index), 4)
+
+
+if __name__ == "__main__":
+  unittest.main()
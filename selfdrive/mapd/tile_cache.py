@@ -0,0 +1,205 @@
+import os
+import json
+import math
+import time
+import threading
+import overpy
+import numpy as np
+from scipy import spatial
+from collections import OrderedDict, defaultdict
+from common.file_helpers import mkdirs_exists_ok
+from common.transformations.coordinates import geodetic2ecef
+from selfdrive.mapd.mapd_helpers import way_profile
+
+TILE_CACHE_DIR = "/data/osm_tiles"
+TILE_DEG = 0.025  # ~2.8 km north-south
+MAX_LOADED_TILES = 32
+TILE_MAX_AGE = 30 * 24 * 3600.  # refetch tiles older than a month
+TILE_VERSION = 1
+
+# Same filter as QueryThread.build_way_query, but for a bounding box
+TILE_QUERY = """(
+way
+  (%f,%f,%f,%f)
+[highway][highway!~"^(footway|path|bridleway|steps|cycleway|construction|bus_guideway|escape)$"];
+>;);out;is_in(%f,%f);area._[admin_level~"[24]"];
+convert area ::id = id(), admin_level = t['admin_level'],
+name = t['name'], "ISO3166-1:alpha2" = t['ISO3166-1:alpha2'];out;
+"""
+
+
+def tile_key(lat, lon, tile_deg=TILE_DEG):
+  return int(math.floor(lat / tile_deg)), int(math.floor(lon / tile_deg))
+
+
+def tile_bbox(key, tile_deg=TILE_DEG):
+  """Returns (south, west, north, east) of a tile"""
+  ix, iy = key
+  return ix * tile_deg, iy * tile_deg, (ix + 1) * tile_deg, (iy + 1) * tile_deg
+
+
+def tiles_around(lat, lon, radius, tile_deg=TILE_DEG):
+  """Returns the keys of all tiles intersecting the bounding box of a circle, closest tile first"""
+  dlat = radius / 111132.954
+  dlon = radius / max(111132.954 * math.cos(math.radians(lat)), 1.)
+  ix0, iy0 = tile_key(lat - dlat, lon - dlon, tile_deg)
+  ix1, iy1 = tile_key(lat + dlat, lon + dlon, tile_deg)
+  center = tile_key(lat, lon, tile_deg)
+  keys = [(ix, iy) for ix in range(ix0, ix1 + 1) for iy in range(iy0, iy1 + 1)]
+  return sorted(keys, key=lambda k: (k[0] - center[0])**2 + (k[1] - center[1])**2)
+
+
+def position_ahead(lat, lon, heading, distance):
+  """Position distance meters from lat, lon along heading (degrees from north)"""
+  a = 111132.954*math.cos(float(lat)/180*3.141592)
+  b = 111132.954 - 559.822 * math.cos( 2 * float(lat)/180*3.141592) + 1.175 * math.cos( 4 * float(lat)/180*3.141592)
+  heading = math.radians(-heading + 90)
+  return lat + math.sin(heading)*distance/b, lon + math.cos(heading)*distance/a
+
+
+def encode_result(result):
+  """Packs the ways, nodes and admin areas of an overpy result into flat arrays"""
+  nodes = result.nodes
+  ways = result.ways
+  node_ids = np.array([n.id for n in nodes], dtype=np.int64)
+  node_latlon = np.array([(float(n.lat), float(n.lon)) for n in nodes], dtype=np.float64).reshape(-1, 2)
+  way_ids = np.array([w.id for w in ways], dtype=np.int64)
+  way_node_ids = np.array([i for w in ways for i in w._node_ids], dtype=np.int64)
+  way_offsets = np.cumsum([0] + [len(w._node_ids) for w in ways]).astype(np.int64)
+  # Only a small fraction of nodes carry tags, store them sparse
+  tags = {
+    'nodes': {str(n.id): n.tags for n in nodes if n.tags},
+    'ways': [w.tags for w in ways],
+    'areas': [(a.id, a.tags) for a in result.areas],
+  }
+  return {
+    'version': np.array([TILE_VERSION], dtype=np.int64),
+    'node_ids': node_ids,
+    'node_latlon': node_latlon,
+    'way_ids': way_ids,
+    'way_node_ids': way_node_ids,
+    'way_offsets': way_offsets,
+    'tags': np.frombuffer(json.dumps(tags).encode('utf8'), dtype=np.uint8),
+  }
+
+
+def decode_result(arrays):
+  """Rebuilds an overpy result from the arrays written by encode_result"""
+  tags = json.loads(arrays['tags'].tobytes().decode('utf8'))
+  node_tags = tags['nodes']
+  result = overpy.Result()
+
+  for node_id, (lat, lon) in zip(arrays['node_ids'].tolist(), arrays['node_latlon'].tolist()):
+    result.append(overpy.Node(node_id=node_id, lat=lat, lon=lon, tags=node_tags.get(str(node_id), {}), attributes={}, result=result))
+
+  offsets = arrays['way_offsets'].tolist()
+  way_node_ids = arrays['way_node_ids'].tolist()
+  for i, way_id in enumerate(arrays['way_ids'].tolist()):
+    result.append(overpy.Way(way_id=way_id, node_ids=way_node_ids[offsets[i]:offsets[i + 1]], tags=tags['ways'][i], attributes={}, result=result))
+
+  for area_id, area_tags in tags['areas']:
+    result.append(overpy.Area(area_id=area_id, tags=area_tags, attributes={}, result=result))
+  return result
+
+
+class Tile():
+  def __init__(self, key, result):
+    self.key = key
+    self.result = result
+    self.real_nodes = list(result.nodes)
+
+    # The tree is built once per tile and reused for as long as the tile stays loaded
+    if len(self.real_nodes):
+      nodes = np.asarray([(float(n.lat), float(n.lon), 0) for n in self.real_nodes])
+      self.tree = spatial.KDTree(geodetic2ecef(nodes))
+    else:
+      self.tree = None
+
+    self.node_to_way = defaultdict(list)
+    for way in result.ways:
+      for node_id in way._node_ids:
+        self.node_to_way[node_id].append(way)
+      # Precompute once per tile instead of on every mapd cycle
+      way_profile(way)
+
+    self.location_info = {}
+    for area in result.areas:
+      if area.tags.get('admin_level', '') == "2":
+        self.location_info['country'] = area.tags.get('ISO3166-1:alpha2', '')
+      elif area.tags.get('admin_level', '') == "4":
+        self.location_info['region'] = area.tags.get('name', '')
+
+
+class TileCache():
+  """On-disk store of Overpass results on a fixed lat/lon grid.
+
+  Tiles are fetched once, stored as .npz under root and loaded lazily. At most
+  max_tiles parsed tiles (with their KD-trees) are kept in memory, the least
+  recently used one is evicted first."""
+  def __init__(self, root=TILE_CACHE_DIR, tile_deg=TILE_DEG, max_tiles=MAX_LOADED_TILES, max_age=TILE_MAX_AGE):
+    self.root = root
+    self.tile_deg = tile_deg
+    self.max_tiles = max_tiles
+    self.max_age = max_age
+    self.tiles = OrderedDict()
+    # tiles may be fetched from prefetch threads
+    self.lock = threading.Lock()
+
+  def tile_path(self, key):
+    return os.path.join(self.root, "%d_%d.npz" % key)
+
+  def is_cached(self, key):
+    with self.lock:
+      if key in self.tiles:
+        return True
+    try:
+      return time.time() - os.path.getmtime(self.tile_path(key)) < self.max_age
+    except OSError:
+      return False
+
+  def missing_tiles(self, keys):
+    return [k for k in keys if not self.is_cached(k)]
+
+  def fetch(self, api, key):
+    """Downloads a tile through an object with an overpy.Overpass like query() and stores it"""
+    s, w, n, e = tile_bbox(key, self.tile_deg)
+    result = api.query(TILE_QUERY % (s, w, n, e, (s + n) / 2., (w + e) / 2.))
+    return self.store(key, result)
+
+  def store(self, key, result):
+    mkdirs_exists_ok(self.root)
+    path = self.tile_path(key)
+    tmp_path = "%s.tmp%d" % (path, threading.get_ident())
+    with open(tmp_path, "wb") as f:
+      np.savez_compressed(f, **encode_result(result))
+    os.rename(tmp_path, path)
+    tile = Tile(key, result)
+    self._insert(tile)
+    return tile
+
+  def get(self, key):
+    """Returns a loaded tile, or None if it is not on disk"""
+    with self.lock:
+      if key in self.tiles:
+        self.tiles.move_to_end(key)
+        return self.tiles[key]
+
+    try:
+      with np.load(self.tile_path(key)) as arrays:
+        if int(arrays['version'][0]) != TILE_VERSION:
+          return None
+        result = decode_result(arrays)
+    except (OSError, KeyError, ValueError):
+      return None
+
+    tile = Tile(key, result)
+    self._insert(tile)
+    return tile
+
+  def _insert(self, tile):
+    with self.lock:
+      self.tiles[tile.key] = tile
+      self.tiles.move_to_end(tile.key)
+      while len(self.tiles) > self.max_tiles:
+        self.tiles.popitem(last=False)
+
@@ -1,5 +1,8 @@
 import os
+import atexit
 import logging
+import threading
+from collections import deque
 
 from logentries import LogentriesHandler
 import zmq
@@ -18,6 +21,7 @@ class LogMessageHandler(logging.Handler):
     logging.Handler.__init__(self)
     self.setFormatter(formatter)
     self.pid = None
+    self.dropped = 0
 
   def connect(self):
     self.zctx = zmq.Context()
@@ -36,8 +40,84 @@ class LogMessageHandler(logging.Handler):
       s = chr(record.levelno)+msg
       self.sock.send(s.encode('utf8'), zmq.NOBLOCK)
     except zmq.error.Again:
-      # drop :/
-      pass
+      # logmessaged isn't keeping up, reported by AsyncHandler
+      self.dropped += 1
+
+
+class AsyncHandler(logging.Handler):
+  """Passes records on to handlers from a background thread.
+
+  emit only stores the swaglog context in the record and appends it to a
+  bounded deque, formatting, JSON encoding and sending happen on the thread.
+  Records are formatted there too, so don't change logged objects afterwards.
+  Records that don't fit are counted in dropped, drops of the handlers are
+  added and a swaglog_dropped warning is logged when the count grows. Drops
+  of that warning itself are not reported."""
+  def __init__(self, swaglogger, handlers, maxsize=1024, interval=0.05):
+    logging.Handler.__init__(self)
+    self.swaglogger = swaglogger
+    self.handlers = handlers
+    self.maxsize = maxsize
+    self.interval = interval
+    self.queue = deque()
+    self.dropped = 0
+    self.reported_dropped = 0
+    self.wakeup = threading.Event()
+    self.drain_lock = threading.Lock()
+    self.pid = None
+
+  def start(self):
+    # the thread doesn't survive a fork, the queued records belong to the parent
+    self.pid = os.getpid()
+    self.queue.clear()
+    self.drain_lock = threading.Lock()
+    threading.Thread(target=self.run, name="swaglog", daemon=True).start()
+
+  def handle(self, record):
+    # no handler lock, appending to the deque is safe from any thread
+    rv = self.filter(record)
+    if rv:
+      self.emit(record)
+    return rv
+
+  def emit(self, record):
+    if os.getpid() != self.pid:
+      self.start()
+    if len(self.queue) >= self.maxsize:
+      self.dropped += 1
+      return
+    record.swag_ctx = self.swaglogger.get_ctx()
+    self.queue.append(record)
+    if len(self.queue) == 1:
+      self.wakeup.set()
+
+  def run(self):
+    while True:
+      self.wakeup.wait(self.interval)
+      self.wakeup.clear()
+      self.flush()
+
+  def handle_record(self, record):
+    for handler in self.handlers:
+      if record.levelno >= handler.level:
+        handler.handle(record)
+
+  def total_dropped(self):
+    return self.dropped + sum(getattr(h, 'dropped', 0) for h in self.handlers)
+
+  def flush(self):
+    with self.drain_lock:
+      while len(self.queue):
+        self.handle_record(self.queue.popleft())
+
+      dropped = self.total_dropped()
+      if dropped != self.reported_dropped:
+        msg = {'event': 'swaglog_dropped', 'count': dropped - self.reported_dropped, 'total': dropped}
+        record = self.swaglogger.makeRecord(self.swaglogger.name, logging.WARNING, __file__, 0, msg, None, None)
+        record.swag_ctx = self.swaglogger.get_ctx()
+        self.handle_record(record)
+        # a handler that is dropping drops the report too, don't report that again
+        self.reported_dropped = self.total_dropped()
 
 
 def add_logentries_handler(log):
@@ -52,5 +132,6 @@ cloudlog = log = SwagLogger()
 log.setLevel(logging.DEBUG)
 
 outhandler = logging.StreamHandler()
-log.addHandler(outhandler)
-log.addHandler(LogMessageHandler(SwagFormatter(log)))
+async_handler = AsyncHandler(log, [outhandler, LogMessageHandler(SwagFormatter(log))])
+log.addHandler(async_handler)
+atexit.register(async_handler.flush)
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 import bz2
 import os
+import struct
 import sys
 import numbers
+from functools import lru_cache
+from itertools import zip_longest
 
 import dictdiffer
 
@@ -12,19 +15,151 @@ if "CI" in os.environ:
 else:
   from tqdm import tqdm  # type: ignore
 
+from cereal import log
 from tools.lib.logreader import LogReader
 
 EPSILON = sys.float_info.epsilon
 
+# bytes of the primitive types in a struct data section, None for bool which is a bit
+PRIMITIVE_SIZES = {
+  'bool': None, 'int8': 1, 'uint8': 1, 'int16': 2, 'uint16': 2, 'enum': 2,
+  'int32': 4, 'uint32': 4, 'float32': 4, 'int64': 8, 'uint64': 8, 'float64': 8,
+}
+NO_DISCRIMINANT = 0xffff
+U16, U32, U64 = struct.Struct('<H'), struct.Struct('<I'), struct.Struct('<Q')
 
-def save_log(dest, log_msgs):
-  dat = b""
-  for msg in tqdm(log_msgs):
-    dat += msg.as_builder().to_bytes()
-  dat = bz2.compress(dat)
 
-  with open(dest, "wb") as f:
-   f.write(dat)
+def save_log(dest, log_msgs):
+  with bz2.open(dest, "wb") as f:
+    for msg in tqdm(log_msgs):
+      f.write(msg.as_builder().to_bytes())
+
+
+class FarPointer(Exception):
+  pass
+
+
+@lru_cache(maxsize=None)
+def field_path(key):
+  """Steps from the Event root struct to the primitive field key, None if the
+  schema has no such field or it isn't primitive, dictdiffer ignores those
+  when the messages are diffed. A step is (pointer index or None for groups,
+  discriminant check or None), the last one (byte offset, size, bit, check)."""
+  schema = log.Event.schema
+  keys = key.split(".")
+  steps = []
+  for i, k in enumerate(keys):
+    if k not in schema.fields:
+      return None
+    field = schema.fields[k]
+    check = None
+    if field.proto.discriminantValue != NO_DISCRIMINANT:
+      check = (schema.node.struct.discriminantOffset * 2, field.proto.discriminantValue)
+
+    if field.proto.which() == 'group':
+      steps.append((None, check))
+    else:
+      typ = field.proto.slot.type.which()
+      offset = field.proto.slot.offset
+      if i == len(keys) - 1:
+        if typ not in PRIMITIVE_SIZES:
+          return None
+        size = PRIMITIVE_SIZES[typ]
+        steps.append((offset // 8, 1, 1 << (offset % 8), check) if size is None else (offset * size, size, None, check))
+        return tuple(steps)
+      if typ != 'struct':
+        return None
+      steps.append((offset, check))
+
+    if i < len(keys) - 1:
+      schema = field.schema
+  return None
+
+
+def read_struct_pointer(dat, pos):
+  """(data section start, data bytes, pointer section start) of the struct pointer
+  at pos, None if it is null. Far pointers raise FarPointer."""
+  ptr = U64.unpack_from(dat, pos)[0]
+  if ptr == 0:
+    return None
+  if ptr & 3 != 0:
+    raise FarPointer
+  offset = (ptr & 0xffffffff) >> 2
+  if offset >= 1 << 29:
+    offset -= 1 << 30
+  data = pos + 8 * (1 + offset)
+  data_size = 8 * ((ptr >> 32) & 0xffff)
+  return data, data_size, data + data_size
+
+
+def read_discriminant(dat, data, data_size, offset):
+  return U16.unpack_from(dat, data + offset)[0] if offset + 2 <= data_size else 0
+
+
+class FieldMask():
+  """Serializes Events with the ignored fields zeroed.
+
+  Primitive fields are zeroed in place in the serialized message by following
+  the struct pointers from the root, the rest of the message doesn't move when
+  a primitive changes, so masked bytes of equal messages are equal. Messages
+  with far pointers fall back to remove_ignored_fields. Other ignored fields
+  are not masked, messages differing in them are left to dictdiffer."""
+  def __init__(self, ignore_fields):
+    self.masked_fields = []
+    self.common = []
+    self.by_union = {}
+    self.union_offset = log.Event.schema.node.struct.discriminantOffset * 2
+    for key in ignore_fields:
+      path = field_path(key)
+      if path is None:
+        continue
+      self.masked_fields.append(key)
+      check = path[0][-1]
+      if check is None:
+        self.common.append(path)
+      else:
+        # the Event union member is checked once per message, not per path
+        first = path[0][:-1] + (None,)
+        self.by_union.setdefault(check[1], []).append((first,) + path[1:])
+
+  def mask(self, dat):
+    dat = bytearray(dat)
+    nseg = U32.unpack_from(dat, 0)[0] + 1
+    root = read_struct_pointer(dat, (4 + 4 * nseg + 7) & ~7)
+    if root is None:
+      return bytes(dat)
+    paths = self.common + self.by_union.get(read_discriminant(dat, root[0], root[1], self.union_offset), [])
+
+    for path in paths:
+      data, data_size, pointers = root
+      for step in path:
+        check = step[-1]
+        if check is not None and read_discriminant(dat, data, data_size, check[0]) != check[1]:
+          break
+
+        if len(step) == 2:
+          if step[0] is not None:
+            target = read_struct_pointer(dat, pointers + 8 * step[0])
+            if target is None:
+              break
+            data, data_size, pointers = target
+          continue
+
+        offset, size, bit, _ = step
+        # fields past the data section of an older struct read as their default
+        if offset + size <= data_size:
+          if bit is None:
+            dat[data + offset:data + offset + size] = bytes(size)
+          else:
+            dat[data + offset] &= ~bit & 0xff
+    return bytes(dat)
+
+  def __call__(self, msg):
+    dat = msg.as_builder().to_bytes()
+    try:
+      return self.mask(dat)
+    except FarPointer:
+      return remove_ignored_fields(msg, self.masked_fields).as_builder().to_bytes()
 
 
 def remove_ignored_fields(msg, ignore):
@@ -53,22 +188,34 @@ def remove_ignored_fields(msg, ignore):
 
 
 def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None):
+  """Compares two logs message by message, any iterables work and are only
+  consumed once. Ignored fields are zeroed in the serialized messages, only
+  messages that still differ are converted to dicts and diffed."""
   if ignore_fields is None:
     ignore_fields = []
 
   if ignore_msgs is None:
     ignore_msgs = []
-  log1, log2 = [list(filter(lambda m: m.which() not in ignore_msgs, log)) for log in (log1, log2)]
-  assert len(log1) == len(log2), "logs are not same length: " + str(len(log1)) + " VS " + str(len(log2))
+  log1, log2 = iter(log1), iter(log2)
+  if len(ignore_msgs):
+    log1, log2 = [filter(lambda m: m.which() not in ignore_msgs, log) for log in (log1, log2)]
+  masked_bytes = FieldMask(ignore_fields)
 
   diff = []
-  for msg1, msg2 in tqdm(zip(log1, log2)):
+  compared = 0
+  for msg1, msg2 in tqdm(zip_longest(log1, log2)):
+    if msg1 is None or msg2 is None:
+      len1 = compared + (msg1 is not None) + sum(1 for _ in log1)
+      len2 = compared + (msg2 is not None) + sum(1 for _ in log2)
+      raise AssertionError("logs are not same length: " + str(len1) + " VS " + str(len2))
+    compared += 1
+
     if msg1.which() != msg2.which():
       print(msg1, msg2)
       raise Exception("msgs not aligned between logs")
 
-    msg1_bytes = remove_ignored_fields(msg1, ignore_fields).as_builder().to_bytes()
-    msg2_bytes = remove_ignored_fields(msg2, ignore_fields).as_builder().to_bytes()
+    msg1_bytes = masked_bytes(msg1)
+    msg2_bytes = masked_bytes(msg2)
 
     if msg1_bytes != msg2_bytes:
       msg1_dict = msg1.to_dict(verbose=True)
@@ -91,6 +238,4 @@ def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=Non
 
 
 if __name__ == "__main__":
-  log1 = list(LogReader(sys.argv[1]))
-  log2 = list(LogReader(sys.argv[2]))
-  print(compare_logs(log1, log2, sys.argv[3:]))
+  print(compare_logs(LogReader(sys.argv[1]), LogReader(sys.argv[2]), sys.argv[3:]))
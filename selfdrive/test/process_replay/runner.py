@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Runs process replay for many segments and processes on a pool of workers.
+
+Every rlog and reference log is downloaded, decompressed and indexed once
+into a shared directory, the workers only read those local files and decode
+just the message types a process subscribes to. Each worker has its own HOME
+so Params of replays running at the same time don't collide, and two replays
+of the same process never run at once since some processes still publish on
+real sockets."""
+import argparse
+import atexit
+import bz2
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+
+import tools.lib.cache
+from tools.lib.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from tools.lib.logreader import UNION_TAGS, LogReader
+try:
+  from xx.chffr.lib.filereader import FileReader
+except ImportError:
+  from tools.lib.filereader import FileReader
+
+# process_replay and everything importing Params are only imported inside the
+# workers, the params path is fixed from HOME when the library is loaded
+
+ReplayTask = namedtuple('ReplayTask', ['segment', 'proc_name', 'log_path', 'ref_path', 'ignore_fields', 'ignore_msgs'])
+ReplayResult = namedtuple('ReplayResult', ['segment', 'proc_name', 'diff', 'msgs', 'replay_time', 'total_time'])
+
+CACHED_SEGMENTS = 2  # decompressed logs a worker keeps in memory
+CAR_PARAMS_CAN_MSGS = 300  # can messages the init callbacks fingerprint with
+
+
+def default_cache_dir():
+  return os.path.join(tools.lib.cache.DEFAULT_CACHE_DIR, "process_replay")
+
+
+def decompress_log(url, path):
+  """Downloads and decompresses a log to path once, and indexes it"""
+  if not os.path.exists(path):
+    with FileReader(url) as f:
+      dat = f.read()
+    if os.path.splitext(url)[1] == ".bz2":
+      dat = bz2.decompress(dat)
+    with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+      f.write(dat)
+  LogReader(path).index()
+  return path
+
+
+def local_log_path(cache_dir, url):
+  # no extension, LogReader reads files without one as uncompressed
+  name = url.split("openpilotci/")[-1].replace("/", "_").replace("|", "_")
+  return os.path.join(cache_dir, os.path.splitext(name)[0])
+
+
+def prepare_logs(urls, cache_dir, threads=8):
+  """Fetches all logs in parallel, returns {url: local path} with None for
+  the logs that failed, so one bad download only fails the replays using it"""
+  mkdirs_exists_ok(cache_dir)
+  with ThreadPoolExecutor(threads) as pool:
+    futures = {url: pool.submit(decompress_log, url, local_log_path(cache_dir, url)) for url in set(urls)}
+    paths = {}
+    for url, future in futures.items():
+      try:
+        paths[url] = future.result()
+      except Exception as e:
+        print("failed to get %s: %s" % (url, e))
+        paths[url] = None
+    return paths
+
+
+def select_messages(lr, services, limits=None):
+  """Messages of lr with one of the union types in services, decoded from the
+  index without building the others, in the order replay_process sorts them.
+  limits caps services to their first n messages."""
+  index = lr.index()
+  tags = np.array([UNION_TAGS[s] for s in services if s in UNION_TAGS], dtype=np.uint16)
+  selected = np.flatnonzero(np.isin(index.which, tags))
+  selected = selected[np.argsort(index.mono_times[selected], kind='stable')]
+  for service, n in (limits or {}).items():
+    is_service = index.which[selected] == UNION_TAGS[service]
+    selected = selected[~is_service | (np.cumsum(is_service) <= n)]
+  return [lr[int(i)] for i in selected]
+
+
+_log_readers: OrderedDict = OrderedDict()
+
+
+def init_worker(index_cache_dir):
+  home = tempfile.mkdtemp(prefix="process_replay_")
+  atexit.register(shutil.rmtree, home, True)
+  os.environ["HOME"] = home
+  # log indexes were built by the parent, look them up in its cache
+  tools.lib.cache.DEFAULT_CACHE_DIR = index_cache_dir
+
+
+def log_reader(path):
+  if path not in _log_readers:
+    while len(_log_readers) >= CACHED_SEGMENTS:
+      _log_readers.popitem(last=False)
+    _log_readers[path] = LogReader(path)
+  _log_readers.move_to_end(path)
+  return _log_readers[path]
+
+
+def replay_task(task):
+  from selfdrive.test.process_replay.compare_logs import compare_logs
+  from selfdrive.test.process_replay.process_replay import CONFIGS, replay_process
+
+  start = time.monotonic()
+  cfg = next(c for c in CONFIGS if c.proc_name == task.proc_name)
+  services, limits = list(cfg.pub_sub.keys()), {}
+  if "can" not in cfg.pub_sub:
+    # the init callbacks get the car params from the first can messages
+    services.append("can")
+    limits["can"] = CAR_PARAMS_CAN_MSGS
+  msgs = select_messages(log_reader(task.log_path), services, limits)
+  num_msgs = sum(m.which() in cfg.pub_sub for m in msgs)
+
+  replay_time = 0.
+  try:
+    t = time.monotonic()
+    log_msgs = replay_process(cfg, msgs)
+    replay_time = time.monotonic() - t
+
+    diff = compare_logs(LogReader(task.ref_path), log_msgs, task.ignore_fields + cfg.ignore, task.ignore_msgs, cfg.tolerance)
+  except Exception as e:
+    diff = "%s: %s" % (type(e).__name__, e)
+  return ReplayResult(task.segment, task.proc_name, diff, num_msgs, replay_time, time.monotonic() - start)
+
+
+def run_tasks(tasks, jobs):
+  """Yields a ReplayResult for every task as they finish, never running two
+  tasks of the same process at once"""
+  ctx = multiprocessing.get_context("spawn")
+  initargs = (tools.lib.cache.DEFAULT_CACHE_DIR,)
+  with ProcessPoolExecutor(jobs, mp_context=ctx, initializer=init_worker, initargs=initargs) as pool:
+    queued = list(tasks)
+    running = {}
+    while queued or running:
+      busy = {task.proc_name for task in running.values()}
+      for task in list(queued):
+        if len(running) >= jobs:
+          break
+        if task.proc_name not in busy:
+          queued.remove(task)
+          busy.add(task.proc_name)
+          running[pool.submit(replay_task, task)] = task
+
+      done, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in done:
+        del running[future]
+        yield future.result()
+
+
+def run_replays(segments, proc_names, ref_commit, jobs=None, cache_dir=None, ignore_fields=None, ignore_msgs=None):
+  """Replays every process on every segment, returns {segment: {proc_name: diff}}
+  like the serial test loop and prints the timings"""
+  from selfdrive.test.process_replay.test_processes import BASE_URL, get_segment
+
+  jobs = jobs or os.cpu_count()
+  cache_dir = cache_dir or default_cache_dir()
+  ignore_fields = ignore_fields or []
+  ignore_msgs = ignore_msgs or []
+
+  t = time.monotonic()
+  urls = {}
+  for segment in segments:
+    urls[segment] = get_segment(segment)
+    for proc_name in proc_names:
+      urls[segment, proc_name] = BASE_URL + "%s_%s_%s.bz2" % (segment, proc_name, ref_commit)
+  paths = prepare_logs(urls.values(), cache_dir)
+  print("***** fetched %d logs in %.1f s *****" % (sum(p is not None for p in paths.values()), time.monotonic() - t))
+
+  results = {segment: {} for segment in segments}
+  tasks = []
+  for segment in segments:
+    for proc_name in proc_names:
+      log_path, ref_path = paths[urls[segment]], paths[urls[segment, proc_name]]
+      if log_path is None or ref_path is None:
+        results[segment][proc_name] = "failed to get %s" % ("segment" if log_path is None else "reference log")
+      else:
+        tasks.append(ReplayTask(segment, proc_name, log_path, ref_path, ignore_fields, ignore_msgs))
+
+  t = time.monotonic()
+  timings = []
+  for result in run_tasks(tasks, jobs):
+    results[result.segment][result.proc_name] = result.diff
+    timings.append(result)
+    print("%-45s %-14s %7.1f s  %8.0f msgs/s" % (result.segment, result.proc_name, result.total_time,
+                                                 msgs_per_second(result.msgs, result.replay_time)))
+  print_timings(timings, time.monotonic() - t, jobs)
+  return results
+
+
+def msgs_per_second(msgs, seconds):
+  # failed replays have no replay time
+  return msgs / seconds if seconds > 0 else 0.
+
+
+def print_timings(timings, wall_time, jobs):
+  per_proc = defaultdict(lambda: [0., 0., 0])
+  for result in timings:
+    proc = per_proc[result.proc_name]
+    proc[0] += result.total_time
+    proc[1] += result.replay_time
+    proc[2] += result.msgs
+
+  print("\n***** timings *****")
+  print("%-14s %10s %10s %10s" % ("process", "wall s", "replay s", "msgs/s"))
+  for proc_name, (total_time, replay_time, msgs) in sorted(per_proc.items()):
+    print("%-14s %10.1f %10.1f %10.0f" % (proc_name, total_time, replay_time, msgs_per_second(msgs, replay_time)))
+  busy = sum(r.total_time for r in timings)
+  print("%d replays in %.1f s on %d workers, %.1f s of work (%.1fx)" % (len(timings), wall_time, jobs, busy,
+                                                                        busy / max(wall_time, 1e-9)))
+
+
+if __name__ == "__main__":
+  from selfdrive.test.process_replay.process_replay import CONFIGS
+  from selfdrive.test.process_replay.test_processes import format_diff, segments
+
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+  parser.add_argument("--procs", type=str, nargs="*", default=[cfg.proc_name for cfg in CONFIGS])
+  parser.add_argument("--cars", type=str, nargs="*", default=[], help="only these car brands (e.g. HONDA)")
+  parser.add_argument("--cache-dir", type=str, default=None, help="shared directory for the decompressed logs")
+  args = parser.parse_args()
+
+  process_replay_dir = os.path.dirname(os.path.abspath(__file__))
+  ref_commit = open(os.path.join(process_replay_dir, "ref_commit")).read().strip()
+  segs = [segment for car_brand, segment in segments if not args.cars or car_brand.upper() in args.cars]
+
+  results = run_replays(segs, args.procs, ref_commit, args.jobs, args.cache_dir)
+  diff1, _, failed = format_diff(results, ref_commit)
+  print(diff1)
+  print("TEST", "FAILED" if failed else "SUCCEEDED")
@@ -8,6 +8,7 @@ from selfdrive.car.car_helpers import interface_names
 from selfdrive.test.process_replay.compare_logs import compare_logs
 from selfdrive.test.process_replay.process_replay import (CONFIGS,
                                                           replay_process)
+from selfdrive.test.process_replay.runner import run_replays
 from tools.lib.logreader import LogReader
 
 INJECT_MODEL = 0
@@ -120,6 +121,8 @@ if __name__ == "__main__":
                         help="Extra fields or msgs to ignore (e.g. carState.events)")
   parser.add_argument("--ignore-msgs", type=str, nargs="*", default=[],
                         help="Msgs to ignore (e.g. carEvents)")
+  parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="Replays to run in parallel")
   args = parser.parse_args()
 
   cars_whitelisted = len(args.whitelist_cars) > 0
@@ -143,26 +146,23 @@ if __name__ == "__main__":
     untested = (set(interface_names) - set(excluded_interfaces)) - tested_cars
     assert len(untested) == 0, "Cars missing routes: %s" % (str(untested))
 
-  results: Any = {}
+  tested_segments = []
   for car_brand, segment in segments:
     if (cars_whitelisted and car_brand.upper() not in args.whitelist_cars) or \
        (not cars_whitelisted and car_brand.upper() in args.blacklist_cars):
       continue
+    tested_segments.append(segment)
 
-    print("***** testing route segment %s *****\n" % segment)
-
-    results[segment] = {}
-
-    rlog_fn = get_segment(segment)
-    lr = LogReader(rlog_fn)
-
-    for cfg in CONFIGS:
-      if (procs_whitelisted and cfg.proc_name not in args.whitelist_procs) or \
-         (not procs_whitelisted and cfg.proc_name in args.blacklist_procs):
-        continue
+  tested_procs = []
+  for cfg in CONFIGS:
+    if (procs_whitelisted and cfg.proc_name not in args.whitelist_procs) or \
+       (not procs_whitelisted and cfg.proc_name in args.blacklist_procs):
+      continue
+    tested_procs.append(cfg.proc_name)
 
-      cmp_log_fn = os.path.join(process_replay_dir, "%s_%s_%s.bz2" % (segment, cfg.proc_name, ref_commit))
-      results[segment][cfg.proc_name] = test_process(cfg, lr, cmp_log_fn, args.ignore_fields, args.ignore_msgs)
+  # segments and processes are replayed on a pool of workers, logs are only fetched once
+  results: Any = run_replays(tested_segments, tested_procs, ref_commit, args.jobs,
+                             ignore_fields=args.ignore_fields, ignore_msgs=args.ignore_msgs)
 
   diff1, diff2, failed = format_diff(results, ref_commit)
   with open(os.path.join(process_replay_dir, "diff.txt"), "w") as f:
@@ -5,6 +5,7 @@ import sys
 from selfdrive.test.openpilotci import upload_file
 from selfdrive.test.process_replay.compare_logs import save_log
 from selfdrive.test.process_replay.process_replay import replay_process, CONFIGS
+from selfdrive.test.process_replay.runner import default_cache_dir, prepare_logs
 from selfdrive.test.process_replay.test_processes import segments, get_segment
 from selfdrive.version import get_git_commit
 from tools.lib.logreader import LogReader
@@ -20,8 +21,11 @@ if __name__ == "__main__":
   with open(ref_commit_fn, "w") as f:
     f.write(ref_commit)
 
+  # download and decompress all segments once up front
+  rlog_fns = prepare_logs([get_segment(segment) for _, segment in segments], default_cache_dir())
+
   for car_brand, segment in segments:
-    rlog_fn = get_segment(segment)
+    rlog_fn = rlog_fns.get(get_segment(segment))
 
     if rlog_fn is None:
       print("failed to get segment %s" % segment)
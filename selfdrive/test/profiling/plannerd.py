@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Times Planner.update on the radarState messages of a recorded segment.
+
+Pass an rlog, or run without arguments to use a CI segment.
+With --profile the cProfile stats of the replay are printed as well."""
+
+import sys
+import time
+import cProfile
+import pstats
+import argparse
+import numpy as np
+
+from cereal import car
+import cereal.messaging_arne as messaging_arne
+from tools.lib.logreader import LogReader
+from selfdrive.controls.lib.planner import Planner
+from selfdrive.controls.lib.vehicle_model import VehicleModel
+from selfdrive.test.profiling.lib import SubMaster, PubMaster, ReplayDone
+
+BASE_URL = "https://commadataci.blob.core.windows.net/openpilotci/"
+SEGMENT = "77611a1fac303767|2020-02-29--13-29-33/3"
+
+SERVICES = ['radarState', 'carState', 'controlsState', 'model', 'liveParameters', 'modelLongButton', 'liveMapData']
+
+
+class ArneSubMaster(dict):
+  """arne182Status and latControl are not in the recorded logs, the planner sees their defaults"""
+  def __init__(self):
+    super().__init__({s: getattr(messaging_arne.new_message(s), s) for s in ['arne182Status', 'latControl']})
+
+
+def replay(msgs, CP):
+  sm = SubMaster(msgs, 'radarState', SERVICES)
+  pm = PubMaster()
+  arne_sm = ArneSubMaster()
+  PL = Planner(CP)
+  VM = VehicleModel(CP)
+
+  times = []
+  try:
+    while True:
+      sm.update()
+      t = time.perf_counter()
+      PL.update(sm, pm, CP, VM, None, arne_sm)
+      times.append(time.perf_counter() - t)
+  except ReplayDone:
+    pass
+  if PL.live_params is not None:
+    PL.live_params.stop()
+  return np.array(times)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("rlog", nargs='?', help="rlog path or url")
+  parser.add_argument("--profile", action="store_true")
+  args = parser.parse_args()
+
+  if args.rlog is None:
+    args.rlog = f"{BASE_URL}{SEGMENT.replace('|', '/')}/rlog.bz2"
+  msgs = list(LogReader(args.rlog))
+  CP = next((m.carParams for m in msgs if m.which() == 'carParams'), None)
+  if CP is None:
+    print("no carParams in the log, using the defaults")
+    CP = car.CarParams.new_message()
+
+  if args.profile:
+    with cProfile.Profile() as pr:
+      times = replay(msgs, CP)
+    pstats.Stats(pr).sort_stats('cumulative').print_stats(30)
+  else:
+    times = replay(msgs, CP)
+
+  if not len(times):
+    print("no radarState in the log")
+    return 1
+  print("%d radarState updates" % len(times))
+  print("mean %.3f ms  p50 %.3f ms  p99 %.3f ms  max %.3f ms" % (np.mean(times) * 1e3, np.percentile(times, 50) * 1e3,
+                                                                np.percentile(times, 99) * 1e3, np.max(times) * 1e3))
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import json
+import time
+import logging
+import threading
+import unittest
+
+from common.logging_extra import SwagLogger, SwagFormatter
+from selfdrive.swaglog import AsyncHandler
+
+
+class ListHandler(logging.Handler):
+  def __init__(self, block=None):
+    logging.Handler.__init__(self)
+    self.setFormatter(SwagFormatter(None))
+    self.block = block
+    self.records = []
+    self.dropped = 0
+
+  def emit(self, record):
+    if self.block is not None:
+      self.block.wait()
+    self.records.append((threading.current_thread().name, json.loads(self.format(record))))
+
+
+class FullHandler(logging.Handler):
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.dropped = 0
+
+  def emit(self, record):
+    self.dropped += 1
+
+
+class TestAsyncHandler(unittest.TestCase):
+  def setUp(self):
+    self.log = SwagLogger()
+    self.out = ListHandler()
+    self.out.formatter.swaglogger = self.log
+
+  def test_formats_on_thread(self):
+    handler = AsyncHandler(self.log, [self.out])
+    self.log.addHandler(handler)
+    with self.log.ctx(route="abc"):
+      self.log.event("test", x=1)
+    self.log.info("hello %s", "world")
+    for _ in range(100):
+      if len(self.out.records) == 2:
+        break
+      time.sleep(0.01)
+
+    self.assertEqual([r[0] for r in self.out.records], ["swaglog", "swaglog"])
+    msgs = [r[1] for r in self.out.records]
+    self.assertEqual(msgs[0]['msg'], {'event': 'test', 'x': 1})
+    self.assertEqual(msgs[0]['ctx'], {'route': 'abc'})
+    self.assertEqual(msgs[1]['msg'], "hello world")
+    self.assertEqual(msgs[1]['ctx'], {})
+
+  def test_drops_are_counted(self):
+    block = threading.Event()
+    self.out.block = block
+    handler = AsyncHandler(self.log, [self.out], maxsize=10, interval=0.01)
+    self.log.addHandler(handler)
+    self.log.info("first")
+    time.sleep(0.1)  # thread is blocked in the handler now
+
+    for i in range(20):
+      self.log.info("msg %d", i)
+    self.assertEqual(handler.dropped, 10)
+
+    self.out.dropped = 3
+    block.set()
+    handler.flush()
+    msgs = [r[1]['msg'] for r in self.out.records]
+    self.assertEqual(msgs[:11], ["first"] + ["msg %d" % i for i in range(10)])
+    self.assertEqual(msgs[-1], {'event': 'swaglog_dropped', 'count': 13, 'total': 13})
+
+  def test_report_drop_not_reported(self):
+    full = FullHandler()
+    handler = AsyncHandler(self.log, [self.out, full], interval=10)
+    self.log.addHandler(handler)
+    self.log.info("dropped")
+    handler.flush()
+    handler.flush()
+    handler.flush()
+    msgs = [r[1]['msg'] for r in self.out.records]
+    self.assertEqual(msgs, ["dropped", {'event': 'swaglog_dropped', 'count': 1, 'total': 1}])
+    self.assertEqual(full.dropped, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,22 +1,23 @@
 # pylint: skip-file
 import json
+import mmap
 import os
-import pickle
 import queue
 import struct
 import subprocess
 import tempfile
 import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
 
 import numpy as np
 from aenum import Enum
 from lru import LRU
 
-import _io
-from tools.lib.cache import cache_path_for_file_path
+from tools.lib.cache import DEFAULT_CACHE_DIR, cache_path_for_file_path
 from tools.lib.exceptions import DataUnreadableError
-from tools.lib.file_helpers import atomic_write_in_dir
+from tools.lib.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
 
 try:
   from xx.chffr.lib.filereader import FileReader
@@ -27,6 +28,18 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+VIDEO_INDEX_MAGIC = b"VIDX"
+# magic, index rows, prefix bytes, probe bytes, width, height
+VIDEO_INDEX_HEADER = struct.Struct("<4sIIIII")
+
+# the parser only knows a frame is complete once the next NAL unit starts, an end
+# of sequence NAL (plus the byte the start code search needs) after a GOP gets its
+# last frame out without waiting for the next GOP
+HEVC_EOS_NAL = b"\x00\x00\x01\x48\x01\x00"
+
+GOP_DECODE_TIMEOUT = 10.  # seconds without a frame before a persistent decoder is given up on
+FRAME_CACHE_MAX_BYTES = 20 * 1024**3
+
 
 class GOPReader:
   def get_gop(self, num):
@@ -105,6 +118,55 @@ def vidindex(fn, typ):
   return index, prefix
 
 
+class VideoIndexData(dict):
+  """index_data read from the cache, the ffprobe output is only parsed when it is used"""
+  def __init__(self, probe_json, **kwargs):
+    super().__init__(**kwargs)
+    self.probe_json = probe_json
+
+  def __missing__(self, key):
+    if key != 'probe':
+      raise KeyError(key)
+    self['probe'] = json.loads(self.probe_json)
+    return self['probe']
+
+
+def write_video_index(f, index_data):
+  """Header, then the (N, 2) uint32 index, the global prefix and the ffprobe json"""
+  index = np.ascontiguousarray(index_data['index'], dtype='<u4')
+  prefix = index_data['global_prefix']
+  probe = json.dumps(index_data['probe']).encode('utf8')
+  stream = index_data['probe']['streams'][0]
+  f.write(VIDEO_INDEX_HEADER.pack(VIDEO_INDEX_MAGIC, index.shape[0], len(prefix), len(probe),
+                                  stream['width'], stream['height']))
+  f.write(index.tobytes())
+  f.write(prefix)
+  f.write(probe)
+
+
+def read_video_index(path):
+  """Loads an index written by write_video_index, the index array is a view
+  into the file contents. Returns None for files in another format.
+
+  Index files are a few KB, one read is cheaper than setting up a mmap."""
+  with open(path, "rb") as f:
+    dat = f.read()
+
+  if len(dat) < VIDEO_INDEX_HEADER.size:
+    return None
+  magic, rows, prefix_len, probe_len, w, h = VIDEO_INDEX_HEADER.unpack_from(dat)
+  if magic != VIDEO_INDEX_MAGIC:
+    return None
+
+  offset = VIDEO_INDEX_HEADER.size
+  index = np.frombuffer(dat, dtype='<u4', count=rows * 2, offset=offset).reshape(rows, 2)
+  offset += index.nbytes
+  prefix = dat[offset:offset + prefix_len]
+  offset += prefix_len
+
+  return VideoIndexData(dat[offset:offset + probe_len], index=index, global_prefix=prefix, width=w, height=h)
+
+
 def cache_fn(func):
   @wraps(func)
   def cache_inner(fn, *args, **kwargs):
@@ -114,15 +176,17 @@ def cache_fn(func):
       cache_prefix = kwargs.pop('cache_prefix', None)
       cache_path = cache_path_for_file_path(fn, cache_prefix)
 
+    cache_value = None
     if cache_path and os.path.exists(cache_path):
-      with open(cache_path, "rb") as cache_file:
-        cache_value = pickle.load(cache_file)
-    else:
+      # None for indexes pickled by older versions, they are rebuilt
+      cache_value = read_video_index(cache_path)
+
+    if cache_value is None:
       cache_value = func(fn, *args, **kwargs)
 
       if cache_path:
         with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-          pickle.dump(cache_value, cache_file, -1)
+          write_video_index(cache_file, cache_value)
 
     return cache_value
 
@@ -173,13 +237,17 @@ def index_video(fn, frame_type=None, cache_prefix=None):
 def get_video_index(fn, frame_type, cache_prefix=None):
   cache_path = cache_path_for_file_path(fn, cache_prefix)
 
-  if not os.path.exists(cache_path):
+  try:
+    index_data = read_video_index(cache_path)
+  except FileNotFoundError:
     index_video(fn, frame_type, cache_prefix)
+    if not os.path.exists(cache_path):
+      return None
+    index_data = read_video_index(cache_path)
 
-  if not os.path.exists(cache_path):
-    return None
-  with open(cache_path, "rb") as cache_file:
-    return pickle.load(cache_file)
+  if index_data is None:
+    index_data = index_stream(fn, "hevc", cache_prefix=cache_prefix)
+  return index_data
 
 
 def read_file_check_size(f, sz, cookie):
@@ -267,27 +335,35 @@ class BaseFrameReader:
     raise NotImplementedError
 
 
-def FrameReader(fn, cache_prefix=None, readahead=False, readbehind=False, index_data=None):
+def FrameReader(fn, cache_prefix=None, readahead=False, readbehind=False, index_data=None,
+                workers=0, frame_cache=None):
+  """workers > 0 decodes GOPs on a pool of persistent ffmpeg processes, frame_cache
+  is an optional FrameCache shared with other readers and processes"""
   frame_type = fingerprint_video(fn)
   if frame_type == FrameType.raw:
     return RawFrameReader(fn)
   elif frame_type in (FrameType.h265_stream,):
     if not index_data:
       index_data = get_video_index(fn, frame_type, cache_prefix)
-    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind)
+    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind,
+                             workers=workers, frame_cache=frame_cache)
   else:
     raise NotImplementedError(frame_type)
 
 
 class RawData:
+  """Raw camera file, every frame is a uint32 length followed by the frame.
+  The file is memory mapped and read returns views into it."""
   def __init__(self, f):
-    self.f = _io.FileIO(f, 'rb')
-    self.lenn = struct.unpack("I", self.f.read(4))[0]
-    self.count = os.path.getsize(f) / (self.lenn+4)
+    with open(f, "rb") as fh:
+      self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    self.lenn = struct.unpack_from("I", self.mm)[0]
+    self.count = len(self.mm) // (self.lenn+4)
+    self.frames = np.frombuffer(self.mm, dtype=np.uint8, count=self.count * (self.lenn+4))
+    self.frames = self.frames.reshape(self.count, self.lenn+4)[:, 4:]
 
   def read(self, i):
-    self.f.seek((self.lenn+4)*i + 4)
-    return self.f.read(self.lenn)
+    return self.frames[i]
 
 
 class RawFrameReader(BaseFrameReader):
@@ -300,7 +376,7 @@ class RawFrameReader(BaseFrameReader):
     self.w, self.h = 640, 480
 
   def load_and_debayer(self, img):
-    img = np.frombuffer(img, dtype='uint8').reshape(960, 1280)
+    img = img.reshape(960, 1280)
     cimg = np.dstack([img[0::2, 1::2], ((img[0::2, 0::2].astype("uint16") + img[1::2, 1::2].astype("uint16")) >> 1).astype("uint8"), img[1::2, 0::2]])
     return cimg
 
@@ -326,7 +402,7 @@ class RawFrameReader(BaseFrameReader):
 
 
 class VideoStreamDecompressor:
-  def __init__(self, vid_fmt, w, h, pix_fmt):
+  def __init__(self, vid_fmt, w, h, pix_fmt, low_delay=False):
     self.vid_fmt = vid_fmt
     self.w = w
     self.h = h
@@ -343,11 +419,15 @@ class VideoStreamDecompressor:
 
     threads = os.getenv("FFMPEG_THREADS", "0")
     cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
+    # frame threading holds frames back until more input arrives, with slice
+    # threading every frame of a written GOP comes out without waiting for the next
+    decoder_args = ["-thread_type", "slice", "-flags2", "showall"] if low_delay else []
     self.proc = subprocess.Popen(
       ["ffmpeg",
        "-threads", threads,
        "-hwaccel", "none" if not cuda else "cuda",
        "-c:v", "hevc",
+       *decoder_args,
        # "-avioflags", "direct",
        "-analyzeduration", "0",
        "-probesize", "32",
@@ -384,8 +464,8 @@ class VideoStreamDecompressor:
     self.proc.stdin.write(rawdat)
     self.proc.stdin.flush()
 
-  def read(self):
-    dat = self.out_q.get(block=True)
+  def read(self, timeout=None):
+    dat = self.out_q.get(block=True, timeout=timeout)
 
     if self.pix_fmt == "rgb24":
       ret = np.frombuffer(dat, dtype=np.uint8).reshape((self.h, self.w, 3))
@@ -407,6 +487,128 @@ class VideoStreamDecompressor:
     self.proc.wait()
     assert self.proc.wait() == 0
 
+  def kill(self):
+    self.proc.kill()
+    self.proc.wait()
+    self.t.join()
+
+
+class GOPDecoder:
+  """Decodes GOPs with one long running ffmpeg instead of one process per GOP.
+
+  Every GOP returned by get_gop starts with the stream prefix and an I frame,
+  so they can be written one after another in any order. If the frames don't
+  come out as expected the process is killed and the GOP is decoded with
+  decompress_video_data instead. The process is also killed when the decoder
+  is garbage collected, for readers that are never closed."""
+  def __init__(self, vid_fmt, w, h, pix_fmt):
+    self.vid_fmt = vid_fmt
+    self.w = w
+    self.h = h
+    self.pix_fmt = pix_fmt
+    self.dec = None
+    self.finalizer = None
+
+  def decode(self, rawdat, num_frames):
+    if self.dec is None:
+      self.dec = VideoStreamDecompressor(self.vid_fmt, self.w, self.h, self.pix_fmt, low_delay=True)
+      self.finalizer = weakref.finalize(self, self.dec.kill)
+    try:
+      self.dec.write(rawdat + HEVC_EOS_NAL)
+      frames = [self.dec.read(timeout=GOP_DECODE_TIMEOUT) for _ in range(num_frames)]
+      if not self.dec.out_q.empty():
+        raise queue.Empty
+      return np.stack(frames)
+    except (queue.Empty, OSError):
+      self.close()
+      return decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, self.pix_fmt)
+
+  def close(self):
+    if self.dec is not None:
+      self.finalizer()
+      self.dec = None
+
+
+class DecodePool:
+  """Worker threads with a GOPDecoder each, so several GOPs decode at once.
+  Can be shared between readers, GOPDecoders are kept per output format."""
+  def __init__(self, workers):
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+    self.local = threading.local()
+    self.lock = threading.Lock()
+    self.decoders = []
+
+  def _decoder(self, vid_fmt, w, h, pix_fmt):
+    decoders = self.local.__dict__.setdefault('decoders', {})
+    key = (vid_fmt, w, h, pix_fmt)
+    if key not in decoders:
+      decoders[key] = GOPDecoder(*key)
+      with self.lock:
+        self.decoders.append(decoders[key])
+    return decoders[key]
+
+  def submit(self, fn, *args):
+    """Runs fn(decoder_for, *args) on a worker, decoder_for(vid_fmt, w, h, pix_fmt) returns its GOPDecoder"""
+    return self.executor.submit(fn, self._decoder, *args)
+
+  def close(self):
+    self.executor.shutdown(wait=True)
+    with self.lock:
+      for dec in self.decoders:
+        dec.close()
+      self.decoders = []
+
+
+class FrameCache:
+  """Decoded GOPs on disk, one .npy file per GOP that is memory mapped on read.
+
+  Files are written atomically so any number of readers and processes can
+  share a directory. Reading a GOP touches its mtime and the least recently
+  used files are deleted when the directory grows over max_bytes."""
+  def __init__(self, path=None, max_bytes=FRAME_CACHE_MAX_BYTES):
+    self.path = path if path is not None else os.path.join(DEFAULT_CACHE_DIR, "frames")
+    self.max_bytes = max_bytes
+    mkdirs_exists_ok(self.path)
+
+  def _path(self, fn, pix_fmt, frame_b):
+    name = os.path.basename(cache_path_for_file_path(fn))
+    return os.path.join(self.path, "%s.%s.%d.npy" % (name, pix_fmt, frame_b))
+
+  def get(self, fn, pix_fmt, frame_b):
+    path = self._path(fn, pix_fmt, frame_b)
+    try:
+      frames = np.load(path, mmap_mode='r')
+      os.utime(path)
+    except (OSError, ValueError):
+      return None
+    return frames
+
+  def put(self, fn, pix_fmt, frame_b, frames):
+    with atomic_write_in_dir(self._path(fn, pix_fmt, frame_b), mode="wb", overwrite=True) as f:
+      np.save(f, frames)
+    self.trim()
+
+  def trim(self):
+    entries = []
+    for entry in os.scandir(self.path):
+      if entry.name.endswith(".npy"):
+        try:
+          st = entry.stat()
+        except FileNotFoundError:
+          continue
+        entries.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      try:
+        # readers that have it mapped keep their pages
+        os.unlink(path)
+      except FileNotFoundError:
+        pass
+      total -= size
+
 
 class StreamGOPReader(GOPReader):
   def __init__(self, fn, frame_type, index_data):
@@ -423,7 +625,6 @@ class StreamGOPReader(GOPReader):
 
     self.index = index_data['index']
     self.prefix = index_data['global_prefix']
-    probe = index_data['probe']
 
     self.prefix_frame_data = None
     self.num_prefix_frames = 0
@@ -438,8 +639,11 @@ class StreamGOPReader(GOPReader):
 
     self.frame_count = len(self.index) - 1
 
-    self.w = probe['streams'][0]['width']
-    self.h = probe['streams'][0]['height']
+    if 'width' in index_data:
+      self.w, self.h = index_data['width'], index_data['height']
+    else:
+      self.w = index_data['probe']['streams'][0]['width']
+      self.h = index_data['probe']['streams'][0]['height']
 
   def _lookup_gop(self, num):
     frame_b = num
@@ -481,12 +685,21 @@ class StreamGOPReader(GOPReader):
 class GOPFrameReader(BaseFrameReader):
   #FrameReader with caching and readahead for formats that are group-of-picture based
 
-  def __init__(self, readahead=False, readbehind=False):
+  def __init__(self, readahead=False, readbehind=False, workers=0, frame_cache=None):
     self.open_ = True
 
     self.readahead = readahead
     self.readbehind = readbehind
-    self.frame_cache = LRU(64)
+    # room for a few GOPs in flight per worker
+    self.frame_cache = LRU(64 * max(1, workers))
+    self.disk_cache = frame_cache
+
+    # GOPs being decoded, concurrent requests for one wait on the same future
+    self.pending = {}
+    self.pending_lock = threading.Lock()
+
+    self.pool = DecodePool(workers) if workers > 0 else None
+    self.decoders = {}
 
     if self.readahead:
       self.cache_lock = threading.RLock()
@@ -510,6 +723,13 @@ class GOPFrameReader(BaseFrameReader):
       self.readahead_c.release()
       self.readahead_thread.join()
 
+    if self.pool is not None:
+      self.pool.close()
+    with self.cache_lock:
+      for dec in self.decoders.values():
+        dec.close()
+      self.decoders = {}
+
   def _readahead_thread(self):
     while True:
       self.readahead_c.acquire()
@@ -525,32 +745,84 @@ class GOPFrameReader(BaseFrameReader):
       num, pix_fmt = self.readahead_last
 
       if self.readbehind:
-        for k in range(num - 1, max(0, num - self.readahead_len), -1):
-          self._get_one(k, pix_fmt)
+        frames = range(num - 1, max(0, num - self.readahead_len), -1)
       else:
-        for k in range(num, min(self.frame_count, num + self.readahead_len)):
-          self._get_one(k, pix_fmt)
+        frames = range(num, min(self.frame_count, num + self.readahead_len))
 
-  def _get_one(self, num, pix_fmt):
-    assert num < self.frame_count
+      if self.pool is not None:
+        self.prefetch(frames, pix_fmt)
+      else:
+        for k in frames:
+          self._get_one(k, pix_fmt)
 
-    if (num, pix_fmt) in self.frame_cache:
-      return self.frame_cache[(num, pix_fmt)]
+  def prefetch(self, nums, pix_fmt="yuv420p"):
+    """Queues the GOPs holding frames nums on the decode pool without waiting for them"""
+    assert self.pool is not None
+    gops = []
+    for num in nums:
+      frame_b = self._lookup_gop(num)[0]
+      if frame_b not in gops and (num, pix_fmt) not in self.frame_cache:
+        gops.append(frame_b)
+    for frame_b in gops:
+      self._decode_gop(frame_b, pix_fmt)
+
+  def _load_gop(self, decoder_for, frame_b, pix_fmt):
+    frames = None
+    if self.disk_cache is not None:
+      frames = self.disk_cache.get(self.fn, pix_fmt, frame_b)
+
+    if frames is None:
+      frame_b, num_frames, skip_frames, rawdat = self.get_gop(frame_b)
+      frames = decoder_for(self.vid_fmt, self.w, self.h, pix_fmt).decode(rawdat, skip_frames + num_frames)
+      frames = frames[skip_frames:]
+      assert frames.shape[0] == num_frames
+      if self.disk_cache is not None:
+        self.disk_cache.put(self.fn, pix_fmt, frame_b, frames)
+
+    for i in range(frames.shape[0]):
+      self.frame_cache[(frame_b+i, pix_fmt)] = frames[i]
+    return frames
+
+  def _inline_decoder(self, vid_fmt, w, h, pix_fmt):
+    if pix_fmt not in self.decoders:
+      self.decoders[pix_fmt] = GOPDecoder(vid_fmt, w, h, pix_fmt)
+    return self.decoders[pix_fmt]
+
+  def _decode_gop(self, frame_b, pix_fmt):
+    key = (frame_b, pix_fmt)
+    with self.pending_lock:
+      future = self.pending.get(key)
+      if future is not None:
+        return future
+      if self.pool is not None:
+        future = self.pool.submit(self._load_gop, frame_b, pix_fmt)
+      else:
+        future = Future()
+      self.pending[key] = future
+    future.add_done_callback(lambda f: self._decode_done(key, f))
 
-    with self.cache_lock:
-      if (num, pix_fmt) in self.frame_cache:
-        return self.frame_cache[(num, pix_fmt)]
+    if self.pool is None:
+      try:
+        with self.cache_lock:
+          future.set_result(self._load_gop(self._inline_decoder, frame_b, pix_fmt))
+      except Exception as e:
+        future.set_exception(e)
+    return future
 
-      frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+  def _decode_done(self, key, future):
+    with self.pending_lock:
+      if self.pending.get(key) is future:
+        del self.pending[key]
 
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
-      ret = ret[skip_frames:]
-      assert ret.shape[0] == num_frames
+  def _get_one(self, num, pix_fmt):
+    assert num < self.frame_count
 
-      for i in range(ret.shape[0]):
-        self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
+    frame = self.frame_cache.get((num, pix_fmt))
+    if frame is not None:
+      return frame
 
-      return self.frame_cache[(num, pix_fmt)]
+    frame_b = self._lookup_gop(num)[0]
+    return self._decode_gop(frame_b, pix_fmt).result()[num - frame_b]
 
   def get(self, num, count=1, pix_fmt="yuv420p"):
     assert self.frame_count is not None
@@ -573,9 +845,9 @@ class GOPFrameReader(BaseFrameReader):
 
 
 class StreamFrameReader(StreamGOPReader, GOPFrameReader):
-  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False):
+  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False, workers=0, frame_cache=None):
     StreamGOPReader.__init__(self, fn, frame_type, index_data)
-    GOPFrameReader.__init__(self, readahead, readbehind)
+    GOPFrameReader.__init__(self, readahead, readbehind, workers, frame_cache)
 
 
 def GOPFrameIterator(gop_reader, pix_fmt):
@@ -2,13 +2,14 @@
 import os
 import sys
 import bz2
-import tempfile
-import subprocess
+import struct
 import urllib.parse
 import capnp
 import numpy as np
 
+from tools.lib.cache import cache_path_for_file_path
 from tools.lib.exceptions import DataUnreadableError
+from tools.lib.file_helpers import atomic_write_in_dir
 try:
   from xx.chffr.lib.filereader import FileReader
 except ImportError:
@@ -17,81 +18,152 @@ from cereal import log as capnp_log
 
 OP_PATH = os.path.dirname(os.path.dirname(capnp_log.__file__))
 
-def index_log(fn):
-  index_log_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "index_log")
-  index_log = os.path.join(index_log_dir, "index_log")
+READ_SIZE = 4 * 1024 * 1024
+INDEX_VERSION = 1
 
-  if not os.path.exists(index_log):
-    phonelibs_dir = os.path.join(OP_PATH, 'phonelibs')
-    subprocess.check_call(["make", "PHONELIBS=" + phonelibs_dir], cwd=index_log_dir, stdout=subprocess.DEVNULL)
+# Byte offsets of logMonoTime and the union tag in the data section of an Event,
+# so messages can be indexed without building capnp readers
+_EVENT_STRUCT = capnp_log.Event.schema.node.struct
+MONO_TIME_OFFSET = capnp_log.Event.schema.fields['logMonoTime'].proto.slot.offset * 8
+WHICH_OFFSET = _EVENT_STRUCT.discriminantOffset * 2
+UNION_TAGS = {f.name: f.discriminantValue for f in _EVENT_STRUCT.fields if f.discriminantValue != 0xffff}
+UNKNOWN_TAG = 0xffff
 
-  try:
-    dat = subprocess.check_output([index_log, fn, "-"])
-  except subprocess.CalledProcessError as e:
-    raise DataUnreadableError("%s capnp is corrupted/truncated" % fn) from e
-  return np.frombuffer(dat, dtype=np.uint64)
 
-def event_read_multiple_bytes(dat):
-  with tempfile.NamedTemporaryFile() as dat_f:
-    dat_f.write(dat)
-    dat_f.flush()
-    idx = index_log(dat_f.name)
+def message_size(dat, pos):
+  """Size of the capnp framed message starting at pos, None if dat ends before it does"""
+  if pos + 4 > len(dat):
+    return None
+  nseg = struct.unpack_from('<I', dat, pos)[0] + 1
+  header = (4 + 4 * nseg + 7) & ~7
+  if pos + header > len(dat):
+    return None
+  size = header + 8 * sum(struct.unpack_from('<%dI' % nseg, dat, pos + 4))
+  return size if pos + size <= len(dat) else None
+
+
+def message_header(dat, pos, size):
+  """(logMonoTime, union tag) of the Event message at pos, read straight from the root struct"""
+  nseg = struct.unpack_from('<I', dat, pos)[0] + 1
+  seg0 = pos + ((4 + 4 * nseg + 7) & ~7)
+  ptr = struct.unpack_from('<Q', dat, seg0)[0]
+  if ptr & 3 != 0:
+    # far pointer to the root struct, let capnp resolve it
+    evt = capnp_log.Event.from_bytes(bytes(dat[pos:pos + size]))
+    try:
+      return evt.logMonoTime, UNION_TAGS[str(evt.which())]
+    except capnp.lib.capnp.KjException:
+      return evt.logMonoTime, UNKNOWN_TAG
 
-  end_idx = np.uint64(len(dat))
-  idx = np.append(idx, end_idx)
+  offset = (ptr & 0xffffffff) >> 2
+  if offset >= 1 << 29:
+    offset -= 1 << 30
+  data = seg0 + 8 * (1 + offset)
+  data_size = 8 * ((ptr >> 32) & 0xffff)
 
-  return [capnp_log.Event.from_bytes(dat[idx[i]:idx[i+1]])
-          for i in range(len(idx)-1)]
+  # fields beyond the data section of older messages read as 0
+  mono_time = struct.unpack_from('<Q', dat, data + MONO_TIME_OFFSET)[0] if MONO_TIME_OFFSET + 8 <= data_size else 0
+  which = struct.unpack_from('<H', dat, data + WHICH_OFFSET)[0] if WHICH_OFFSET + 2 <= data_size else 0
+  return mono_time, which
+
+
+def message_boundaries(dat):
+  """Start offsets of all complete messages in dat followed by the end of the last one,
+  a truncated message at the end is dropped"""
+  offsets = [0]
+  while True:
+    size = message_size(dat, offsets[-1])
+    if size is None:
+      return offsets
+    offsets.append(offsets[-1] + size)
+
+
+def event_read_multiple_bytes(dat):
+  offsets = message_boundaries(dat)
+  return [capnp_log.Event.from_bytes(dat[offsets[i]:offsets[i+1]])
+          for i in range(len(offsets)-1)]
 
 
 # this is an iterator itself, and uses private variables from LogReader
 class MultiLogIterator(object):
-  def __init__(self, log_paths, wraparound=True):
+  """Iterates over the segment logs of a route.
+
+  Seeking bisects the logMonoTimes from the LogReader indexes. With services
+  only messages of these union types are decoded, all others are skipped by
+  their tag in the index."""
+  def __init__(self, log_paths, wraparound=True, services=None):
     self._log_paths = log_paths
     self._wraparound = wraparound
+    self._tags = None
+    if services is not None:
+      self._tags = np.array([UNION_TAGS[s] for s in services if s in UNION_TAGS], dtype=np.uint16)
 
     self._first_log_idx = next(i for i in range(len(log_paths)) if log_paths[i] is not None)
     self._current_log = self._first_log_idx
     self._idx = 0
     self._log_readers = [None]*len(log_paths)
-    self.start_time = self._log_reader(self._first_log_idx)._ts[0]
+    self._selections = [None]*len(log_paths)
+    self.start_time = int(self._log_reader(self._first_log_idx)._ts[0])
 
   def _log_reader(self, i):
     if self._log_readers[i] is None and self._log_paths[i] is not None:
       log_path = self._log_paths[i]
       print("LogReader:%s" % log_path)
       self._log_readers[i] = LogReader(log_path)
+      # messages are decoded by index, decompress the whole log and index it in one pass
+      self._log_readers[i]._data()
 
     return self._log_readers[i]
 
+  def _selection(self, i):
+    """Indexes of the messages of segment i that are iterated over, and a running
+    maximum of their times since start_time in seconds, which can be bisected"""
+    if self._selections[i] is None:
+      index = self._log_reader(i).index()
+      if self._tags is None:
+        msgs = np.arange(len(index))
+      else:
+        msgs = np.flatnonzero(np.isin(index.which, self._tags))
+      times = (index.mono_times[msgs].astype(np.int64) - self.start_time) * 1e-9
+      self._selections[i] = (msgs, np.maximum.accumulate(times) if len(times) else times)
+    return self._selections[i]
+
+  def _next_log(self, i):
+    # None at the end of the route without wraparound
+    i = next((j for j in range(i + 1, len(self._log_paths)) if self._log_paths[j] is not None), None)
+    if i is None and self._wraparound:
+      i = self._first_log_idx
+    return i
+
   def __iter__(self):
     return self
 
   def _inc(self):
-    lr = self._log_reader(self._current_log)
-    if self._idx < len(lr._ents)-1:
+    if self._idx < len(self._selection(self._current_log)[0])-1:
       self._idx += 1
     else:
       self._idx = 0
-      self._current_log = next(i for i in range(self._current_log + 1, len(self._log_readers) + 1)
-                               if i == len(self._log_readers) or self._log_paths[i] is not None)
-      # wraparound
-      if self._current_log == len(self._log_readers):
-        if self._wraparound:
-          self._current_log = self._first_log_idx
-        else:
-          raise StopIteration
+      self._current_log = self._next_log(self._current_log)
 
   def __next__(self):
-    while 1:
-      lr = self._log_reader(self._current_log)
-      ret = lr._ents[self._idx]
+    # skip segments without any of the requested services
+    for _ in range(len(self._log_paths) + 1):
+      if self._current_log is None:
+        raise StopIteration
+      msgs, _ = self._selection(self._current_log)
+      if len(msgs):
+        ret = self._log_reader(self._current_log)[int(msgs[self._idx])]
+        self._inc()
+        return ret
       self._inc()
-      return ret
+    raise StopIteration
 
   def tell(self):
     # returns seconds from start of log
-    return (self._log_reader(self._current_log)._ts[self._idx] - self.start_time) * 1e-9
+    msgs, _ = self._selection(self._current_log)
+    if not len(msgs):
+      return self._current_log * 60.
+    return (int(self._log_reader(self._current_log)._ts[msgs[self._idx]]) - self.start_time) * 1e-9
 
   def seek(self, ts):
     # seek to nearest minute
@@ -101,45 +173,194 @@ class MultiLogIterator(object):
 
     self._current_log = minute
 
-    # HACK: O(n) seek afterward
-    self._idx = 0
-    while self.tell() < ts:
-      self._inc()
+    # first message at or after ts, or the start of the next segment if there is none
+    msgs, times = self._selection(minute)
+    self._idx = int(np.searchsorted(times, ts, side='left'))
+    if self._idx >= len(msgs):
+      self._idx = 0
+      self._current_log = self._next_log(minute)
     return True
 
 
+class LogIndex(object):
+  """Offset, logMonoTime and union tag of every message in a decompressed log.
+
+  Stored next to the download cache so reopening a log skips the scan."""
+  def __init__(self, offsets, mono_times, which, size):
+    self.offsets = np.asarray(offsets, dtype=np.uint64)
+    self.mono_times = np.asarray(mono_times, dtype=np.uint64)
+    self.which = np.asarray(which, dtype=np.uint16)
+    self.size = size
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def message_range(self, i):
+    if i < 0:
+      i += len(self.offsets)
+    if not 0 <= i < len(self.offsets):
+      raise IndexError("message index out of range")
+    end = self.offsets[i+1] if i + 1 < len(self.offsets) else self.size
+    return int(self.offsets[i]), int(end)
+
+  @staticmethod
+  def cache_path(fn):
+    return cache_path_for_file_path(fn) + ".logindex.npz"
+
+  @staticmethod
+  def source_stamp(fn):
+    if urllib.parse.urlparse(fn).scheme in ("http", "https"):
+      return [INDEX_VERSION, 0, 0]
+    st = os.stat(fn)
+    return [INDEX_VERSION, st.st_size, st.st_mtime_ns]
+
+  @classmethod
+  def load(cls, fn):
+    try:
+      with np.load(cls.cache_path(fn)) as arrays:
+        if arrays['source'].tolist() != cls.source_stamp(fn):
+          return None
+        return cls(arrays['offsets'], arrays['mono_times'], arrays['which'], int(arrays['size']))
+    except (OSError, KeyError, ValueError):
+      return None
+
+  def save(self, fn):
+    try:
+      with atomic_write_in_dir(self.cache_path(fn), mode="wb", overwrite=True) as f:
+        np.savez(f, source=np.array(self.source_stamp(fn), dtype=np.int64), offsets=self.offsets,
+                 mono_times=self.mono_times, which=self.which, size=self.size)
+    except OSError:
+      pass
+
+
 class LogReader(object):
-  def __init__(self, fn, canonicalize=True, only_union_types=False):
+  """Reads the Events of an rlog/qlog.
+
+  Iterating streams the log: it is read and decompressed in READ_SIZE chunks
+  and every Event is only built when it is yielded, so memory use does not
+  depend on the log size. index() returns the message offsets, times and union
+  tags, they are collected during the first pass and cached on disk. Indexing
+  (len, []) keeps the decompressed log in memory and decodes single Events
+  on access."""
+  def __init__(self, fn, canonicalize=True, only_union_types=False, cache_index=True):
     data_version = None
     _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-    with FileReader(fn) as f:
-      dat = f.read()
-
-    if ext == "":
-      # old rlogs weren't bz2 compressed
-      ents = event_read_multiple_bytes(dat)
-    elif ext == ".bz2":
-      dat = bz2.decompress(dat)
-      ents = event_read_multiple_bytes(dat)
-    else:
+    # old rlogs weren't bz2 compressed
+    if ext not in ("", ".bz2"):
       raise Exception(f"unknown extension {ext}")
 
-    self._ts = [x.logMonoTime for x in ents]
+    self._fn = fn
+    self._compressed = ext == ".bz2"
+    self._cache_index = cache_index
+    self._index = LogIndex.load(fn) if cache_index else None
+    self._dat = None
     self.data_version = data_version
     self._only_union_types = only_union_types
-    self._ents = ents
+
+  def _chunks(self):
+    with FileReader(self._fn) as f:
+      length = f.get_length() if hasattr(f, "get_length") else None
+      pos = 0
+      decompressor = bz2.BZ2Decompressor() if self._compressed else None
+      while length is None or pos < length:
+        chunk = f.read(READ_SIZE if length is None else min(READ_SIZE, length - pos))
+        if not chunk:
+          break
+        pos += len(chunk)
+
+        if decompressor is None:
+          yield chunk
+          continue
+
+        # pbzip2 output is several concatenated streams
+        while chunk:
+          try:
+            yield decompressor.decompress(chunk)
+          except (OSError, EOFError) as e:
+            raise DataUnreadableError("%s bz2 is corrupted" % self._fn) from e
+          chunk = b""
+          if decompressor.eof:
+            chunk = decompressor.unused_data
+            decompressor = bz2.BZ2Decompressor()
+
+  def _messages(self):
+    """Yields (offset, message bytes) while decompressing, builds the index on the way"""
+    build_index = self._index is None
+    offsets, mono_times, which = [], [], []
+
+    buf = bytearray()
+    buf_offset = 0  # offset of buf in the decompressed log
+    for chunk in self._chunks():
+      buf += chunk
+      pos = 0
+      while True:
+        size = message_size(buf, pos)
+        if size is None:
+          break
+        if build_index:
+          mono_time, tag = message_header(buf, pos, size)
+          offsets.append(buf_offset + pos)
+          mono_times.append(mono_time)
+          which.append(tag)
+        yield buf_offset + pos, bytes(buf[pos:pos + size])
+        pos += size
+      del buf[:pos]
+      buf_offset += pos
+
+    if build_index:
+      self._index = LogIndex(offsets, mono_times, which, buf_offset)
+      if self._cache_index:
+        self._index.save(self._fn)
+
+  def _decode(self, dat):
+    ent = capnp_log.Event.from_bytes(dat)
+    if self._only_union_types:
+      try:
+        ent.which()
+      except capnp.lib.capnp.KjException:
+        return None
+    return ent
 
   def __iter__(self):
-    for ent in self._ents:
-      if self._only_union_types:
-        try:
-          ent.which()
-          yield ent
-        except capnp.lib.capnp.KjException:
-          pass
-      else:
+    for _, dat in self._messages():
+      ent = self._decode(dat)
+      if ent is not None:
         yield ent
 
+  def index(self):
+    if self._index is None:
+      for _ in self._messages():
+        pass
+    return self._index
+
+  def _data(self):
+    if self._dat is None:
+      self._dat = b"".join(self._chunks())
+      if self._index is None:
+        boundaries = message_boundaries(self._dat)
+        headers = [message_header(self._dat, start, end - start) for start, end in zip(boundaries, boundaries[1:])]
+        mono_times, which = zip(*headers) if len(headers) else ((), ())
+        self._index = LogIndex(boundaries[:-1], mono_times, which, boundaries[-1])
+        if self._cache_index:
+          self._index.save(self._fn)
+    return self._dat
+
+  def __len__(self):
+    return len(self.index())
+
+  def __getitem__(self, i):
+    dat = self._data()
+    start, end = self._index.message_range(i)
+    return capnp_log.Event.from_bytes(dat[start:end])
+
+  @property
+  def _ts(self):
+    return self.index().mono_times
+
+  @property
+  def _ents(self):
+    return self
+
 if __name__ == "__main__":
   log_path = sys.argv[1]
   lr = LogReader(log_path)
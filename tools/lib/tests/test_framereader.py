@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import gc
+import os
+import pickle
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+
+import numpy as np
+
+from tools.lib.framereader import FrameCache, GOPDecoder, RawData, decompress_video_data, \
+                                  read_video_index, write_video_index
+
+
+def encode_hevc(path, frames=10, w=64, h=48):
+  subprocess.check_call(["ffmpeg", "-loglevel", "quiet", "-y", "-f", "lavfi", "-i",
+                         "testsrc=size=%dx%d:rate=20" % (w, h), "-frames:v", str(frames),
+                         "-c:v", "libx265", "-x265-params", "log-level=none:bframes=0",
+                         "-f", "hevc", path])
+
+
+class TestVideoIndex(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.index_data = {
+      'index': np.array([[2, 0], [1, 100], [2, 250], [0xFFFFFFFF, 300]], dtype=np.uint32),
+      'global_prefix': b"\x00\x00\x00\x01prefix",
+      'probe': {'streams': [{'width': 1164, 'height': 874, 'codec_name': 'hevc'}]},
+    }
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_roundtrip(self):
+    path = os.path.join(self.tmpdir, "index")
+    with open(path, "wb") as f:
+      write_video_index(f, self.index_data)
+
+    index_data = read_video_index(path)
+    np.testing.assert_array_equal(index_data['index'], self.index_data['index'])
+    self.assertEqual(index_data['global_prefix'], self.index_data['global_prefix'])
+    self.assertEqual((index_data['width'], index_data['height']), (1164, 874))
+    self.assertEqual(index_data['probe'], self.index_data['probe'])
+
+  def test_pickled_index_is_rejected(self):
+    path = os.path.join(self.tmpdir, "index")
+    with open(path, "wb") as f:
+      pickle.dump(self.index_data, f, -1)
+    self.assertIsNone(read_video_index(path))
+
+    open(path, "wb").close()
+    self.assertIsNone(read_video_index(path))
+
+
+class TestRawData(unittest.TestCase):
+  def test_frames_are_views(self):
+    frames = [bytes([i]) * 16 for i in range(5)]
+    with tempfile.NamedTemporaryFile() as f:
+      f.write(b"".join(struct.pack("I", len(frame)) + frame for frame in frames))
+      f.flush()
+
+      raw = RawData(f.name)
+      self.assertEqual(raw.count, 5)
+      for i, frame in enumerate(frames):
+        self.assertEqual(raw.read(i).tobytes(), frame)
+      self.assertFalse(raw.read(3).flags.owndata)
+
+
+class TestFrameCache(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_roundtrip(self):
+    cache = FrameCache(self.tmpdir)
+    frames = np.arange(4 * 6, dtype=np.uint8).reshape(4, 6)
+    self.assertIsNone(cache.get("fcamera.hevc", "yuv420p", 0))
+
+    cache.put("fcamera.hevc", "yuv420p", 0, frames)
+    cached = cache.get("fcamera.hevc", "yuv420p", 0)
+    self.assertIsInstance(cached, np.memmap)
+    np.testing.assert_array_equal(cached, frames)
+    self.assertIsNone(cache.get("fcamera.hevc", "rgb24", 0))
+    self.assertIsNone(cache.get("fcamera.hevc", "yuv420p", 4))
+
+  def test_evicts_least_recently_used(self):
+    frames = np.zeros((4, 1024), dtype=np.uint8)
+    cache = FrameCache(self.tmpdir, max_bytes=3 * (frames.nbytes + 128))
+    for frame_b in range(3):
+      cache.put("fcamera.hevc", "yuv420p", frame_b, frames)
+      path = cache._path("fcamera.hevc", "yuv420p", frame_b)
+      os.utime(path, (frame_b, frame_b))
+
+    # reading a GOP makes it the most recently used one
+    self.assertIsNotNone(cache.get("fcamera.hevc", "yuv420p", 0))
+    cache.put("fcamera.hevc", "yuv420p", 3, frames)
+
+    self.assertIsNone(cache.get("fcamera.hevc", "yuv420p", 1))
+    for frame_b in (0, 2, 3):
+      self.assertIsNotNone(cache.get("fcamera.hevc", "yuv420p", frame_b))
+
+
+@unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not installed")
+class TestGOPDecoder(unittest.TestCase):
+  def test_matches_decompress(self):
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as f:
+      encode_hevc(f.name)
+      rawdat = f.read()
+
+    expected = decompress_video_data(rawdat, "hevc", 64, 48, "yuv420p")
+    dec = GOPDecoder("hevc", 64, 48, "yuv420p")
+    try:
+      # the same process is reused, every frame has to come out of each write
+      for _ in range(3):
+        np.testing.assert_array_equal(dec.decode(rawdat, expected.shape[0]), expected)
+        self.assertIsNotNone(dec.dec)
+    finally:
+      dec.close()
+
+  def test_killed_when_collected(self):
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as f:
+      encode_hevc(f.name)
+      rawdat = f.read()
+
+    dec = GOPDecoder("hevc", 64, 48, "yuv420p")
+    dec.decode(rawdat, 10)
+    proc = dec.dec.proc
+    del dec
+    gc.collect()
+    self.assertIsNotNone(proc.poll())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+import os
+import bz2
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from cereal import log as capnp_log
+import tools.lib.cache
+from tools.lib.logreader import LogReader, LogIndex, MultiLogIterator, UNION_TAGS, message_boundaries
+
+
+def make_log(n=300, t0=1000000, dt=10000000):
+  msgs = []
+  for i in range(n):
+    evt = capnp_log.Event.new_message()
+    # logs are only roughly sorted by time
+    evt.logMonoTime = t0 + (i + 2 * (i % 7 == 3)) * dt
+    if i % 3 == 0:
+      can = evt.init('can', 1 + i % 50)
+      for j, c in enumerate(can):
+        c.address = j
+        c.dat = bytes(8)
+    elif i % 3 == 1:
+      evt.init('carState').vEgo = i
+    else:
+      evt.init('controlsState').vCruise = i
+    msgs.append(evt.to_bytes())
+  return msgs
+
+
+class TestLogReader(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.cache_dir = mock.patch.object(tools.lib.cache, "DEFAULT_CACHE_DIR", os.path.join(self.tmp, "cache"))
+    self.cache_dir.start()
+
+    self.msgs = make_log()
+    self.dat = b"".join(self.msgs)
+    self.raw_fn = os.path.join(self.tmp, "rlog")
+    with open(self.raw_fn, "wb") as f:
+      f.write(self.dat)
+    # concatenated streams, like pbzip2 writes them
+    self.bz2_fn = os.path.join(self.tmp, "rlog.bz2")
+    with open(self.bz2_fn, "wb") as f:
+      half = len(self.msgs) // 2
+      f.write(bz2.compress(b"".join(self.msgs[:half])) + bz2.compress(b"".join(self.msgs[half:])))
+
+  def tearDown(self):
+    self.cache_dir.stop()
+    shutil.rmtree(self.tmp)
+
+  def _check(self, lr):
+    ents = list(lr)
+    self.assertEqual(len(ents), len(self.msgs))
+    for ent, dat in zip(ents, self.msgs):
+      self.assertEqual(ent.as_builder().to_bytes(), dat)
+
+  def test_streaming(self):
+    with mock.patch("tools.lib.logreader.READ_SIZE", 1000):
+      self._check(LogReader(self.raw_fn))
+      self._check(LogReader(self.bz2_fn))
+
+  def test_index(self):
+    idx = LogReader(self.bz2_fn).index()
+    expected = [capnp_log.Event.from_bytes(m) for m in self.msgs]
+    self.assertEqual(list(idx.offsets), message_boundaries(self.dat)[:-1])
+    self.assertEqual(list(idx.mono_times), [e.logMonoTime for e in expected])
+    self.assertEqual(list(idx.which), [UNION_TAGS[e.which()] for e in expected])
+
+  def test_index_cache(self):
+    list(LogReader(self.bz2_fn))
+    self.assertTrue(os.path.isfile(LogIndex.cache_path(self.bz2_fn)))
+
+    lr = LogReader(self.bz2_fn)
+    self.assertIsNotNone(lr._index)
+    self.assertEqual(len(lr), len(self.msgs))
+    self.assertEqual(lr[42].as_builder().to_bytes(), self.msgs[42])
+    self.assertEqual(lr[-1].as_builder().to_bytes(), self.msgs[-1])
+    self.assertEqual(lr[-len(self.msgs)].as_builder().to_bytes(), self.msgs[0])
+    with self.assertRaises(IndexError):
+      lr[len(self.msgs)]
+    with self.assertRaises(IndexError):
+      lr[-len(self.msgs) - 1]
+
+    # a changed file invalidates the cached index
+    with open(self.bz2_fn, "ab") as f:
+      f.write(bz2.compress(self.msgs[0]))
+    os.utime(self.bz2_fn, ns=(0, 0))
+    self.assertIsNone(LogReader(self.bz2_fn)._index)
+
+  def test_truncated(self):
+    with open(self.raw_fn, "wb") as f:
+      f.write(self.dat[:-10])
+    lr = LogReader(self.raw_fn)
+    self.assertEqual(len(list(lr)), len(self.msgs) - 1)
+    self.assertEqual(len(lr.index()), len(self.msgs) - 1)
+
+
+class TestMultiLogIterator(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.cache_dir = mock.patch.object(tools.lib.cache, "DEFAULT_CACHE_DIR", os.path.join(self.tmp, "cache"))
+    self.cache_dir.start()
+
+    self.log_paths = []
+    self.msgs = []
+    for seg in range(3):
+      msgs = [capnp_log.Event.from_bytes(m) for m in make_log(300, t0=seg * 60 * 10**9, dt=2 * 10**8)]
+      self.msgs += msgs
+      self.log_paths.append(os.path.join(self.tmp, "%d--rlog.bz2" % seg))
+      with open(self.log_paths[-1], "wb") as f:
+        f.write(bz2.compress(b"".join(m.as_builder().to_bytes() for m in msgs)))
+
+  def tearDown(self):
+    self.cache_dir.stop()
+    shutil.rmtree(self.tmp)
+
+  def test_iterate(self):
+    lr = MultiLogIterator(self.log_paths, wraparound=False)
+    self.assertEqual([m.logMonoTime for m in lr], [m.logMonoTime for m in self.msgs])
+
+  def test_seek(self):
+    lr = MultiLogIterator(self.log_paths, wraparound=False)
+    for ts in (0., 0.5, 7.3, 59.9, 60., 61.1, 130.):
+      self.assertTrue(lr.seek(ts))
+      # first message at or after ts, like walking the log
+      expected = next(m for m in self.msgs if m.logMonoTime * 1e-9 >= ts)
+      self.assertEqual(next(lr).logMonoTime, expected.logMonoTime)
+    self.assertFalse(lr.seek(200.))
+
+  def test_services(self):
+    lr = MultiLogIterator(self.log_paths, wraparound=False, services=['carState'])
+    self.assertEqual([m.logMonoTime for m in lr], [m.logMonoTime for m in self.msgs if m.which() == 'carState'])
+
+    lr = MultiLogIterator(self.log_paths, wraparound=True, services=['carState'])
+    lr.seek(100.)
+    msg = next(lr)
+    self.assertEqual(msg.which(), 'carState')
+    self.assertGreaterEqual(msg.logMonoTime * 1e-9, 100.)
+
+
+if __name__ == "__main__":
+  unittest.main()
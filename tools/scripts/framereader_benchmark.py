@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Frames/s of FrameReader with the different decode setups.
+
+per-gop decodes every GOP with its own ffmpeg like the reader used to, inline
+uses one persistent ffmpeg in the calling thread, workers=N a decode pool, and
+disk cache reads frames from a warm FrameCache."""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from tools.lib.framereader import FrameCache, FrameReader, decompress_video_data
+
+
+def per_gop_get(fr, pix_fmt):
+  gops = {}
+
+  def get(num):
+    frame_b = fr._lookup_gop(num)[0]
+    if frame_b not in gops:
+      frame_b, num_frames, skip_frames, rawdat = fr.get_gop(frame_b)
+      gops.clear()
+      gops[frame_b] = decompress_video_data(rawdat, fr.vid_fmt, fr.w, fr.h, pix_fmt)[skip_frames:]
+    return gops[frame_b][num - frame_b]
+  return get
+
+
+def run(get, frames, prefetch=None, window=0):
+  t = time.monotonic()
+  for i, num in enumerate(frames):
+    if prefetch is not None and i % window == 0:
+      prefetch(frames[i:i + 2 * window])
+    get(num)
+  return len(frames) / (time.monotonic() - t)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("video", help="hevc camera file")
+  parser.add_argument("--frames", type=int, default=600, help="frames read per run")
+  parser.add_argument("--workers", type=int, nargs='*', default=[2, 4])
+  parser.add_argument("--pix-fmt", default="yuv420p")
+  args = parser.parse_args()
+
+  probe = FrameReader(args.video)
+  count = min(args.frames, probe.frame_count)
+  # random access reads whole GOPs in a random order, like shuffled training samples
+  gop_starts = sorted({probe._lookup_gop(i)[0] for i in range(probe.frame_count)})
+  random.seed(0)
+  random.shuffle(gop_starts)
+  gop_len = probe.frame_count // len(gop_starts)
+  patterns = {
+    'sequential': list(range(count)),
+    'random': [b + i for b in gop_starts[:max(1, count // gop_len)] for i in range(gop_len) if b + i < probe.frame_count],
+  }
+  print("%s: %d frames %dx%d, %d GOPs" % (args.video, probe.frame_count, probe.w, probe.h, len(gop_starts)))
+
+  cache_dir = tempfile.mkdtemp()
+  try:
+    setups = [('per-gop', None), ('inline', {})]
+    setups += [('workers=%d' % n, {'workers': n}) for n in args.workers]
+    setups += [('disk cache', {'frame_cache': FrameCache(cache_dir)})]
+
+    # fill the disk cache so the last setup measures reads only
+    with FrameReader(args.video, frame_cache=FrameCache(cache_dir)) as fr:
+      for num in range(probe.frame_count):
+        fr.get(num, pix_fmt=args.pix_fmt)
+
+    for pattern, frames in patterns.items():
+      for name, kwargs in setups:
+        if kwargs is None:
+          fps = run(per_gop_get(probe, args.pix_fmt), frames)
+        else:
+          with FrameReader(args.video, **kwargs) as fr:
+            # with a pool the next GOPs in the access order are queued ahead
+            prefetch = (lambda nums: fr.prefetch(nums, args.pix_fmt)) if 'workers' in kwargs else None
+            fps = run(lambda num: fr.get(num, pix_fmt=args.pix_fmt)[0], frames, prefetch, gop_len * kwargs.get('workers', 1))
+        print("%12s %12s: %8.1f frames/s" % (pattern, name, fps))
+  finally:
+    probe.close()
+    shutil.rmtree(cache_dir)
+
+
+if __name__ == "__main__":
+  main()